@@ -1,3 +1,6 @@
 from .constants import *
+from .analysis import Cost
 from .compiler import Compiler, CompilerError
+from .optimizer import PASSES, Pass, PassStats
+from .targets import DEFAULT_TARGET, TARGETS, Target
 from .version import __version__
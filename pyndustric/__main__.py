@@ -4,6 +4,7 @@ import pyndustric
 import sys
 import time
 import inspect
+import math
 
 
 def create_args():
@@ -18,10 +19,71 @@ def create_args():
         action="store_true",
         help="copy the generated code to clipboard (requires `autoit`)",
     )
+    parser.add_argument(
+        "-O",
+        dest="opt_level",
+        type=int,
+        choices=range(4),
+        default=1,
+        metavar="LEVEL",
+        help="optimization level, from 0 (no optimizations) to 3 (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--target",
+        choices=pyndustric.TARGETS,
+        default=pyndustric.DEFAULT_TARGET,
+        help="kind of processor the code will run on (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--mlog",
+        dest="mlog_version",
+        type=int,
+        choices=(7, 8),
+        default=pyndustric.MLOG_VERSION,
+        metavar="VERSION",
+        help="version of Mindustry logic to generate code for, 7 or 8 (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--cost",
+        action="store_true",
+        help="print the most instructions and ticks the program, its functions and loops may take",
+    )
+    parser.add_argument(
+        "-v",
+        "--verbose",
+        action="store_true",
+        help="print how long each optimization pass took and how many instructions it saved",
+    )
 
     return parser
 
 
+def print_pass_stats(stats):
+    print(f"# {'pass':<20} {'time (ms)':>10} {'instructions':>13} {'delta':>6}", file=sys.stderr)
+    for stat in stats:
+        if stat.after is None:
+            count = delta = "-"
+        else:
+            count, delta = stat.after, f"{stat.after - stat.before:+}"
+        print(f"# {stat.name:<20} {stat.seconds * 1000:>10.2f} {count:>13} {delta:>6}", file=sys.stderr)
+
+
+def print_costs(costs, target):
+    print(f"# worst case on {target.name} processors ({target.ipt} instructions per tick)", file=sys.stderr)
+    print(f"# {'part':<20} {'line':>5} {'instructions':>13} {'ticks':>9} {'trips':>9}", file=sys.stderr)
+    for cost in costs:
+        part = f"{cost.kind} {cost.name}".strip()
+        if cost.instructions == math.inf:
+            count, ticks = "unbounded", "-"
+        else:
+            count, ticks = cost.instructions, f"{cost.instructions / target.ipt:.2f}"
+        if cost.kind != "loop":
+            trips = "-"
+        else:
+            trips = "unbounded" if cost.trips is None else cost.trips
+        print(f"# {part:<20} {cost.line:>5} {count:>13} {ticks:>9} {trips:>9}", file=sys.stderr)
+
+
 def main():
     parser = create_args()
     args = parser.parse_args()
@@ -37,7 +99,10 @@ def main():
         print(f"# compiling {file}...", file=sys.stderr)
         start = time.time()
         try:
-            masm = pyndustric.Compiler().compile(source)
+            compiler = pyndustric.Compiler(
+                opt_level=args.opt_level, mlog_version=args.mlog_version, target=args.target
+            )
+            masm = compiler.compile(source)
         except pyndustric.CompilerError as e:
             trace = inspect.trace()[-1]
             print(f"[{trace.lineno}@{trace.function}]{str(e)}")
@@ -45,6 +110,10 @@ def main():
             sys.exit(1)
         complete_masm += masm
         took = time.time() - start
+        if args.verbose:
+            print_pass_stats(compiler.pass_stats)
+        if args.cost:
+            print_costs(compiler.costs(), compiler.target)
         print(masm)
         print(
             f"# compiled {file} with pyndustric {pyndustric.__version__} in {took:.2f}s",
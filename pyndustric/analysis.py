@@ -0,0 +1,759 @@
+"""
+Control-flow graph and dataflow analyses over the compiler's instruction list.
+
+The graph follows mlog's execution model. Every program implicitly ends with `end`, which wraps
+around to the first instruction while keeping all variables, so falling off the end of the
+program (or running into an explicit `end`) is an edge back to the entry block.
+
+Jump tables have an edge to each of their labels.
+
+Function calls are `jump` instructions preceded by an instruction capturing `@counter`, and
+functions return by writing `@counter`. Both are modelled as edges: a call goes to the function's
+prologue, and each return goes back to the instruction after every call to that function.
+"""
+
+from .ir import _Instruction, _Jump, _JumpTable, _Label, _Literal, _Variable, _number
+from collections import deque
+from dataclasses import dataclass
+from typing import Optional
+import math
+
+_COUNTER = "@counter"
+
+
+class BasicBlock:
+    """
+    A maximal sequence of instructions which always execute together, from first to last.
+
+    `start` and `end` delimit the instructions of the block in the analysed list. Labels are
+    kept at the start of the block they point to.
+    """
+
+    __slots__ = ("index", "start", "end", "instructions", "successors", "predecessors")
+
+    def __init__(self, index: int, start: int, instructions: list):
+        self.index = index
+        self.start = start
+        self.end = start + len(instructions)
+        self.instructions = instructions
+        self.successors = []
+        self.predecessors = []
+
+    @property
+    def last(self):
+        """
+        The last instruction of the block which is not a label, if any.
+        """
+        for ins in reversed(self.instructions):
+            if not isinstance(ins, _Label):
+                return ins
+        return None
+
+    def __repr__(self):
+        return f"BasicBlock({self.index}, {self.start}..{self.end})"
+
+
+def _is_call(instructions: list, i: int) -> bool:
+    ins = instructions[i]
+    return (
+        isinstance(ins, _Jump)
+        and ins.condition == "always"
+        and i > 0
+        and _COUNTER in instructions[i - 1].args
+        and _COUNTER not in instructions[i - 1].outputs
+    )
+
+
+def _is_indirect(ins: _Instruction) -> bool:
+    return not isinstance(ins, _Jump) and _COUNTER in ins.outputs
+
+
+class ControlFlowGraph:
+    """
+    Splits a list of instructions into basic blocks connected by the edges control can follow.
+    """
+
+    def __init__(self, instructions: list):
+        self.instructions = instructions
+        self.blocks = []
+        self.label_blocks = {}  # label -> block it starts
+        self.calls = {}  # block ending in a call -> block of the called function's prologue
+
+        self._split()
+        self._connect()
+
+    @property
+    def entry(self) -> BasicBlock:
+        return self.blocks[0]
+
+    def _split(self):
+        start = 0
+        empty = True  # whether the current block only has labels so far
+        for i, ins in enumerate(self.instructions):
+            if isinstance(ins, _Label):
+                # Consecutive labels point to the same block.
+                if not empty:
+                    self._add_block(start, i)
+                    start = i
+                    empty = True
+            elif isinstance(ins, (_Jump, _JumpTable)) or ins.op == "end" or _is_indirect(ins):
+                self._add_block(start, i + 1)
+                start = i + 1
+                empty = True
+            else:
+                empty = False
+
+        if start < len(self.instructions) or not self.blocks:
+            self._add_block(start, len(self.instructions))
+
+    def _add_block(self, start: int, end: int):
+        block = BasicBlock(len(self.blocks), start, self.instructions[start:end])
+        self.blocks.append(block)
+        for ins in block.instructions:
+            if not isinstance(ins, _Label):
+                break
+            self.label_blocks[ins] = block
+
+    def _next(self, block: BasicBlock) -> BasicBlock:
+        # Falling off the end of the program wraps around to the start.
+        return self.blocks[block.index + 1] if block.index + 1 < len(self.blocks) else self.entry
+
+    def _connect(self):
+        returns = []
+        return_points = {}  # prologue block -> blocks right after calls to it
+        for block in self.blocks:
+            ins = block.last
+            if isinstance(ins, _Jump):
+                target = self.label_blocks[ins.label]
+                if _is_call(self.instructions, block.end - 1):
+                    self.calls[block] = target
+                    return_points.setdefault(target, []).append(self._next(block))
+                    self._edge(block, target)
+                else:
+                    self._edge(block, target)
+                    if ins.condition != "always":
+                        self._edge(block, self._next(block))
+            elif isinstance(ins, _JumpTable):
+                for label in ins.labels:
+                    self._edge(block, self.label_blocks[label])
+            elif ins is not None and ins.op == "end":
+                self._edge(block, self.entry)
+            elif ins is not None and _is_indirect(ins):
+                returns.append(block)
+            else:
+                self._edge(block, self._next(block))
+
+        # Returns go back to the callers of the function they belong to. If the function can't be
+        # determined, assume they can return to any call.
+        owners = {}
+        for prologue in return_points:
+            for block in self._function_body(prologue):
+                owners.setdefault(block, []).append(prologue)
+
+        every_point = [point for points in return_points.values() for point in points]
+        for block in returns:
+            points = [point for prologue in owners.get(block, ()) for point in return_points[prologue]]
+            for point in points or every_point:
+                self._edge(block, point)
+
+    def _function_body(self, prologue: BasicBlock) -> list:
+        # Blocks reachable from the prologue without entering other functions or following returns.
+        seen = {prologue}
+        stack = [prologue]
+        while stack:
+            block = stack.pop()
+            if block in self.calls:
+                nexts = [self._next(block)]
+            else:
+                nexts = block.successors
+            for succ in nexts:
+                if succ not in seen:
+                    seen.add(succ)
+                    stack.append(succ)
+        return list(seen)
+
+    def _edge(self, source: BasicBlock, target: BasicBlock):
+        if target not in source.successors:
+            source.successors.append(target)
+            target.predecessors.append(source)
+
+    def reverse_postorder(self) -> list:
+        """
+        Blocks reachable from the entry, ordered so that (ignoring back edges) every block comes
+        before its successors.
+        """
+        order = []
+        seen = {self.entry}
+        stack = [(self.entry, iter(self.entry.successors))]
+        while stack:
+            block, succs = stack[-1]
+            for succ in succs:
+                if succ not in seen:
+                    seen.add(succ)
+                    stack.append((succ, iter(succ.successors)))
+                    break
+            else:
+                stack.pop()
+                order.append(block)
+
+        order.reverse()
+        return order
+
+
+def _variables(operands) -> set:
+    return {arg for arg in operands if isinstance(arg, _Variable)}
+
+
+def reaching_definitions(cfg: ControlFlowGraph) -> list:
+    """
+    Computes, for every block, the set of definitions which may reach its start.
+
+    A definition is the index (in `cfg.instructions`) of an instruction writing a variable.
+    Variables are never undefined in mlog (they start as `null`), which is represented by the
+    absence of any definition for it.
+    """
+    defs_of = {}  # variable -> indices of the instructions writing it
+    for i, ins in enumerate(cfg.instructions):
+        for var in _variables(ins.outputs):
+            defs_of.setdefault(var, set()).add(i)
+
+    gen = []
+    kill = []
+    for block in cfg.blocks:
+        block_gen = {}
+        for i in range(block.start, block.end):
+            for var in _variables(cfg.instructions[i].outputs):
+                block_gen[var] = i
+
+        gen.append(set(block_gen.values()))
+        kill.append(set().union(*(defs_of[var] for var in block_gen)))
+
+    reach_in = [set() for _ in cfg.blocks]
+    reach_out = [set(g) for g in gen]
+    worklist = deque(cfg.reverse_postorder())
+    pending = set(worklist)
+    while worklist:
+        block = worklist.popleft()
+        pending.discard(block)
+        reach_in[block.index] = set().union(*(reach_out[pred.index] for pred in block.predecessors))
+        out = gen[block.index] | (reach_in[block.index] - kill[block.index])
+        if out != reach_out[block.index]:
+            reach_out[block.index] = out
+            for succ in block.successors:
+                if succ not in pending:
+                    pending.add(succ)
+                    worklist.append(succ)
+
+    return reach_in
+
+
+# How much is known about a number: nothing, that it's an integer, or a non-negative integer.
+_UNKNOWN, _INTEGER, _NATURAL = range(3)
+
+# How many times the bound of a definition may grow before it's considered unbounded.
+_BOUND_ROUNDS = 3
+
+# Operations which always result in an integer (0 or 1, for comparisons).
+_INTEGER_OPS = {"idiv", "shl", "shr", "or", "and", "xor", "flip", "floor", "ceil"}
+_COMPARISON_OPS = {
+    "equal",
+    "notEqual",
+    "land",
+    "lessThan",
+    "lessThanEq",
+    "greaterThan",
+    "greaterThanEq",
+    "strictEqual",
+}
+
+
+def _operation_kind(mode: str, a: int, b: int) -> int:
+    # What is known about the result of `op mode`, given what's known about its operands.
+    if mode in _COMPARISON_OPS:
+        return _NATURAL
+    elif mode in ("add", "mul", "max"):
+        return min(a, b) if mode != "max" or min(a, b) == _UNKNOWN else max(a, b)
+    elif mode in ("sub", "min"):
+        return min(a, b, _INTEGER if mode == "sub" else _NATURAL)
+    elif mode == "mod":
+        return a if b != _UNKNOWN else _UNKNOWN
+    elif mode == "abs":
+        return _NATURAL if a != _UNKNOWN else _UNKNOWN
+    elif mode in ("shr", "floor", "ceil", "idiv"):
+        return _NATURAL if a == _NATURAL and (mode != "idiv" or b == _NATURAL) else _INTEGER
+    elif mode == "and":
+        return _NATURAL if _NATURAL in (a, b) else _INTEGER
+    elif mode in ("or", "xor"):
+        return _NATURAL if a == b == _NATURAL else _INTEGER
+    elif mode in _INTEGER_OPS:
+        return _INTEGER
+    return _UNKNOWN
+
+
+def _operation_bound(mode: str, a: float, b: float, divisor) -> float:
+    # The most the absolute value of the result of `op mode` can be, given its operands' (and the
+    # constant second operand, if any).
+    if mode in _COMPARISON_OPS:
+        return 1
+    elif mode in ("add", "sub"):
+        return a + b
+    elif mode == "mul":
+        return a * b
+    elif mode in ("max", "min"):
+        return max(a, b)
+    elif mode in ("abs", "rand"):
+        return a
+    elif mode == "mod":
+        return min(a, b)
+    elif mode in ("floor", "ceil", "flip"):
+        return a + 1
+    elif mode == "idiv":
+        # Dividing by anything smaller than 1 (like zero) may make it larger.
+        return a if divisor is not None and abs(divisor) >= 1 else math.inf
+    elif mode in ("shl", "shr"):
+        # Only shifting right by a known amount can't make it larger.
+        if divisor is None or divisor < 0 or not float(divisor).is_integer():
+            return math.inf
+        return a if mode == "shr" else a * 2 ** min(divisor, 64)
+    elif mode in ("and", "or", "xor"):
+        return 2 * max(a, b)
+    return math.inf
+
+
+def integer_variables(cfg: ControlFlowGraph) -> list:
+    """
+    Computes, for every instruction, which of the variables it reads certainly hold an integer.
+
+    They are stored as a dictionary from the variable to `(natural, bound)`: whether it's also
+    never negative, and the most its absolute value can be (`math.inf` if it's not known). Bitwise
+    operations work on 64-bit integers, so they only match the arithmetic ones for bounded values.
+    Variables which nothing writes to before being read are not known to be anything.
+    """
+    instructions = cfg.instructions
+    reach_in = reaching_definitions(cfg)
+
+    # The definitions of every variable read by each instruction.
+    reaching = [{} for _ in instructions]
+    for block in cfg.blocks:
+        current = {}
+        for i in reach_in[block.index]:
+            for var in _variables(instructions[i].outputs):
+                current.setdefault(var, set()).add(i)
+        for i in range(block.start, block.end):
+            ins = instructions[i]
+            reaching[i] = {var: current.get(var, set()) for var in _variables(ins.inputs)}
+            for var in _variables(ins.outputs):
+                current[var] = {i}
+
+    def operand_kind(i, arg):
+        if isinstance(arg, _Variable):
+            defs = reaching[i].get(arg)
+            if not defs:
+                return _UNKNOWN, math.inf
+            return min(kinds[d] for d in defs), max(bounds[d] for d in defs)
+        value = _number(arg)
+        if value is None or not float(value).is_integer():
+            return _UNKNOWN, math.inf if value is None else abs(value)
+        return _NATURAL if value >= 0 else _INTEGER, abs(value)
+
+    # Start assuming every definition is a natural number as small as can be, and correct it until
+    # nothing changes. Bounds which keep growing (as in loops) are given up on after a few rounds.
+    definitions = [i for i, ins in enumerate(instructions) if _variables(ins.outputs)]
+    kinds = {i: _NATURAL for i in definitions}
+    bounds = {i: 0 for i in definitions}
+    growth = {i: 0 for i in definitions}
+    changed = True
+    while changed:
+        changed = False
+        for i in definitions:
+            ins = instructions[i]
+            if ins.op == "set":
+                kind, bound = operand_kind(i, ins.args[1])
+            elif ins.op == "op" and len(ins.args) >= 3:
+                operands = (ins.args[2:4] + [None])[:2]
+                (a, a_bound), (b, b_bound) = (operand_kind(i, arg) for arg in operands)
+                kind = _operation_kind(ins.mode, a, b)
+                bound = _operation_bound(ins.mode, a_bound, b_bound, _number(operands[1]))
+                if ins.mode == "and" and _NATURAL in (a, b):
+                    # Masking with a non-negative number can only clear bits of it.
+                    bound = min(bound for kind, bound in ((a, a_bound), (b, b_bound)) if kind == _NATURAL)
+            else:
+                kind, bound = _UNKNOWN, math.inf
+
+            if kind < kinds[i]:
+                kinds[i] = kind
+                changed = True
+            if bound > bounds[i]:
+                growth[i] += 1
+                bounds[i] = bound if growth[i] < _BOUND_ROUNDS else math.inf
+                changed = True
+
+    result = []
+    for i, ins in enumerate(instructions):
+        known = {}
+        for var in _variables(ins.inputs):
+            kind, bound = operand_kind(i, var)
+            if kind != _UNKNOWN:
+                known[var] = (kind == _NATURAL, bound)
+        result.append(known)
+    return result
+
+
+def copy_transfer(copies: dict, ins: _Instruction):
+    """
+    Updates the available `copies` (see `available_copies`) after the instruction executes.
+    """
+    for var in ins.outputs:
+        copies.pop(var, None)
+        for dst in [dst for dst, src in copies.items() if src == var]:
+            del copies[dst]
+
+    if ins.op == "set" and len(ins.args) == 2 and isinstance(ins.args[0], _Variable):
+        dst, src = ins.args
+        src = copies.get(src, src)
+        if isinstance(src, (_Variable, _Literal)) and src != dst:
+            copies[dst] = src
+
+
+def available_copies(cfg: ControlFlowGraph) -> list:
+    """
+    Computes, for every block, the copies which hold at its start no matter how it's reached.
+
+    Copies are stored as a dictionary from variable to the literal or other variable it's
+    certainly equal to, because of an earlier `set`. Unreachable blocks have `None` instead.
+    """
+    copies_in = [None for _ in cfg.blocks]
+    copies_out = [None for _ in cfg.blocks]
+    # The program may start running from scratch, so nothing is known at the entry.
+    copies_in[cfg.entry.index] = {}
+
+    worklist = deque(cfg.reverse_postorder())
+    pending = set(worklist)
+    while worklist:
+        block = worklist.popleft()
+        pending.discard(block)
+        if block is not cfg.entry:
+            copies = None
+            for pred in block.predecessors:
+                out = copies_out[pred.index]
+                if out is None:
+                    continue
+                elif copies is None:
+                    copies = dict(out)
+                else:
+                    copies = {dst: src for dst, src in copies.items() if out.get(dst) == src}
+            copies_in[block.index] = copies
+
+        copies = dict(copies_in[block.index])
+        for ins in block.instructions:
+            copy_transfer(copies, ins)
+
+        if copies != copies_out[block.index]:
+            copies_out[block.index] = copies
+            for succ in block.successors:
+                if succ not in pending:
+                    pending.add(succ)
+                    worklist.append(succ)
+
+    return copies_in
+
+
+class Liveness:
+    """
+    Computes which variables may be read before being written again at each point of the program.
+    """
+
+    def __init__(self, cfg: ControlFlowGraph):
+        self.cfg = cfg
+        self.live_in = [set() for _ in cfg.blocks]
+        self.live_out = [set() for _ in cfg.blocks]
+
+        uses = []
+        defs = []
+        for block in cfg.blocks:
+            block_uses = set()
+            block_defs = set()
+            for ins in block.instructions:
+                block_uses |= _variables(ins.inputs) - block_defs
+                block_defs |= _variables(ins.outputs)
+            uses.append(block_uses)
+            defs.append(block_defs)
+
+        worklist = deque(reversed(cfg.reverse_postorder()))
+        # Unreachable blocks are still analysed, so that passes can safely query them.
+        pending = set(worklist)
+        worklist.extend(block for block in cfg.blocks if block not in pending)
+        pending.update(cfg.blocks)
+        while worklist:
+            block = worklist.popleft()
+            pending.discard(block)
+            out = set().union(*(self.live_in[succ.index] for succ in block.successors))
+            self.live_out[block.index] = out
+            live = uses[block.index] | (out - defs[block.index])
+            if live != self.live_in[block.index]:
+                self.live_in[block.index] = live
+                for pred in block.predecessors:
+                    if pred not in pending:
+                        pending.add(pred)
+                        worklist.append(pred)
+
+    def live_after(self, block: BasicBlock) -> list:
+        """
+        For each instruction in the block, the variables live right after it executes.
+        """
+        live = set(self.live_out[block.index])
+        result = []
+        for ins in reversed(block.instructions):
+            result.append(set(live))
+            live -= _variables(ins.outputs)
+            live |= _variables(ins.inputs)
+        result.reverse()
+        return result
+
+
+class Dominators:
+    """
+    Computes the immediate dominator of every block reachable from the entry.
+
+    A block dominates another if every path from the entry to the latter goes through the former.
+    """
+
+    def __init__(self, cfg: ControlFlowGraph):
+        self.cfg = cfg
+        order = cfg.reverse_postorder()
+        position = {block: i for i, block in enumerate(order)}
+        idom = {cfg.entry: cfg.entry}
+
+        def intersect(a, b):
+            while a is not b:
+                while position[a] > position[b]:
+                    a = idom[a]
+                while position[b] > position[a]:
+                    b = idom[b]
+            return a
+
+        changed = True
+        while changed:
+            changed = False
+            for block in order[1:]:
+                preds = [pred for pred in block.predecessors if pred in idom]
+                new = preds[0]
+                for pred in preds[1:]:
+                    new = intersect(pred, new)
+                if idom.get(block) is not new:
+                    idom[block] = new
+                    changed = True
+
+        self.idom = idom
+
+    def dominates(self, a: BasicBlock, b: BasicBlock) -> bool:
+        """
+        Whether `a` dominates `b`. Unreachable blocks are dominated by nothing.
+        """
+        if b not in self.idom:
+            return False
+
+        while b is not a:
+            if b is self.cfg.entry:
+                return False
+            b = self.idom[b]
+        return True
+
+
+def natural_loops(cfg: ControlFlowGraph, dominators: Dominators) -> list:
+    """
+    Finds the loops of the program, as `(header, blocks)` pairs, innermost first.
+
+    A back edge goes to a block (the header) dominating its source. The blocks of the loop are
+    those dominated by the header which can reach a back edge without going through the header.
+    Loops sharing a header are merged, and wrapping around to the entry is not considered a loop.
+    """
+    loops = {}
+    for block in cfg.blocks:
+        for header in block.successors:
+            if header is cfg.entry or not dominators.dominates(header, block):
+                continue
+
+            blocks = loops.setdefault(header, {header})
+            stack = [block]
+            while stack:
+                pred = stack.pop()
+                if pred not in blocks and dominators.dominates(header, pred):
+                    blocks.add(pred)
+                    stack.extend(pred.predecessors)
+
+    return sorted(loops.items(), key=lambda loop: len(loop[1]))
+
+
+# Conditions under which a loop keeps going, for the jump back to its start.
+_LOOP_CONDITIONS = {"lessThan", "lessThanEq", "greaterThan", "greaterThanEq", "notEqual"}
+
+
+def _trip_count(cfg: ControlFlowGraph, header: BasicBlock, blocks: set, reaching: list, dominators):
+    """
+    How many times the loop runs once entered, if it's counted: it jumps back while a variable
+    compares to a constant, the variable starts as a constant, and every iteration adds constants
+    to it. Otherwise (or if it never stops), returns `None`.
+    """
+    latches = [block for block in header.predecessors if block in blocks]
+    ins = latches[0].last if len(latches) == 1 else None
+    if not isinstance(ins, _Jump) or ins.condition not in _LOOP_CONDITIONS:
+        return None
+
+    var, bound = ins.args[1], _number(ins.args[2])
+    if not isinstance(var, _Variable) or bound is None:
+        return None
+
+    step = 0
+    for block in blocks:
+        for written in block.instructions:
+            if var not in written.outputs:
+                continue
+            if (
+                written.op != "op"
+                or written.mode not in ("add", "sub")
+                or written.args[2] != var
+                or _number(written.args[3]) is None
+                or not dominators.dominates(block, latches[0])
+            ):
+                return None
+            step += _number(written.args[3]) * (1 if written.mode == "add" else -1)
+
+    inside = {i for block in blocks for i in range(block.start, block.end)}
+    starts = [i for i in reaching[header.index] if i not in inside and var in cfg.instructions[i].outputs]
+    if len(starts) != 1 or cfg.instructions[starts[0]].op != "set":
+        return None
+    start = _number(cfg.instructions[starts[0]].args[1])
+    if start is None or step == 0:
+        return None
+
+    # The body runs once before the condition is first checked.
+    distance = (bound - start) / step
+    if ins.condition == "notEqual":
+        return max(int(distance), 1) if distance.is_integer() and distance > 0 else None
+    if (step > 0) != (ins.condition in ("lessThan", "lessThanEq")):
+        return None
+    if ins.condition in ("lessThanEq", "greaterThanEq"):
+        return max(math.floor(distance) + 1, 1)
+    return max(math.ceil(distance), 1)
+
+
+@dataclass
+class Cost:
+    """
+    The most instructions a part of the program may run (`math.inf` if there's no limit).
+
+    `line` is where the part starts in the generated code. For loops, `instructions` is the cost
+    of a single iteration, and `trips` how many iterations there are, if known.
+    """
+
+    kind: str  # "program", "function" or "loop"
+    name: str
+    line: int
+    instructions: float
+    trips: Optional[int] = None
+
+
+class WorstCase:
+    """
+    Computes the most instructions some parts of the program may run: one pass from the top of
+    the program to its end, one call of each function, and one iteration of each loop.
+
+    `cost` tells how many instructions running each instruction takes. Loops count as all their
+    iterations when their trip count is known, and as unbounded otherwise, as do recursive
+    functions. Unbounded costs are `math.inf`.
+    """
+
+    def __init__(self, cfg: ControlFlowGraph, cost):
+        self.cfg = cfg
+        dominators = Dominators(cfg)
+        reaching = reaching_definitions(cfg)
+        # Calls and returns are edges too, so calling a function twice makes a cycle: only the loops
+        # which can go around while stepping over calls are kept.
+        self.loops = {
+            header: blocks
+            for header, blocks in natural_loops(cfg, dominators)
+            if self._goes_around(header, blocks)
+        }  # header -> blocks of the loop
+        self.trips = {
+            header: _trip_count(cfg, header, blocks, reaching, dominators)
+            for header, blocks in self.loops.items()
+        }
+        self._block_costs = [sum(map(cost, block.instructions)) for block in cfg.blocks]
+        self._iterations = {}
+        self._calls = {}
+
+    @property
+    def program(self) -> float:
+        """
+        The most instructions run from the top of the program until it ends or wraps around.
+        """
+        return self._longest(self.cfg.entry, None, None)
+
+    def call(self, prologue: BasicBlock) -> float:
+        """
+        The most instructions run by a call to the function starting at the given block.
+        """
+        if prologue not in self._calls:
+            self._calls[prologue] = math.inf  # until known, so that recursion is unbounded
+            self._calls[prologue] = self._longest(prologue, None, None)
+        return self._calls[prologue]
+
+    def iteration(self, header: BasicBlock) -> float:
+        """
+        The most instructions run by an iteration of the loop starting at the given block.
+        """
+        if header not in self._iterations:
+            self._iterations[header] = math.inf
+            self._iterations[header] = self._longest(header, self.loops[header], header)
+        return self._iterations[header]
+
+    def _flow(self, block: BasicBlock) -> list:
+        # The blocks which may run next within the same call, stepping over the calls made.
+        if block in self.cfg.calls:
+            return [self.cfg._next(block)]
+
+        ins = block.last
+        if ins is not None and (ins.op == "end" or _is_indirect(ins)):
+            return []
+        return [succ for succ in block.successors if succ is not self.cfg.entry]
+
+    def _goes_around(self, header: BasicBlock, blocks: set) -> bool:
+        seen = set()
+        stack = [header]
+        while stack:
+            for succ in self._flow(stack.pop()):
+                if succ is header:
+                    return True
+                if succ in blocks and succ not in seen:
+                    seen.add(succ)
+                    stack.append(succ)
+        return False
+
+    def _longest(self, start: BasicBlock, inside, header) -> float:
+        # The most instructions run from `start` until leaving the blocks `inside` (if given),
+        # going back to `header`, returning or reaching the end of the program. Loops other than
+        # the one of `header` count as a whole.
+        longest = {}
+
+        def visit(block):
+            if block in longest:
+                return longest[block]
+
+            longest[block] = math.inf  # a cycle which is not a loop
+            loop = self.loops.get(block) if block is not header else None
+            if loop is not None:
+                trips = self.trips[block]
+                cost = math.inf if trips is None else trips * self.iteration(block)
+                nexts = {succ for inner in loop for succ in self._flow(inner) if succ not in loop}
+            else:
+                nexts = self._flow(block)
+                cost = self._block_costs[block.index]
+                if block in self.cfg.calls:
+                    cost += self.call(self.cfg.calls[block])
+
+            nexts = [succ for succ in nexts if succ is not header and (inside is None or succ in inside)]
+            longest[block] = cost + max(map(visit, nexts), default=0)
+            return longest[block]
+
+        return visit(start)
@@ -1,61 +1,20 @@
-from re import sub
-
 from .constants import *
+from .analysis import ControlFlowGraph, Cost, WorstCase
+from .ir import _Builtin, _Instruction, _Jump, _JumpTable, _Label, _Literal, _Variable
+from .ir import _evaluate, _number, _number_literal, _operand, _size, _truthy
+from .optimizer import PASSES, PassStats
+from .targets import DEFAULT_TARGET, TARGETS, Target
 from dataclasses import dataclass
 from pathlib import Path
 from typing import Callable, Union
 from string import hexdigits
+from time import perf_counter
 import ast
 import inspect
 import sys
 import textwrap
 
 
-class _Instruction:
-    """
-    Represents a mlog instruction.
-    """
-
-    def __init__(self, ins: str):
-        self._ins = ins
-
-    def __str__(self):
-        return self._ins
-
-
-class _Label(_Instruction):
-    """
-    Represents a no-op instruction used to label certain destinations for mlog jumps.
-    """
-
-    def __init__(self):
-        super().__init__("")
-        self._lineno = None
-
-    def __str__(self):
-        if self._lineno is None:
-            raise CompilerError(
-                INTERNAL_COMPILER_ERR,
-                None,
-                "lineno should be set. some instruction likely referenced this unstored label",
-            )
-
-        return str(self._lineno)
-
-
-class _Jump(_Instruction):
-    """
-    Represents a jump instruction towards a specific label.
-    """
-
-    def __init__(self, label: _Label, condition: str):
-        super().__init__(f"jump {{}} {condition}")
-        self._label = label
-
-    def __str__(self):
-        return super().__str__().format(self._label)
-
-
 @dataclass
 class Function:
     """
@@ -64,6 +23,12 @@ class Function:
 
     start: _Label  # label pointing to the function's prologue
     argc: int  # count of number of arguments the function takes
+    params: list  # variables the arguments are passed in
+    ret_counter: str  # variable holding the address to return to
+    recursive: bool  # whether the function calls itself
+    saved: list = None  # variables saved to the stack around recursive calls
+    output: str = REG_RET  # variable the return value is written to
+    body: list = None  # statements of inline functions, copied to every call
 
 
 class CompilerError(ValueError):
@@ -77,6 +42,7 @@ class CompilerError(ValueError):
             ERR_UNSUPPORTED_EXPR,
             ERR_UNSUPPORTED_SYSCALL,
             ERR_BAD_SYSCALL_ARGS,
+            ERR_UNSUPPORTED_PATTERN,
         ]:
             context["unparsed"] = ast.unparse(node)
         super().__init__(
@@ -105,8 +71,38 @@ class CompatTransformer(ast.NodeTransformer):
             return ast.copy_location(ast.Constant(value=node.value), node)
 
 
+class LocalsTransformer(ast.NodeTransformer):
+    """
+    Renames the local variables of a function, so that they can't clobber the caller's.
+
+    Like in Python, variables assigned within the function are local unless declared `global`.
+    """
+
+    def __init__(self, function: ast.FunctionDef):
+        declared_global = set()
+        assigned = {arg.arg for arg in function.args.args}
+        for node in ast.walk(function):
+            if isinstance(node, ast.Global):
+                declared_global.update(node.names)
+            elif isinstance(node, ast.Name) and isinstance(node.ctx, ast.Store):
+                assigned.add(node.id)
+
+        self.names = {
+            name: REG_LOCAL_FMT.format(function.name, name) for name in assigned - declared_global
+        }
+
+    def visit_Name(self, node):
+        if node.id in self.names:
+            node.id = self.names[node.id]
+        return node
+
+
 def _parse_code(code: str):
-    return CompatTransformer().visit(ast.parse(code))
+    tree = ast.parse(code)
+    # Walking the entire tree is not free, so avoid it when there is nothing to transform.
+    if sys.version_info < (3, 9):
+        tree = CompatTransformer().visit(tree)
+    return tree
 
 
 def _name_as_resource(name: str, mapping: dict):
@@ -136,14 +132,291 @@ def _name_as_res(name: str):
     return _name_as_resource(name, RES_MAP)
 
 
+def _fold(node):
+    """
+    Evaluates the expression at compile time, following mlog's semantics rather than Python's.
+
+    Returns the resulting number (or boolean, for comparisons), or `None` if the value can only
+    be known when the program runs.
+    """
+    if isinstance(node, ast.Constant):
+        value = node.value
+        return value if isinstance(value, (bool, int, float)) else None
+
+    elif isinstance(node, ast.UnaryOp):
+        value = _fold(node.operand)
+        if value is None:
+            return None
+        elif isinstance(node.op, ast.Not):
+            return not _truthy(value)
+        elif isinstance(node.op, ast.Invert):
+            return _evaluate("flip", value)
+        elif isinstance(node.op, ast.USub):
+            return _evaluate("sub", 0, value)
+        else:
+            return _evaluate("add", 0, value)
+
+    elif isinstance(node, ast.BinOp):
+        op = BIN_OPS.get(type(node.op))
+        return op and _evaluate(op, _fold(node.left), _fold(node.right))
+
+    elif isinstance(node, ast.Compare):
+        # Unlike the generated code, constant comparisons can be chained the same way Python does.
+        left = _fold(node.left)
+        for op, comparator in zip(node.ops, node.comparators):
+            right = _fold(comparator)
+            result = _evaluate(BIN_CMP.get(type(op)), left, right)
+            if not result:
+                return result
+            left = right
+        return True
+
+    elif isinstance(node, ast.BoolOp):
+        values = [_fold(value) for value in node.values]
+        if None in values:
+            return None
+        truths = map(_truthy, values)
+        return all(truths) if isinstance(node.op, ast.And) else any(truths)
+
+    elif isinstance(node, ast.IfExp):
+        test = _fold(node.test)
+        if test is None:
+            return None
+        return _fold(node.body if _truthy(test) else node.orelse)
+
+    elif isinstance(node, ast.Call) and isinstance(node.func, ast.Name):
+        if BUILTIN_DEFS.get(node.func.id) != len(node.args) or node.keywords:
+            return None
+        return _evaluate(node.func.id, *map(_fold, node.args))
+
+    return None
+
+
+def _is_plain(node) -> bool:
+    # Whether the value is available without running any instruction.
+    return isinstance(node, (ast.Name, ast.Constant)) or _fold(node) is not None
+
+
+def _is_condition(node) -> bool:
+    # Whether the value is best computed with jumps, evaluating only what's needed.
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.Not):
+        return _is_condition(node.operand)
+    return isinstance(node, ast.BoolOp) or (isinstance(node, ast.Compare) and len(node.ops) > 1)
+
+
+def _may_read(node, name: str) -> bool:
+    # Whether evaluating the expression may read the variable (calling a function may read anything).
+    return any(
+        (isinstance(subnode, ast.Name) and subnode.id == name)
+        or (
+            isinstance(subnode, ast.Call)
+            and not (isinstance(subnode.func, ast.Name) and subnode.func.id in BUILTIN_DEFS)
+        )
+        for subnode in ast.walk(node)
+    )
+
+
+def _min_max(node: ast.IfExp):
+    """
+    Returns `(op, a, b)` if the expression picks the smallest (`op` is `"min"`) or the largest
+    (`"max"`) of two values, like `a if a < b else b`, or `None`.
+    """
+    test = node.test
+    if (
+        not isinstance(test, ast.Compare)
+        or len(test.ops) != 1
+        or not isinstance(test.ops[0], (ast.Lt, ast.LtE, ast.Gt, ast.GtE))
+        or any(isinstance(subnode, ast.Call) for subnode in ast.walk(node))
+    ):
+        return None
+
+    a, b = test.left, test.comparators[0]
+    smaller = isinstance(test.ops[0], (ast.Lt, ast.LtE))
+    picked = ast.dump(node.body), ast.dump(node.orelse)
+    if picked == (ast.dump(a), ast.dump(b)):
+        return ("min" if smaller else "max"), a, b
+    if picked == (ast.dump(b), ast.dump(a)):
+        return ("max" if smaller else "min"), a, b
+    return None
+
+
+def _affine(node, name: str):
+    """
+    Returns `(a, b)` if the expression is always `a * name + b`, with integer constants `a` and `b`.
+    """
+    if isinstance(node, ast.Name):
+        return (1, 0) if node.id == name else None
+
+    value = _fold(node)
+    if value is not None:
+        return (0, int(value)) if float(value).is_integer() else None
+
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.USub):
+        operand = _affine(node.operand, name)
+        return operand and (-operand[0], -operand[1])
+
+    if isinstance(node, ast.BinOp) and isinstance(node.op, (ast.Add, ast.Sub, ast.Mult)):
+        left, right = _affine(node.left, name), _affine(node.right, name)
+        if left is None or right is None:
+            return None
+        elif isinstance(node.op, ast.Add):
+            return (left[0] + right[0], left[1] + right[1])
+        elif isinstance(node.op, ast.Sub):
+            return (left[0] - right[0], left[1] - right[1])
+        elif left[0] == 0:
+            return (left[1] * right[0], left[1] * right[1])
+        elif right[0] == 0:
+            return (left[0] * right[1], left[1] * right[1])
+
+    return None
+
+
+def _case_values(test, name: str):
+    # The integers `test` compares the variable to, if it's made of `name == value` joined by `or`.
+    if isinstance(test, ast.BoolOp) and isinstance(test.op, ast.Or):
+        values = [_case_values(value, name) for value in test.values]
+        return None if None in values else [value for case in values for value in case]
+
+    if (
+        isinstance(test, ast.Compare)
+        and len(test.ops) == 1
+        and isinstance(test.ops[0], ast.Eq)
+        and isinstance(test.left, ast.Name)
+        and test.left.id == name
+    ):
+        value = _fold(test.comparators[0])
+        if value is not None and float(value).is_integer():
+            return [int(value)]
+
+    return None
+
+
+def _if_chain_cases(node: ast.If):
+    """
+    Returns `(subject, cases, default)` if the `if`/`elif` chain starts by comparing the same
+    variable to integers, like a `match` statement would, or `None`.
+
+    `cases` are `(values, body)` pairs, and `default` runs if no value matches (it may be the
+    rest of the chain, once its tests compare something else).
+    """
+    test = node.test
+    while isinstance(test, ast.BoolOp):
+        test = test.values[0]
+    if not isinstance(test, ast.Compare) or not isinstance(test.left, ast.Name):
+        return None
+
+    subject = test.left.id
+    cases = []
+    while True:
+        values = _case_values(node.test, subject)
+        if values is None:
+            return (subject, cases, [node]) if cases else None
+
+        cases.append((values, node.body))
+        if len(node.orelse) != 1 or not isinstance(node.orelse[0], ast.If):
+            return subject, cases, node.orelse
+        node = node.orelse[0]
+
+
+def _walk_functions(node, function=None):
+    # Like `ast.walk`, but also yields the function definition each node is in.
+    for child in ast.iter_child_nodes(node):
+        yield child, function
+        yield from _walk_functions(child, child if isinstance(child, ast.FunctionDef) else function)
+
+
+def _return_outputs(tree: ast.Module) -> dict:
+    """
+    Finds the variable each function can write its return value to, instead of `REG_RET`.
+
+    This is only possible for functions called once, as in `x = f()`, in which case they can
+    write to `x` directly. A tail call `return g()` in `f` writes wherever `f` writes to.
+    """
+    functions = {}
+    for node, _ in _walk_functions(tree):
+        if isinstance(node, ast.FunctionDef) and "inline" not in (d.id for d in node.decorator_list):
+            functions[node.name] = node
+
+    local_names = {None: {}}  # function -> its renamed local variables
+    assigned = {}  # call node -> variable it's assigned to
+    tail_calls = {}  # call node -> function it returns from
+    uses = {name: [] for name in functions}  # function -> (variable, tail caller) of each call
+    for node, function in _walk_functions(tree):
+        # Inline functions are copied, so calls within them may happen many times.
+        copied = function is not None and function.name not in functions
+
+        if isinstance(node, ast.Assign) and isinstance(node.targets[0], ast.Name) and not copied:
+            if function not in local_names:
+                local_names[function] = LocalsTransformer(function).names
+            target = node.targets[0].id
+            assigned[node.value] = local_names[function].get(target, target)
+
+        elif isinstance(node, ast.Return) and function is not None and not copied:
+            tail_calls[node.value] = function.name
+
+        elif isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id in functions:
+            if tail_calls.get(node) == node.func.id:
+                continue  # jumping back to itself doesn't change where it returns to
+            elif node in tail_calls:
+                uses[node.func.id].append((None, tail_calls[node]))
+            elif node in assigned and function is not functions[node.func.id]:
+                uses[node.func.id].append((assigned[node], None))
+            else:
+                uses[node.func.id].append((None, None))
+
+    outputs = {}
+
+    def output(name):
+        if name not in outputs:
+            outputs[name] = REG_RET  # until known, so that tail calls in a cycle settle on it
+            if len(uses[name]) == 1:
+                variable, caller = uses[name][0]
+                outputs[name] = output(caller) if caller else variable or REG_RET
+        return outputs[name]
+
+    for name in functions:
+        output(name)
+    return outputs
+
+
 class Compiler(ast.NodeVisitor):
-    def __init__(self):
-        self._ins = [_Instruction(f"set {REG_STACK} 0")]
+    def __init__(
+        self,
+        opt_level: int = 1,
+        passes: list = None,
+        mlog_version: int = MLOG_VERSION,
+        target: Union[str, Target] = DEFAULT_TARGET,
+    ):
+        """
+        `opt_level` selects which of the `passes` run, from none at 0 to all of them at 3.
+        By default, the passes in `PASSES` are used.
+
+        `mlog_version` is the version of Mindustry's logic the code will run on, and `target` the
+        processor running it (one of `TARGETS`, or its name). Both decide which instructions may be
+        used (see `OPCODE_VERSIONS` and `PRIVILEGED_OPCODES`), and the target how long the program
+        may be and how much the optimizations may grow it.
+        """
+        self.opt_level = opt_level
+        self.mlog_version = mlog_version
+        self.target = TARGETS[target] if isinstance(target, str) else target
+        self.passes = list(PASSES if passes is None else passes)
+        self.pass_stats = []  # `PassStats` of the last compilation
+        self._ins = [_Instruction("set", REG_STACK, "0")]
         self._in_def = None  # current function name
         self._epilogue = None  # current function's epilogue label
+        self._stmt = None  # statement being compiled, which errors about its instructions point to
+        self._stmt_start = 0  # index in `_ins` where the current statement started
+        self._loop_tmps = []  # temporaries used by the range of the `for` loops being compiled
         self._functions = {}
+        self._main_ins = self._ins  # code of the main program, while compiling a function
+        self._unroll_budget = self.target.unroll_budget  # instructions left for unrolling loops
+        self._induction = {}  # index expression -> induction variable holding its value
+        self._tree = None  # the program being compiled
+        self._wraps_around = False  # whether the program starts over by running off its last line
+        self._function_ins = []  # code of the functions, which goes after the main program
         self._inline_functions = {}
-        self._in_inline_function = False
+        self._return_outputs = {}  # function name -> variable its return value is written to
+        self._inline_return = None  # output and end label of the inline function being copied
         self._tmp_var_counter = 0
         self._scope_start_label = (
             []
@@ -151,14 +424,36 @@ class Compiler(ast.NodeVisitor):
         # needed for break to know its next label to jump to; works like a stack
         self._scope_end_label = []
 
-    def ins_append(self, ins):
+    def visit(self, node):
+        # Temporaries are only ever used within a single statement (except for those in `_loop_tmps`).
+        if not isinstance(node, ast.stmt):
+            return super().visit(node)
+
+        stmt, stmt_start = self._stmt, self._stmt_start
+        self._stmt, self._stmt_start = node, len(self._ins)
+        try:
+            return super().visit(node)
+        finally:
+            self._stmt, self._stmt_start = stmt, stmt_start
+
+    def supports(self, opcode: str) -> bool:
+        """
+        Whether the instruction can be used in the generated code.
+        """
+        if opcode in PRIVILEGED_OPCODES and not self.target.privileged:
+            return False
+        return OPCODE_VERSIONS.get(opcode, 0) <= self.mlog_version
+
+    def ins_append(self, ins, *args):
         if not isinstance(ins, _Instruction):
-            ins = _Instruction(ins)
+            ins = _Instruction(ins, *args)
+        if not self.supports(ins.op):
+            raise CompilerError(ERR_UNAVAILABLE_INSTRUCTION, self._stmt, a=ins.op, target=self.target.name)
         self._ins.append(ins)
 
     def _tmp_var_name(self):
         self._tmp_var_counter += 1
-        return REG_TMP_FMT.format(self._tmp_var_counter)
+        return _Variable(REG_TMP_FMT.format(self._tmp_var_counter))
 
     def compile(self, code: Union[str, Callable, Path]):
         if inspect.isfunction(code):
@@ -180,11 +475,68 @@ class Compiler(ast.NodeVisitor):
         else:
             raise CompilerError(ERR_INVALID_SOURCE, None)
 
-        for node in body:
+        self.pass_stats = []
+        tree = ast.Module(body=body, type_ignores=[])
+        for opt in self.passes:
+            if opt.on_ast and opt.level <= self.opt_level:
+                start = perf_counter()
+                tree = opt.run(self, tree)
+                self.pass_stats.append(PassStats(opt.name, perf_counter() - start, None, None))
+        self._tree = tree
+
+        start = perf_counter()
+        self._return_outputs = _return_outputs(tree)
+        for node in tree.body:
             self.visit(node)
+        if self._function_ins:
+            self.ins_append("end")
+            self._ins.extend(self._function_ins)
+        if not self._wraps_around:
+            self.ins_append("end")
+        self.pass_stats.append(PassStats("codegen", perf_counter() - start, 0, self.ins_count()))
+
+        for opt in self.passes:
+            if not opt.on_ast and opt.level <= self.opt_level:
+                start = perf_counter()
+                before = self.ins_count()
+                self._ins = opt.run(self, self._ins)
+                self.pass_stats.append(
+                    PassStats(opt.name, perf_counter() - start, before, self.ins_count())
+                )
 
         return self.generate_masm()
 
+    def ins_count(self):
+        """
+        Amount of instructions generated so far, without counting labels.
+        """
+        return sum(map(_size, self._ins))
+
+    def costs(self) -> list:
+        """
+        The most instructions parts of the last compiled program may run, as a list of `Cost`: a
+        pass from the top of the program to its end, a call of each function and an iteration of
+        each loop. Loops are counted whole in the parts containing them if their trip count is known.
+        """
+        lines = []
+        line = 0
+        for ins in self._ins:
+            lines.append(line)
+            line += _size(ins)
+
+        cfg = ControlFlowGraph(self._ins)
+        worst = WorstCase(cfg, self.target.cost)
+        names = {cfg.label_blocks.get(fn.start): name for name, fn in self._functions.items()}
+
+        costs = [Cost("program", "", 0, worst.program)]
+        for prologue in sorted(set(cfg.calls.values()), key=lambda block: block.start):
+            line = lines[prologue.start]
+            costs.append(Cost("function", names.get(prologue, ""), line, worst.call(prologue)))
+        for header in sorted(worst.loops, key=lambda block: block.start):
+            line = lines[header.start]
+            costs.append(Cost("loop", "", line, worst.iteration(header), worst.trips[header]))
+        return costs
+
     def visit_Import(self, node: ast.Import):
         raise CompilerError(ERR_UNSUPPORTED_IMPORT, node, a=node.names[0].name)
 
@@ -198,11 +550,11 @@ class Compiler(ast.NodeVisitor):
             # a = b
             output = self.as_value(node.value, target.id)
             if output != target.id:
-                self.ins_append(f"set {target.id} {output}")
+                self.ins_append("set", target.id, output)
 
             if len(node.targets) > 1:
                 for additional_target in node.targets[1:]:
-                    self.ins_append(f"set {additional_target.id} {target.id}")
+                    self.ins_append("set", additional_target.id, target.id)
 
         elif isinstance(target, ast.Attribute):
             # Unit.flag = val
@@ -210,7 +562,7 @@ class Compiler(ast.NodeVisitor):
                 raise CompilerError(ERR_COMPLEX_ASSIGN, node)
 
             val = self.as_value(node.value)
-            self.ins_append(f"ucontrol flag {val} 0 0 0 0")
+            self.ins_append("ucontrol", "flag", val, "0", "0", "0", "0")
 
         elif isinstance(target, ast.Subscript):
             # Mem.cell[idx] = val
@@ -221,7 +573,7 @@ class Compiler(ast.NodeVisitor):
             idx = self.as_value(target.slice)
             val = self.as_value(node.value)
 
-            self.ins_append(f"write {val} {cell} {idx}")
+            self.ins_append("write", val, cell, idx)
         elif isinstance(target, ast.Tuple) and len(node.targets) == 1:
             # a, b = c, d
             # Certain system calls (like Unit.locate()) can return tuples; check those if we're assigning a call and not a tuple
@@ -236,7 +588,7 @@ class Compiler(ast.NodeVisitor):
                 left = left.id
                 output = self.as_value(right, left)
                 if output != left:
-                    self.ins_append(f"set {left} {output}")
+                    self.ins_append("set", left, output)
         else:
             raise CompilerError(ERR_COMPLEX_ASSIGN, node)
 
@@ -250,58 +602,67 @@ class Compiler(ast.NodeVisitor):
             raise CompilerError(ERR_UNSUPPORTED_OP, node, op=node.op.__class__.__name__)
 
         right = self.as_value(node.value)
-        self.ins_append(f"op {op} {target.id} {target.id} {right}")
+        self.ins_append("op", op, target.id, target.id, right)
 
     def conditional_jump(self, destination_label, test, jump_if_test=True):
-        if isinstance(test, ast.Compare):
-            if len(test.ops) != 1 or len(test.comparators) != 1:
-                # 1 < 2 < 3: Compare(left=1, ops=[<, <], comparators=[2, 3])
-                tmp = self._tmp_var_name()
-                # evaluate left: 1 op, 1 comparator remaining
-                # op lessThan %tmp 1 2 (tmp = 1 < 2)
-                self.ins_append(
-                    f"op {BIN_CMP.get(type(test.ops.pop(0)))} {tmp} {self.as_value(test.left)} {self.as_value(test.comparators.pop(0))}"
-                )
-                # leave one for below
-                for i in range(len(test.ops) - 1):
-                    # tmp = tmp < n
-                    self.ins_append(
-                        f"op {BIN_CMP.get(type(test.ops.pop(0)))} {tmp} {tmp} {self.as_value(test.comparators.pop(0))}"
-                    )
-            cmp = BIN_CMP.get(type(test.ops[0]))
-            left = self.as_value(test.left)
-            right = self.as_value(test.comparators[0])
-
-        elif isinstance(test, ast.BoolOp):
-            cmp = BIN_CMP.get(type(test.op))
-            left, right = self.as_value(test.values[0]), self.as_value(test.values[1])
+        value = _fold(test)
+        if value is not None:
+            # The outcome is known, so either always jump or never do.
+            if _truthy(value) == jump_if_test:
+                self.ins_append(_Jump(destination_label, "always"))
+            return
+
+        if isinstance(test, ast.UnaryOp) and isinstance(test.op, ast.Not):
+            # Jumping if `not a` is jumping if `a` is false.
+            self.conditional_jump(destination_label, test.operand, not jump_if_test)
+            return
+
+        if isinstance(test, ast.BoolOp):
+            # Operands are only evaluated until the outcome is known. Jumping if `a or b` is true
+            # (or, by De Morgan, if `a and b` is false) means jumping as soon as any operand does.
+            if isinstance(test.op, ast.Or) == jump_if_test:
+                for value in test.values:
+                    self.conditional_jump(destination_label, value, jump_if_test)
+            else:
+                # Otherwise, any operand can rule the jump out, and the last one decides.
+                skip_label = _Label()
+                for value in test.values[:-1]:
+                    self.conditional_jump(skip_label, value, not jump_if_test)
+                self.conditional_jump(destination_label, test.values[-1], jump_if_test)
+                self.ins_append(skip_label)
+            return
 
-        else:
-            left, cmp, right = self.as_value(test), "notEqual", 0
-
-        if not jump_if_test:
-            cmp = NEGATED_BIN_CMP.get(cmp)
-        if cmp is None:
-            raise CompilerError(ERR_UNSUPPORTED_OP, test, op=cmp)
-
-        if cmp == "and":
-            failed_label = _Label()
-            self.ins_append(_Jump(failed_label, f"equal {left} 0"))
-            self.ins_append(_Jump(destination_label, f"notEqual {right} 0"))
-            self.ins_append(failed_label)
-        elif cmp == "or":
-            self.ins_append(_Jump(destination_label, f"notEqual {left} 0"))
-            self.ins_append(_Jump(destination_label, f"notEqual {right} 0"))
-        elif cmp == "nand":
-            self.ins_append(_Jump(destination_label, f"equal {left} 0"))
-            self.ins_append(_Jump(destination_label, f"equal {right} 0"))
-        elif cmp == "nor":
-            failed_label = _Label()
-            self.ins_append(_Jump(failed_label, f"notEqual {left} 0"))
-            self.ins_append(_Jump(destination_label, f"equal {right} 0"))
-            self.ins_append(failed_label)
-        else:
-            self.ins_append(_Jump(destination_label, f"{cmp} {left} {right}"))
+        if isinstance(test, ast.Compare):
+            # The test may be compiled more than once (as in loops), so the node must be left intact.
+            # `a < b < c` is `a < b and b < c`, with `b` evaluated only once (and only if needed).
+            skip_label = _Label()
+            left, left_node = self.as_value(test.left), test.left
+            for i, (op, comparator) in enumerate(zip(test.ops, test.comparators)):
+                cmp = BIN_CMP.get(type(op))
+                if cmp is None:
+                    raise CompilerError(ERR_UNSUPPORTED_OP, test, op=op.__class__.__name__)
+
+                right = self.as_value(comparator)
+                if i + 1 < len(test.ops) and jump_if_test:
+                    label, jump_if_true = skip_label, False
+                else:
+                    label, jump_if_true = destination_label, jump_if_test
+
+                outcome = _fold(ast.Compare(left=left_node, ops=[op], comparators=[comparator]))
+                if outcome is None:
+                    cmp = cmp if jump_if_true else NEGATED_BIN_CMP[cmp]
+                    self.ins_append(_Jump(label, cmp, left, right))
+                elif _truthy(outcome) == jump_if_true:
+                    self.ins_append(_Jump(label, "always"))
+                left, left_node = right, comparator
+
+            if len(test.ops) > 1 and jump_if_test:
+                self.ins_append(skip_label)
+            return
+
+        self.ins_append(
+            _Jump(destination_label, "notEqual" if jump_if_test else "equal", self.as_value(test), "0")
+        )
 
     def radar_instruction(self, variable, obj, value) -> str:
         if obj == "Unit":
@@ -325,7 +686,6 @@ class Compiler(ast.NodeVisitor):
         while len(criteria) < 3:
             criteria.append("any")
 
-        criteria = " ".join(criteria)
         key = "distance"
         order = "min"
         for k in value.keywords:
@@ -341,10 +701,21 @@ class Compiler(ast.NodeVisitor):
         except KeyError:
             raise CompilerError(ERR_UNSUPPORTED_EXPR, value)
 
-        self.ins_append(f"{radar} {criteria} {key} {obj} {order} {variable}")
+        self.ins_append(radar, *criteria, key, obj, order, variable)
         return variable
 
     def visit_If(self, node):
+        value = _fold(node.test)
+        if value is not None:
+            for subnode in node.body if _truthy(value) else node.orelse:
+                self.visit(subnode)
+            return
+
+        if self.opt_level >= 2:
+            chain = _if_chain_cases(node)
+            if chain is not None and self.emit_switch(*chain, compare=False):
+                return
+
         endif_label = _Label()
         if_false_label = _Label() if node.orelse else endif_label
         self.conditional_jump(if_false_label, node.test, jump_if_test=False)
@@ -357,17 +728,137 @@ class Compiler(ast.NodeVisitor):
                 self.visit(subnode)
         self.ins_append(endif_label)
 
+    def visit_Match(self, node):
+        subject = self.as_value(node.subject)
+        cases = []
+        default = []
+        for case in node.cases:
+            if case.guard is not None:
+                raise CompilerError(ERR_UNSUPPORTED_PATTERN, case.guard)
+
+            pattern = case.pattern
+            if isinstance(pattern, ast.MatchAs) and pattern.pattern is None and pattern.name is None:
+                # case _: (it must be the last one)
+                default = case.body
+                break
+            cases.append((self.pattern_values(pattern), case.body))
+
+        self.emit_switch(subject, cases, default)
+
+    def pattern_values(self, pattern) -> list:
+        """
+        The values a `case` pattern matches, as integers when possible.
+        """
+        if isinstance(pattern, ast.MatchOr):
+            return [value for subpattern in pattern.patterns for value in self.pattern_values(subpattern)]
+
+        if not isinstance(pattern, ast.MatchValue):
+            raise CompilerError(ERR_UNSUPPORTED_PATTERN, pattern)
+
+        value = _fold(pattern.value)
+        if value is not None and float(value).is_integer():
+            return [int(value)]
+        return [self.as_value(pattern.value)]
+
+    def emit_switch(self, subject, cases: list, default: list, compare=True) -> bool:
+        """
+        Jumps to the body of the first case whose values include the subject, or to the default.
+
+        If enough of the values are integers close to each other, a jump table does it in the same
+        instructions whatever the case. Otherwise, the subject is compared to every value, unless
+        `compare` is false, in which case nothing is emitted and `False` is returned.
+        """
+        end = _Label()
+        default_label = _Label() if default else end
+        labels = [_Label() for _ in cases]
+        targets = {}  # value -> label of the first case matching it
+        for label, (values, _) in zip(labels, cases):
+            for value in values:
+                targets.setdefault(value, label)
+
+        if (
+            len(targets) >= JUMP_TABLE_MIN_CASES
+            and all(isinstance(value, int) for value in targets)
+            and max(targets) - min(targets) < 2 * len(targets)
+        ):
+            # Only integers match a case (the check goes away when the subject is known to be one).
+            low, high = min(targets), max(targets)
+            integer = self._tmp_var_name()
+            self.ins_append(_Jump(default_label, "lessThan", subject, low))
+            self.ins_append(_Jump(default_label, "greaterThan", subject, high))
+            self.ins_append("op", "floor", integer, subject)
+            self.ins_append(_Jump(default_label, "notEqual", integer, subject))
+            index = subject
+            if low != 0:
+                index = self._tmp_var_name()
+                self.ins_append("op", "sub", index, subject, low)
+            self.ins_append(
+                _JumpTable([targets.get(value, default_label) for value in range(low, high + 1)], index)
+            )
+        elif compare:
+            for value, label in targets.items():
+                self.ins_append(_Jump(label, "equal", subject, value))
+            self.ins_append(_Jump(default_label, "always"))
+        else:
+            return False
+
+        for i, (label, (_, body)) in enumerate(zip(labels, cases)):
+            self.ins_append(label)
+            for subnode in body:
+                self.visit(subnode)
+            if default or i + 1 < len(cases):
+                self.ins_append(_Jump(end, "always"))
+
+        if default:
+            self.ins_append(default_label)
+            for subnode in default:
+                self.visit(subnode)
+        self.ins_append(end)
+        return True
+
     def visit_While(self, node):
         """This will be called for any* while loop."""
+        value = _fold(node.test)
+        if value is not None and not _truthy(value):
+            return
+
+        if value is not None and self._is_main_loop(node):
+            # The program starts over once it runs off its last line, which does the same as the
+            # jump back without taking up an instruction (unlike `end`, which is left out). Both
+            # `continue` and `break` go to the end.
+            end = _Label()
+            self._scope_start_label.append(end)
+            self._scope_end_label.append(end)
+            for subnode in node.body:
+                self.visit(subnode)
+            self._scope_start_label.pop()
+            self.ins_append(self._scope_end_label.pop())
+            self._wraps_around = True
+            return
+
+        # The test is done once before entering the loop, and then at the end of every iteration,
+        # so that each iteration only needs one jump to go back to the start.
+        body = _Label()
         self._scope_start_label.append(_Label())
         self._scope_end_label.append(_Label())
         self.conditional_jump(self._scope_end_label[-1], node.test, jump_if_test=False)
-        self.ins_append(self._scope_start_label[-1])
+        self.ins_append(body)
         for subnode in node.body:
             self.visit(subnode)
-        self.conditional_jump(self._scope_start_label.pop(), node.test, jump_if_test=True)
+        self.ins_append(self._scope_start_label.pop())
+        self.conditional_jump(body, node.test, jump_if_test=True)
         self.ins_append(self._scope_end_label.pop())
 
+    def _is_main_loop(self, node: ast.While) -> bool:
+        # Whether the loop is all the program does: it's the last statement, nothing runs before it
+        # (other than setting up the stack) and no function is placed after it.
+        return (
+            self._in_def is None
+            and node is self._tree.body[-1]
+            and not self._function_ins
+            and sum(map(_size, self._ins[1:])) == 0
+        )
+
     def visit_For(self, node):
         target = node.target
         if not isinstance(target, ast.Name):
@@ -387,7 +878,7 @@ class Compiler(ast.NodeVisitor):
         ):
             it = REG_IT_FMT.format(call.lineno, call.col_offset)
             start, end, step = 0, "@links", 1
-            inject.append(f"getlink {target.id} {it}")
+            inject.append(_Instruction("getlink", target.id, it))
         elif isinstance(call.func, ast.Name) and call.func.id == "range":
             it = target.id
             argv = call.args
@@ -406,25 +897,205 @@ class Compiler(ast.NodeVisitor):
         else:
             raise CompilerError(ERR_UNSUPPORTED_ITER, node, a=call.func.id)
 
-        self.ins_append(f"set {it} {start}")
-
+        if not inject and self.opt_level >= 2 and self.unroll_loop(node, it, start, end, step):
+            return
+
+        loop_tmps = [
+            var for var in (end, step) if isinstance(var, _Variable) and var.startswith(REG_TMP_FMT[:-2])
+        ]
+        ivs, indices = {}, []
+        if not inject and self.opt_level >= 2:
+            ivs, indices = self._find_induction(node, it, step)
+
+        # The loop variable is not needed if it's only used to compute the induction variables,
+        # which can be compared against the end of the range instead.
+        test, limit, scale = it, end, 1
+        if ivs and self._only_read_in(it, indices):
+            (scale, offset), test = next(iter(ivs.items()))
+            limit = self.emit_affine(end, scale, offset)
+            if isinstance(limit, _Variable):
+                loop_tmps.append(limit)
+        else:
+            self.ins_append("set", it, start)
+        for (scale_, offset), iv in ivs.items():
+            self.emit_affine(start, scale_, offset, iv)
+        self._loop_tmps.extend(loop_tmps)
+
+        # Like `while`, the condition is checked before entering the loop and at the end of each
+        # iteration. The first check is not needed when the loop is known to run at least once.
+        # Induction variables scaled by a negative number go the other way around.
+        body = _Label()
         self._scope_start_label.append(_Label())
         self._scope_end_label.append(_Label())
-        condition = _Label()
-        self.ins_append(condition)
-        if backwards:
-            self.ins_append(_Jump(self._scope_end_label[-1], f"lessThanEq {it} {end}"))
-        else:
-            self.ins_append(_Jump(self._scope_end_label[-1], f"greaterThanEq {it} {end}"))
+        continue_cond = "greaterThan" if backwards != (scale < 0) else "lessThan"
+        first, last = _number(_operand(start)), _number(_operand(end))
+        if first is None or last is None or (first <= last if backwards else first >= last):
+            self.ins_append(_Jump(self._scope_end_label[-1], NEGATED_BIN_CMP[continue_cond], test, limit))
 
+        self.ins_append(body)
         self._ins.extend(inject)
-        for subnode in node.body:
-            self.visit(subnode)
+        for index in indices:
+            self._induction[index] = ivs[_affine(index, it)]
+        try:
+            for subnode in node.body:
+                self.visit(subnode)
+        finally:
+            for index in indices:
+                del self._induction[index]
 
         self.ins_append(self._scope_start_label.pop())
-        self.ins_append(f"op add {it} {it} {step}")
-        self.ins_append(_Jump(condition, "always"))
+        if test == it:
+            self.ins_append("op", "add", it, it, step)
+        for (scale_, _), iv in ivs.items():
+            self.ins_append("op", "add", iv, iv, _number_literal(scale_ * int(_number(_operand(step)))))
+        self.ins_append(_Jump(body, continue_cond, test, limit))
         self.ins_append(self._scope_end_label.pop())
+        del self._loop_tmps[len(self._loop_tmps) - len(loop_tmps) :]
+
+    def _find_induction(self, node: ast.For, it: str, step):
+        """
+        Finds the `Mem` indices in the loop which are affine expressions of the loop variable, so
+        that they can be kept in induction variables updated once per iteration instead.
+
+        Returns the induction variable for each `(a, b)` (computing `a * it + b`), and the indices.
+        """
+        step = _number(_operand(step))
+        if step is None or not float(step).is_integer():
+            return {}, []
+
+        body = [subnode for stmt in node.body for subnode in ast.walk(stmt)]
+        if any(
+            isinstance(subnode, ast.Name) and subnode.id == it and isinstance(subnode.ctx, ast.Store)
+            for subnode in body
+        ):
+            return {}, []
+
+        ivs, indices = {}, []
+        for subnode in body:
+            if (
+                isinstance(subnode, ast.Subscript)
+                and isinstance(subnode.value, ast.Attribute)
+                and isinstance(subnode.value.value, ast.Name)
+                and subnode.value.value.id == "Mem"
+            ):
+                affine = _affine(subnode.slice, it)
+                if affine is not None and affine[0] != 0 and affine != (1, 0):
+                    if affine not in ivs:
+                        ivs[affine] = _Variable(REG_IV_FMT.format(node.lineno, len(ivs)))
+                    indices.append(subnode.slice)
+
+        return ivs, indices
+
+    def _only_read_in(self, name: str, nodes: list) -> bool:
+        # Whether the variable is only ever read within the given expressions, anywhere in the
+        # program. Locals are matched by their original name too, which may be a false positive.
+        names = {name}
+        if self._in_def is not None:
+            prefix = REG_LOCAL_FMT.format(self._in_def, "")
+            if name.startswith(prefix):
+                names.add(name[len(prefix) :])
+
+        def reads(tree):
+            return sum(
+                isinstance(node, ast.Name) and isinstance(node.ctx, ast.Load) and node.id in names
+                for node in ast.walk(tree)
+            )
+
+        return reads(self._tree) == sum(map(reads, nodes))
+
+    def emit_affine(self, value, scale: int, offset: int, output: _Variable = None):
+        """
+        Computes `scale * value + offset` into `output` (or a new temporary, unless it's constant).
+        """
+        number = _number(_operand(value))
+        if number is not None:
+            literal = _number_literal(scale * number + offset)
+            if output is None:
+                return literal
+            self.ins_append("set", output, literal)
+            return output
+
+        if output is None:
+            output = self._tmp_var_name()
+        self.ins_append("op", "mul", output, value, str(scale))
+        if offset:
+            self.ins_append("op", "add", output, output, str(offset))
+        return output
+
+    def _body_size(self, body: list) -> int:
+        # Compiles the statements only to count their instructions.
+        ins, tmp_var_counter, unroll_budget = self._ins, self._tmp_var_counter, self._unroll_budget
+        self._ins = []
+        try:
+            for subnode in body:
+                self.visit(subnode)
+            return self.ins_count()
+        finally:
+            self._ins, self._tmp_var_counter, self._unroll_budget = ins, tmp_var_counter, unroll_budget
+
+    def unroll_loop(self, node: ast.For, it: str, start, end, step) -> bool:
+        """
+        Copies the body of a loop over a constant `range()` once per iteration, or a few times per
+        iteration if the copies wouldn't fit within the target's budget, to run fewer jumps.
+
+        Returns whether the loop was unrolled. Loops using `break` or `continue`, or assigning
+        the iteration variable, are left alone.
+        """
+        values = [_number(_operand(value)) for value in (start, end, step)]
+        if None in values or not all(float(value).is_integer() for value in values) or not values[2]:
+            return False
+
+        trips = range(*map(int, values))
+        if not trips or any(
+            isinstance(subnode, (ast.Break, ast.Continue, ast.FunctionDef))
+            or (isinstance(subnode, ast.Name) and subnode.id == it and isinstance(subnode.ctx, ast.Store))
+            for stmt in node.body
+            for subnode in ast.walk(stmt)
+        ):
+            return False
+
+        # The copies only need to set the iteration variable if something reads it.
+        read = any(_may_read(stmt, it) for stmt in node.body)
+
+        # Every copy sets the iteration variable, while the loop takes a guard, an increment and a jump.
+        size = self._body_size(node.body) + 1
+        used = sum(map(_size, self._main_ins + self._function_ins))
+        budget = min(self._unroll_budget, self.target.max_instructions - used) + size + 2
+        factors = [n for n in (8, 4, 2) if len(trips) >= 2 * n]
+        if len(trips) * size <= budget:
+            factor = len(trips)
+        else:
+            factors = [n for n in factors if (n + len(trips) % n) * size <= budget]
+            if not factors:
+                return False
+            factor = factors[0]
+
+        copies = factor + len(trips) % factor if factor < len(trips) else factor
+        self._unroll_budget -= copies * size - size - 2
+
+        # The iterations which don't fill a whole round of the loop are copied before it.
+        remainder = len(trips) % factor if factor < len(trips) else len(trips)
+        for value in trips[:remainder]:
+            if read:
+                self.ins_append("set", it, value)
+            for subnode in node.body:
+                self.visit(subnode)
+
+        if remainder == len(trips):
+            # Leave the variable with the value it would have after the loop, if it's ever read.
+            if not self._only_read_in(it, []):
+                self.ins_append("set", it, trips.start + len(trips) * trips.step)
+            return True
+
+        body = _Label()
+        self.ins_append("set", it, trips[remainder])
+        self.ins_append(body)
+        for i in range(factor):
+            for subnode in node.body:
+                self.visit(subnode)
+            self.ins_append("op", "add", it, it, trips.step)
+        self.ins_append(_Jump(body, "greaterThan" if trips.step < 0 else "lessThan", it, trips.stop))
+        return True
 
     def visit_Break(self, node):
         self.ins_append(_Jump(self._scope_end_label[-1], "always"))
@@ -433,81 +1104,192 @@ class Compiler(ast.NodeVisitor):
         self.ins_append(_Jump(self._scope_start_label[-1], "always"))
 
     def visit_FunctionDef(self, node):
-        # TODO forbid recursion (or implement it by storing and restoring everything from stack)
-        # TODO local variable namespace per-function
         if self._in_def is not None:
             raise CompilerError(ERR_NESTED_DEF, node, a=node.name)
 
-        if node.name in self._functions or node.name == "print":
+        if node.name in self._functions or node.name in self._inline_functions or node.name == "print":
             raise CompilerError(ERR_REDEF, node, a=node.name)
 
-        self._in_def = node.name
-
         decorators = [i.id for i in node.decorator_list]
         # Check that all the decorators are valid
         if any(decorator not in ALLOWED_DECORATORS for decorator in decorators):
             # TODO: Add description specifiying that the decorator is the problem
             raise CompilerError(ERR_INVALID_DEF, node, a=node.name)
 
-        if "inline" in decorators:
-            self._inline_functions[node.name] = node.body
-        else:
-            reg_ret = f"{REG_RET_COUNTER_PREFIX}{len(self._functions)}"
+        args = node.args
+        if any(
+            (
+                args.vararg,
+                args.kwonlyargs,
+                args.kw_defaults,
+                args.kwarg,
+                args.defaults,
+            )
+        ):
+            raise CompilerError(ERR_INVALID_DEF, node, a=node.name)
 
-            args = node.args
-            if any(
-                (
-                    args.vararg,
-                    args.kwonlyargs,
-                    args.kw_defaults,
-                    args.kwarg,
-                    args.defaults,
-                )
-            ):
+        if sys.version_info >= (3, 8):
+            if args.posonlyargs:
                 raise CompilerError(ERR_INVALID_DEF, node, a=node.name)
 
-            if sys.version_info >= (3, 8):
-                if args.posonlyargs:
-                    raise CompilerError(ERR_INVALID_DEF, node, a=node.name)
+        # Arguments are passed in variables dedicated to this function, even when it's inlined.
+        local = LocalsTransformer(node)
+        params = [_Variable(local.names[arg.arg]) for arg in args.args]
 
-            # TODO it's better to put functions at the end and not have to skip them as code, but jumps need fixing
-            end = _Label()
-            self.ins_append(_Jump(end, "always"))
+        if "inline" in decorators:
+            self._inline_functions[node.name] = Function(
+                start=None,
+                argc=len(args.args),
+                params=params,
+                ret_counter=None,
+                recursive=False,
+                body=[local.visit(subnode) for subnode in node.body],
+            )
+        else:
+            self._in_def = node.name
+            reg_ret = f"{REG_RET_COUNTER_PREFIX}{len(self._functions)}"
+
+            # Functions are placed after the main program, so that it doesn't have to jump over them.
+            self._ins = self._function_ins
 
             prologue = _Label()
             self.ins_append(prologue)
-            self._functions[node.name] = Function(start=prologue, argc=len(args.args))
 
-            self.ins_append(f"read {reg_ret} cell1 {REG_STACK}")
-            for arg in reversed(args.args):
-                self.ins_append(f"op sub {REG_STACK} {REG_STACK} 1")
-                self.ins_append(f"read {arg.arg} cell1 {REG_STACK}")
+            # So is the return address. The stack is only used by functions calling themselves,
+            # to save these variables.
+            recursive = any(
+                isinstance(subnode, ast.Call)
+                and isinstance(subnode.func, ast.Name)
+                and subnode.func.id == node.name
+                for subnode in ast.walk(node)
+            )
+            fn = Function(
+                start=prologue,
+                argc=len(args.args),
+                params=params,
+                ret_counter=_Variable(reg_ret),
+                recursive=recursive,
+                saved=[_Variable(reg_ret), *map(_Variable, local.names.values())],
+                output=_Variable(self._return_outputs.get(node.name, REG_RET)),
+            )
+            self._functions[node.name] = fn
 
             # This relies on the fact that there are no nested definitions.
             # Set the epilogue now so that `visit_Return` can use this label.
             self._epilogue = _Label()
 
             for subnode in node.body:
-                self.visit(subnode)
+                self.visit(local.visit(subnode))
 
             self.ins_append(self._epilogue)
-
-            # Add 1 to the return value to skip the jump that made the call.
-            self.ins_append(f"op add @counter {reg_ret} 1")
-            self.ins_append(end)
+            self.ins_append("set", "@counter", reg_ret)
+            self._ins = self._main_ins
             self._in_def = None
             self._epilogue = None
 
+    def emit_arguments(self, fn: Function, node: ast.Call):
+        # The arguments are all evaluated before passing any of them, because evaluating an
+        # argument may call the same function (or change the variables used by previous arguments).
+        values = []
+        for i, arg in enumerate(node.args):
+            value = self.as_value(arg)
+            later_calls = any(
+                isinstance(subnode, ast.Call)
+                and isinstance(subnode.func, ast.Name)
+                and (subnode.func.id in self._functions or subnode.func.id in self._inline_functions)
+                for later in node.args[i + 1 :]
+                for subnode in ast.walk(later)
+            )
+            if isinstance(value, _Variable) and (
+                later_calls or value in fn.params[:i] + fn.params[i + 1 :]
+            ):
+                copy = self._tmp_var_name()
+                self.ins_append("set", copy, value)
+                value = copy
+            values.append(value)
+        return values
+
+    def emit_call(self, fn: Function, node: ast.Call, output: _Variable):
+        values = self.emit_arguments(fn, node)
+
+        # Calling itself would overwrite the variables of the current call, so save them first.
+        # Temporaries written by the current statement may be needed after the call too.
+        saved = []
+        if self._in_def is not None and self._functions.get(self._in_def) is fn:
+            saved = fn.saved + self._loop_tmps
+            for ins in self._ins[self._stmt_start :]:
+                for var in ins.outputs:
+                    if var.startswith(REG_TMP_FMT[:-2]) and var not in saved and var not in values:
+                        saved.append(var)
+        for var in saved:
+            self.ins_append("write", var, "cell1", REG_STACK)
+            self.ins_append("op", "add", REG_STACK, REG_STACK, "1")
+
+        for param, value in zip(fn.params, values):
+            self.ins_append("set", param, value)
+
+        # `@counter` already points to the jump, so add 1 to return right after it.
+        self.ins_append("op", "add", fn.ret_counter, "@counter", "1")
+        self.ins_append(_Jump(fn.start, "always"))
+
+        for var in reversed(saved):
+            self.ins_append("op", "sub", REG_STACK, REG_STACK, "1")
+            self.ins_append("read", var, "cell1", REG_STACK)
+
+        # Expressions may be very complex elsewhere, make sure `REG_RET` is not overwritten.
+        # The only call to a function may have it write to the output directly instead.
+        if output != fn.output:
+            self.ins_append("set", output, fn.output)
+
+    def emit_tail_call(self, fn: Function, node: ast.Call):
+        # Nothing runs after a tail call, so the function called can return to the caller's caller.
+        for param, value in zip(fn.params, self.emit_arguments(fn, node)):
+            self.ins_append("set", param, value)
+
+        caller = self._functions[self._in_def]
+        if fn is not caller:
+            self.ins_append("set", fn.ret_counter, caller.ret_counter)
+        self.ins_append(_Jump(fn.start, "always"))
+
+    def emit_inline_call(self, fn: Function, node: ast.Call, output: _Variable):
+        for param, value in zip(fn.params, self.emit_arguments(fn, node)):
+            self.ins_append("set", param, value)
+
+        inline_return = self._inline_return
+        end = _Label()
+        self._inline_return = (output, end)
+        for subnode in fn.body:
+            self.visit(subnode)
+        self._inline_return = inline_return
+
+        # Returning at the very end doesn't need to skip anything.
+        if isinstance(self._ins[-1], _Jump) and self._ins[-1].label is end:
+            self._ins.pop()
+        self.ins_append(end)
+
     def visit_Return(self, node):
-        if not self._epilogue and not self._in_inline_function:
+        if not self._epilogue and not self._inline_return:
             raise CompilerError(INTERNAL_COMPILER_ERR, node, "return encountered with epilogue being unset")
 
+        if self._inline_return:
+            output, end = self._inline_return
+            value = self.as_value(node.value, output)
+            if value != output:
+                self.ins_append("set", output, value)
+            self.ins_append(_Jump(end, "always"))
+            return
+
+        fn = self._functions[self._in_def]
+        call = node.value
+        if isinstance(call, ast.Call) and isinstance(call.func, ast.Name):
+            callee = self._functions.get(call.func.id)
+            if callee is not None and callee.argc == len(call.args) and callee.output == fn.output:
+                self.emit_tail_call(callee, call)
+                return
+
         val = self.as_value(node.value)
-        if self._in_inline_function:
-            self.ins_append(f"set {REG_RET} {val}")
-        else:
-            self.ins_append(f"set {REG_RET} {val}")
-            self.ins_append(_Jump(self._epilogue, "always"))
+        self.ins_append("set", fn.output, val)
+        self.ins_append(_Jump(self._epilogue, "always"))
 
     def visit_Expr(self, node):
         call = node.value
@@ -560,7 +1342,7 @@ class Compiler(ast.NodeVisitor):
                         v = self.as_value(kw.value)
                         # black cant handle match "ore" | "floor"
                         if kw.arg in ["ore", "floor"]:
-                            self.ins_append(f"setblock {kw.arg} {v} {x} {y}")
+                            self.ins_append("setblock", kw.arg, v, x, y)
                         elif kw.arg == "block":
                             block = v
                         elif kw.arg == "block_team":
@@ -572,7 +1354,7 @@ class Compiler(ast.NodeVisitor):
                             raise CompilerError(ERR_BAD_SYSCALL_ARGS, node)
                         if block_rotation == False:
                             block_rotation = 0
-                            self.ins_append(f"setblock block {block} {x} {y} {block_team} {block_rotation}")
+                            self.ins_append("setblock", "block", block, x, y, block_team, block_rotation)
                 else:
                     raise CompilerError(ERR_UNSUPPORTED_SYSCALL, node)
                 return
@@ -603,15 +1385,15 @@ class Compiler(ast.NodeVisitor):
                         raise CompilerError(ERR_BAD_SYSCALL_ARGS, node)
 
                     val = self.as_value(value.value)
-                    self.ins_append(f"print {val}")
+                    self.ins_append("print", val)
                 elif isinstance(value, ast.Constant):
                     val = self.as_value(value)
-                    self.ins_append(f"print {val}")
+                    self.ins_append("print", val)
                 else:
                     raise CompilerError(ERR_BAD_SYSCALL_ARGS, node)
         else:
             val = self.as_value(arg)
-            self.ins_append(f"print {val}")
+            self.ins_append("print", val)
 
         flush = True
         time = True
@@ -636,13 +1418,11 @@ class Compiler(ast.NodeVisitor):
             if flush in ["notify", "announce"] and isinstance(time, bool):
                 raise CompilerError(ERR_BAD_SYSCALL_ARGS, node)
             if flush in ["toast", "mission", "notify", "announce"]:
-                self.ins_append(
-                    f"message {flush}" + (" " + str(time) if not isinstance(time, bool) else "")
-                )
+                self.ins_append("message", flush, *([] if isinstance(time, bool) else [time]))
                 return
-            self.ins_append(f"printflush {flush}")
+            self.ins_append("printflush", flush)
         elif flush:
-            self.ins_append(f"printflush message1")
+            self.ins_append("printflush", "message1")
 
     def emit_sleep_syscall(self, node: ast.Call):
         if len(node.args) != 1:
@@ -651,7 +1431,7 @@ class Compiler(ast.NodeVisitor):
         arg = node.args[0]
         ms = self.as_value(arg)
 
-        self.ins_append(f"wait {ms}")
+        self.ins_append("wait", ms)
 
     def emit_screen_syscall(self, node: ast.Call):
         method = node.func.attr
@@ -660,7 +1440,7 @@ class Compiler(ast.NodeVisitor):
                 raise CompilerError(ERR_BAD_SYSCALL_ARGS, node)
 
             r, g, b = map(self.as_value, node.args)
-            self.ins_append(f"draw clear {r} {g} {b}")
+            self.ins_append("draw", "clear", r, g, b)
 
         elif method == "color":
             if len(node.args) == 3:
@@ -670,35 +1450,35 @@ class Compiler(ast.NodeVisitor):
             else:
                 raise CompilerError(ERR_BAD_SYSCALL_ARGS, node)
 
-            self.ins_append(f"draw color {r} {g} {b} {a}")
+            self.ins_append("draw", "color", r, g, b, a)
 
         elif method == "stroke":
             if len(node.args) != 1:
                 raise CompilerError(ERR_BAD_SYSCALL_ARGS, node)
 
             width = self.as_value(node.args[0])
-            self.ins_append(f"draw stroke {width}")
+            self.ins_append("draw", "stroke", width)
 
         elif method == "line":
             if len(node.args) != 4:
                 raise CompilerError(ERR_BAD_SYSCALL_ARGS, node)
 
             x0, y0, x1, y1 = map(self.as_value, node.args)
-            self.ins_append(f"draw line {x0} {y0} {x1} {y1}")
+            self.ins_append("draw", "line", x0, y0, x1, y1)
 
         elif method == "rect":
             if len(node.args) != 4:
                 raise CompilerError(ERR_BAD_SYSCALL_ARGS, node)
 
             x, y, width, height = map(self.as_value, node.args)
-            self.ins_append(f"draw rect {x} {y} {width} {height}")
+            self.ins_append("draw", "rect", x, y, width, height)
 
         elif method == "hollow_rect":
             if len(node.args) != 4:
                 raise CompilerError(ERR_BAD_SYSCALL_ARGS, node)
 
             x, y, width, height = map(self.as_value, node.args)
-            self.ins_append(f"draw lineRect {x} {y} {width} {height}")
+            self.ins_append("draw", "lineRect", x, y, width, height)
 
         elif method == "poly":
             if len(node.args) == 4:
@@ -708,7 +1488,7 @@ class Compiler(ast.NodeVisitor):
             else:
                 raise CompilerError(ERR_BAD_SYSCALL_ARGS, node)
 
-            self.ins_append(f"draw poly {x} {y} {sides} {radius} {rotation}")
+            self.ins_append("draw", "poly", x, y, sides, radius, rotation)
 
         elif method == "hollow_poly":
             if len(node.args) == 4:
@@ -718,31 +1498,31 @@ class Compiler(ast.NodeVisitor):
             else:
                 raise CompilerError(ERR_BAD_SYSCALL_ARGS, node)
 
-            self.ins_append(f"draw linePoly {x} {y} {sides} {radius} {rotation}")
+            self.ins_append("draw", "linePoly", x, y, sides, radius, rotation)
 
         elif method == "triangle":
             if len(node.args) != 6:
                 raise CompilerError(ERR_BAD_SYSCALL_ARGS, node)
 
             x0, y0, x1, y1, x2, y2 = map(self.as_value, node.args)
-            self.ins_append(f"draw triangle {x0} {y0} {x1} {y1} {x2} {y2}")
+            self.ins_append("draw", "triangle", x0, y0, x1, y1, x2, y2)
 
         # elif method == 'image':
         #     pass
 
         elif method == "flush":
             if len(node.args) == 0:
-                self.ins_append(f"drawflush display1")
+                self.ins_append("drawflush", "display1")
             elif len(node.args) == 1:
                 value = self.as_value(node.args[0])
-                self.ins_append(f"drawflush {value}")
+                self.ins_append("drawflush", value)
             else:
                 raise CompilerError(ERR_BAD_SYSCALL_ARGS, node)
 
         elif method == "col":
             if len(node.args) == 1:
                 value = self.as_value(node.args[0])
-                self.ins_append(f"draw col {value}")
+                self.ins_append("draw", "col", value)
 
         else:
             raise CompilerError(ERR_UNSUPPORTED_SYSCALL, node)
@@ -758,9 +1538,9 @@ class Compiler(ast.NodeVisitor):
 
                 if not isinstance(unit, str):
                     raise CompilerError(ERR_BAD_SYSCALL_ARGS, node)
-                self.ins_append(f"ubind @{unit}")
+                self.ins_append("ubind", f"@{unit}")
             elif isinstance(node.args[0], ast.Name):
-                self.ins_append(f"ubind {node.args[0].id}")
+                self.ins_append("ubind", node.args[0].id)
             else:
                 raise CompilerError(ERR_BAD_SYSCALL_ARGS, node)
 
@@ -768,68 +1548,68 @@ class Compiler(ast.NodeVisitor):
             if len(node.args) != 0:
                 raise CompilerError(ERR_BAD_SYSCALL_ARGS, node)
 
-            self.ins_append("ucontrol idle 0 0 0 0 0")
+            self.ins_append("ucontrol", "idle", "0", "0", "0", "0", "0")
 
         elif method == "stop":
             if len(node.args) != 0:
                 raise CompilerError(ERR_BAD_SYSCALL_ARGS, node)
 
-            self.ins_append("ucontrol stop 0 0 0 0 0")
+            self.ins_append("ucontrol", "stop", "0", "0", "0", "0", "0")
 
         elif method == "move":
             if len(node.args) != 2:
                 raise CompilerError(ERR_BAD_SYSCALL_ARGS, node)
 
             x, y = map(self.as_value, node.args)
-            self.ins_append(f"ucontrol move {x} {y} 0 0 0")
+            self.ins_append("ucontrol", "move", x, y, "0", "0", "0")
 
         elif method == "approach":
             if len(node.args) != 3:
                 raise CompilerError(ERR_BAD_SYSCALL_ARGS, node)
 
             x, y, r = map(self.as_value, node.args)
-            self.ins_append(f"ucontrol approach {x} {y} {r} 0 0")
+            self.ins_append("ucontrol", "approach", x, y, r, "0", "0")
 
         elif method == "boost":
             if len(node.args) != 1:
                 raise CompilerError(ERR_BAD_SYSCALL_ARGS, node)
 
             enable = self.as_value(node.args[0])
-            self.ins_append(f"ucontrol boost {enable} 0 0 0 0")
+            self.ins_append("ucontrol", "boost", enable, "0", "0", "0", "0")
 
         elif method == "pathfind":
             if len(node.args) != 2:
                 raise CompilerError(ERR_BAD_SYSCALL_ARGS, node)
 
             x, y = map(self.as_value, node.args)
-            self.ins_append(f"ucontrol pathfind {x} {y}")
+            self.ins_append("ucontrol", "pathfind", x, y)
 
         elif method == "shoot":
             if len(node.args) == 0:
-                self.ins_append(f"ucontrol targetp @unit 1 0 0 0")
+                self.ins_append("ucontrol", "targetp", "@unit", "1", "0", "0", "0")
             elif len(node.args) == 2:
                 x, y = map(self.as_value, node.args)
-                self.ins_append(f"ucontrol target {x} {y} 1 0 0")
+                self.ins_append("ucontrol", "target", x, y, "1", "0", "0")
             else:
                 raise CompilerError(ERR_BAD_SYSCALL_ARGS, node)
 
         elif method == "target":
             if len(node.args) == 2:
                 x, y = map(self.as_value, node.args)
-                self.ins_append(f"ucontrol target {x} {y} 0 0 0")
+                self.ins_append("ucontrol", "target", x, y, "0", "0", "0")
             elif len(node.args) == 3:
                 x, y, shoot = map(self.as_value, node.args)
-                self.ins_append(f"ucontrol target {x} {y} {shoot} 0 0")
+                self.ins_append("ucontrol", "target", x, y, shoot, "0", "0")
             else:
                 raise CompilerError(ERR_BAD_SYSCALL_ARGS, node)
 
         elif method == "target_unit":
             if len(node.args) == 1:
                 (unit,) = map(self.as_value, node.args)
-                self.ins_append(f"ucontrol targetp {unit} 1 0 0 0")
+                self.ins_append("ucontrol", "targetp", unit, "1", "0", "0", "0")
             elif len(node.args) == 2:
                 unit, shoot = map(self.as_value, node.args)
-                self.ins_append(f"ucontrol targetp {unit} {shoot} 0 0 0")
+                self.ins_append("ucontrol", "targetp", unit, shoot, "0", "0", "0")
             else:
                 raise CompilerError(ERR_BAD_SYSCALL_ARGS, node)
 
@@ -837,7 +1617,7 @@ class Compiler(ast.NodeVisitor):
             if len(node.args) != 0:
                 raise CompilerError(ERR_BAD_SYSCALL_ARGS, node)
 
-            self.ins_append("ucontrol target 0 0 0 0 0")
+            self.ins_append("ucontrol", "target", "0", "0", "0", "0", "0")
 
         elif method == "fetch":
             if len(node.args) not in (2, 3):
@@ -847,7 +1627,7 @@ class Compiler(ast.NodeVisitor):
             item = self.as_value(node.args[1])
             amount = self.as_value(node.args[2]) if len(node.args) == 3 else 1
 
-            self.ins_append(f"ucontrol itemTake {source} {item} {amount} 0 0")
+            self.ins_append("ucontrol", "itemTake", source, item, amount, "0", "0")
 
         elif method == "store":
             if len(node.args) not in (1, 2):
@@ -856,49 +1636,49 @@ class Compiler(ast.NodeVisitor):
             sink = self.as_value(node.args[0])
             amount = self.as_value(node.args[1]) if len(node.args) == 2 else 1
 
-            self.ins_append(f"ucontrol itemDrop {sink} {amount} 0 0 0")
+            self.ins_append("ucontrol", "itemDrop", sink, amount, "0", "0", "0")
 
         elif method == "lift":
             if len(node.args) != 0:
                 raise CompilerError(ERR_BAD_SYSCALL_ARGS, node)
 
-            self.ins_append("ucontrol payTake takeUnits 0 0 0 0")
+            self.ins_append("ucontrol", "payTake", "takeUnits", "0", "0", "0", "0")
 
         elif method == "carry":
             if len(node.args) != 0:
                 raise CompilerError(ERR_BAD_SYSCALL_ARGS, node)
 
-            self.ins_append("ucontrol payTake takeUnits 0 0 0 0")
+            self.ins_append("ucontrol", "payTake", "takeUnits", "0", "0", "0", "0")
 
         elif method == "drop":
             if len(node.args) != 0:
                 raise CompilerError(ERR_BAD_SYSCALL_ARGS, node)
 
-            self.ins_append("ucontrol payDrop 0 0 0 0 0")
+            self.ins_append("ucontrol", "payDrop", "0", "0", "0", "0", "0")
 
         elif method == "mine":
             if len(node.args) != 2:
                 raise CompilerError(ERR_BAD_SYSCALL_ARGS, node)
 
             x, y = map(self.as_value, node.args)
-            self.ins_append(f"ucontrol mine {x} {y} 0 0 0")
+            self.ins_append("ucontrol", "mine", x, y, "0", "0", "0")
 
         elif method == "build":
             if len(node.args) == 3:
                 x, y, block = map(self.as_value, node.args)
-                self.ins_append(f"ucontrol build {x} {y} {block} 0 0")
+                self.ins_append("ucontrol", "build", x, y, block, "0", "0")
             elif len(node.args) == 4:
                 x, y, block, rotation = map(self.as_value, node.args)
-                self.ins_append(f"ucontrol build {x} {y} {block} {rotation} 0")
+                self.ins_append("ucontrol", "build", x, y, block, rotation, "0")
             elif len(node.args) == 5:
                 x, y, block, rotation, config = map(self.as_value, node.args)
-                self.ins_append(f"ucontrol build {x} {y} {block} {rotation} {config}")
+                self.ins_append("ucontrol", "build", x, y, block, rotation, config)
             else:
                 raise CompilerError(ERR_BAD_SYSCALL_ARGS, node)
         elif method == "unbind":
             if len(node.args) > 0:
                 raise CompilerError(ERR_BAD_SYSCALL_ARGS, node)
-            self.ins_append("ucontrol unbind")
+            self.ins_append("ucontrol", "unbind")
         else:
             raise CompilerError(ERR_UNSUPPORTED_SYSCALL, node)
 
@@ -908,32 +1688,32 @@ class Compiler(ast.NodeVisitor):
             if len(node.args) != 2:
                 raise CompilerError(ERR_BAD_SYSCALL_ARGS, node)
             team, index = map(self.as_value, node.args)
-            self.ins_append(f"fetch player {var} {team} {index}")
+            self.ins_append("fetch", "player", var, team, index)
             return True
         if method == "fetch_unit":
             if len(node.args) != 2:
                 raise CompilerError(ERR_BAD_SYSCALL_ARGS, node)
             team, index = map(self.as_value, node.args)
-            self.ins_append(f"fetch unit {var} {team} {index}")
+            self.ins_append("fetch", "unit", var, team, index)
         elif method == "unit_count":
             if len(node.args) != 1:
                 raise CompilerError(ERR_BAD_SYSCALL_ARGS, node)
             team = self.as_value(node.args[0])
-            self.ins_append(f"fetch unitCount {var} {team}")
+            self.ins_append("fetch", "unitCount", var, team)
         elif method == "player_count":
             if len(node.args) != 1:
                 raise CompilerError(ERR_BAD_SYSCALL_ARGS, node)
             team = self.as_value(node.args[0])
-            self.ins_append(f"fetch playerCount {var} {team}")
+            self.ins_append("fetch", "playerCount", var, team)
         elif method == "spawn_unit":
             if len(node.args) != 5:
                 raise CompilerError(ERR_BAD_SYSCALL_ARGS, node)
             ty, x, y, team, rot = map(self.as_value, node.args)
-            self.ins_append(f"spawn {ty} {x} {y} {rot} {team} {var}")
+            self.ins_append("spawn", ty, x, y, rot, team, var)
         elif method == "get_flag":
             if len(node.args) != 1:
                 raise CompilerError(ERR_BAD_SYSCALL_ARGS, node)
-            self.ins_append(f"getflag {var} {self.as_value(node.args[0])}")
+            self.ins_append("getflag", var, self.as_value(node.args[0]))
         else:
             return False
         return True
@@ -941,38 +1721,38 @@ class Compiler(ast.NodeVisitor):
     def emit_world_syscall_standalone(self, node: ast.Call):
         method = node.func.attr
         if method == "spawn_natural_wave":
-            self.ins_append("spawnwave 0 0 true")
+            self.ins_append("spawnwave", "0", "0", "true")
         elif method == "spawn_wave":
             if len(node.args) != 2:
                 raise CompilerError(ERR_BAD_SYSCALL_ARGS, node)
             x, y = map(self.as_value, node.args)
-            self.ins_append(f"spawnwave {x} {y} false")
+            self.ins_append("spawnwave", x, y, "false")
         elif method == "apply_status":
             if len(node.args) != 3:
                 raise CompilerError(ERR_BAD_SYSCALL_ARGS, node)
             unit, status, length = map(self.as_value, node.args)
-            self.ins_append(f"status false {status} {unit} {length}")
+            self.ins_append("status", "false", status, unit, length)
         elif method == "clear_status":
             if len(node.args) != 2:
                 raise CompilerError(ERR_BAD_SYSCALL_ARGS, node)
             unit, status = map(self.as_value, node.args)
-            self.ins_append(f"status true {status} {unit} 0")
+            self.ins_append("status", "true", status, unit, "0")
         elif method == "set_rate":
             if len(node.args) != 1:
                 raise CompilerError(ERR_BAD_SYSCALL_ARGS, node)
-            self.ins_append(f"setrate {self.as_value(node.args[0])}")
+            self.ins_append("setrate", self.as_value(node.args[0]))
         elif method == "camera_pan":
             if len(node.args) != 3:
                 raise CompilerError(ERR_BAD_SYSCALL_ARGS, node)
             x, y, speed = map(self.as_value, node.args)
-            self.ins_append(f"cutscene pan {x} {y} {speed}")
+            self.ins_append("cutscene", "pan", x, y, speed)
         elif method == "camera_zoom":
             if len(node.args) != 1:
                 raise CompilerError(ERR_BAD_SYSCALL_ARGS, node)
             level = self.as_value(node.args[0])
-            self.ins_append(f"cutscene zoom {level}")
+            self.ins_append("cutscene", "zoom", level)
         elif method == "camera_stop":
-            self.ins_append(f"cutscene stop")
+            self.ins_append("cutscene", "stop")
         elif method == "create_explosion":
             if len(node.args) != 5:
                 raise CompilerError(ERR_BAD_SYSCALL_ARGS, node)
@@ -988,17 +1768,15 @@ class Compiler(ast.NodeVisitor):
                     raise CompilerError(ERR_BAD_SYSCALL_ARGS, node)
                 exec(f"{kw.arg} = {kw.value.value}")
 
-            self.ins_append(
-                f"explosion {team} {x} {y} {radius} {damage} {hits_air} {hits_ground} {piercing}"
-            )
+            self.ins_append("explosion", team, x, y, radius, damage, hits_air, hits_ground, piercing)
         elif method == "set_flag":
             if len(node.args) != 1:
                 raise CompilerError(ERR_BAD_SYSCALL_ARGS, node)
-            self.ins_append(f"setflag {self.as_value(node.args[0])} true")
+            self.ins_append("setflag", self.as_value(node.args[0]), "true")
         elif method == "unset_flag":
             if len(node.args) != 1:
                 raise CompilerError(ERR_BAD_SYSCALL_ARGS, node)
-            self.ins_append(f"setflag {self.as_value(node.args[0])} false")
+            self.ins_append("setflag", self.as_value(node.args[0]), "false")
         else:
             raise CompilerError(ERR_UNSUPPORTED_SYSCALL, node)
 
@@ -1012,17 +1790,17 @@ class Compiler(ast.NodeVisitor):
                 raise CompilerError(ERR_BAD_SYSCALL_ARGS, node)
             ty, team = map(self.as_value, node.args)
             if ty[1:-1] == "core":
-                self.ins_append(f"fetch coreCount {var} {team}")
+                self.ins_append("fetch", "coreCount", var, team)
                 return True
-            self.ins_append(f"fetch buildCount {var} {team} {ty}")
+            self.ins_append("fetch", "buildCount", var, team, ty)
         elif method == "index":
             if len(node.args) != 3:
                 raise CompilerError(ERR_BAD_SYSCALL_ARGS, node)
             ty, team, index = map(self.as_value, node.args)
             if ty[1:-1] == "core":
-                self.ins_append(f"fetch core {var} {team} {index}")
+                self.ins_append("fetch", "core", var, team, index)
                 return True
-            self.ins_append(f"fetch build {var} {team} {index} {ty}")
+            self.ins_append("fetch", "build", var, team, index, ty)
         else:
             return False
         return True
@@ -1035,7 +1813,7 @@ class Compiler(ast.NodeVisitor):
                 raise CompilerError(ERR_BAD_SYSCALL_ARGS, node)
 
             enabled = self.as_value(node.args[0])
-            self.ins_append(f"control enabled {link} {enabled}")
+            self.ins_append("control", "enabled", link, enabled)
         elif method == "shoot":
             if len(node.args) == 2:
                 x, y, enabled = *map(self.as_value, node.args), 1
@@ -1044,23 +1822,23 @@ class Compiler(ast.NodeVisitor):
             else:
                 raise CompilerError(ERR_BAD_SYSCALL_ARGS, node)
 
-            self.ins_append(f"control shoot {link} {x} {y} {enabled}")
+            self.ins_append("control", "shoot", link, x, y, enabled)
         elif method == "ceasefire":
             if len(node.args) != 0:
                 raise CompilerError(ERR_BAD_SYSCALL_ARGS, node)
 
-            self.ins_append(f"control shoot {link} 0 0 0")
+            self.ins_append("control", "shoot", link, "0", "0", "0")
         elif method == "color":
             if len(node.args) == 1:
                 color = self.as_value(node.args[0])
             else:
                 raise CompilerError(ERR_BAD_SYSCALL_ARGS, node)
 
-            self.ins_append(f"control color {link} {color} 0 0 0")
+            self.ins_append("control", "color", link, color, "0", "0", "0")
         elif method == "config":
             if len(node.args) != 1:
                 raise CompilerError(ERR_BAD_SYSCALL_ARGS, node)
-            self.ins_append(f"control config {link} {self.as_value(node.args[0])}")
+            self.ins_append("control", "config", link, self.as_value(node.args[0]))
         else:
             return False
 
@@ -1086,7 +1864,6 @@ class Compiler(ast.NodeVisitor):
             outputs.insert(
                 2, outputs.pop(0)
             )  # we do "found x y building" but the game expects "x y found building"
-            output = " ".join(outputs)
 
             enemy = "true" if node.args[0].value == "enemy" else "false"
             kind = node.keywords[0]
@@ -1095,14 +1872,14 @@ class Compiler(ast.NodeVisitor):
                 if not isinstance(kind.value, ast.Constant):
                     raise CompilerError(ERR_BAD_SYSCALL_ARGS, kind.value)
 
-                self.ins_append(f"ulocate building {kind.value.value} {enemy} @copper {output}")
+                self.ins_append("ulocate", "building", kind.value.value, enemy, "@copper", *outputs)
             elif kind.arg == "ore":
                 ore = self.as_value(kind.value)
-                self.ins_append(f"ulocate ore core {enemy} {ore} {output}")
+                self.ins_append("ulocate", "ore", "core", enemy, ore, *outputs)
             elif kind.arg == "spawn":
-                self.ins_append(f"ulocate spawn core {enemy} @copper {output}")
+                self.ins_append("ulocate", "spawn", "core", enemy, "@copper", *outputs)
             elif kind.arg == "damaged":
-                self.ins_append(f"ulocate damaged core {enemy} @copper {output}")
+                self.ins_append("ulocate", "damaged", "core", enemy, "@copper", *outputs)
             else:
                 raise CompilerError(ERR_BAD_SYSCALL_ARGS, node)
 
@@ -1113,10 +1890,10 @@ class Compiler(ast.NodeVisitor):
                 raise CompilerError(ERR_BAD_TUPLE_ASSIGN, node)
             x, y = map(self.as_value, node.args)
             if len(outputs) == 1:
-                output = "0 " + outputs[0]
+                outputs = ["0", outputs[0]]
             else:
-                output = " ".join(outputs[::-1])
-            self.ins_append(f"ucontrol getBlock {x} {y} {output} 0")
+                outputs = outputs[::-1]
+            self.ins_append("ucontrol", "getBlock", x, y, *outputs, "0")
         else:
             raise CompilerError(ERR_UNSUPPORTED_SYSCALL, node)
 
@@ -1127,7 +1904,7 @@ class Compiler(ast.NodeVisitor):
                 raise CompilerError(ERR_BAD_SYSCALL_ARGS, node)
 
             enabled = self.as_value(node.args[0])
-            self.ins_append(f"control enabled {link} {enabled}")
+            self.ins_append("control", "enabled", link, enabled)
         elif method == "shoot":
             if len(node.args) == 2:
                 x, y, enabled = *map(self.as_value, node.args), 1
@@ -1136,12 +1913,12 @@ class Compiler(ast.NodeVisitor):
             else:
                 raise CompilerError(ERR_BAD_SYSCALL_ARGS, node)
 
-            self.ins_append(f"control shoot {link} {x} {y} {enabled}")
+            self.ins_append("control", "shoot", link, x, y, enabled)
         elif method == "ceasefire":
             if len(node.args) != 0:
                 raise CompilerError(ERR_BAD_SYSCALL_ARGS, node)
 
-            self.ins_append(f"control shoot {link} 0 0 0")
+            self.ins_append("control", "shoot", link, "0", "0", "0")
         else:
             return False
 
@@ -1154,30 +1931,41 @@ class Compiler(ast.NodeVisitor):
         If a temporary variable needs to be created, it will be called `output`.
         If `output` is not set, it will be a random name.
         """
+        if node in self._induction:
+            return self._induction[node]
+
         if output is None:
             output = self._tmp_var_name()
+        else:
+            output = _Variable(output)
+
+        if not isinstance(node, (ast.Constant, ast.Name)):
+            value = _fold(node)
+            literal = None if value is None else _number_literal(value)
+            if literal is not None:
+                return literal
 
         if isinstance(node, ast.Constant):
             # true, 1.23, "string", 4j
             if isinstance(node.value, bool):
-                return ("false", "true")[node.value]
+                return _Literal(("false", "true")[node.value])
             elif isinstance(node.value, (int, float)):
-                return str(node.value)
+                return _Literal(node.value)
             elif node.value is None:
-                return "null"
+                return _Literal("null")
             elif isinstance(node.value, str):
                 if (
                     len(str(node.value)) == 7 or len(str(node.value)) == 9
                 ):  # HEX COLORS: If seperate to prevent IndexError
                     if str(node.value)[0] == "%" and all(c in hexdigits for c in str(node.value)[1:]):
-                        return "".join(c for c in node.value if c >= " " and c != '"')
-                return '"' + "".join(c for c in node.value if c >= " " and c != '"') + '"'
+                        return _Literal("".join(c for c in node.value if c >= " " and c != '"'))
+                return _Literal('"' + "".join(c for c in node.value if c >= " " and c != '"') + '"')
             else:
                 raise CompilerError(ERR_COMPLEX_VALUE, node)
 
         elif isinstance(node, ast.Name):
             # foo, bar
-            return node.id
+            return _Variable(node.id)
 
         elif isinstance(node, ast.Attribute):
             # Env.copper
@@ -1188,10 +1976,10 @@ class Compiler(ast.NodeVisitor):
             if obj == "Env":
                 if node.attr == "ips":
                     # Special-case: instruction per second require a calculation
-                    self.ins_append(f"op mul {output} @ipt 60")
+                    self.ins_append("op", "mul", output, "@ipt", "60")
                     return output
 
-                return _name_as_env(node.attr)
+                return _Builtin(_name_as_env(node.attr))
 
             # Unit is special-cased.
             if obj == "Unit":
@@ -1200,7 +1988,7 @@ class Compiler(ast.NodeVisitor):
 
             attr = _name_as_res(node.attr)
 
-            self.ins_append(f"sensor {output} {obj} {attr}")
+            self.ins_append("sensor", output, obj, attr)
             return output
 
         elif isinstance(node, ast.Subscript):
@@ -1209,12 +1997,12 @@ class Compiler(ast.NodeVisitor):
             if isinstance(node.value, ast.Attribute) and node.value.value.id == "Mem":
                 cell = node.value.attr
                 val = self.as_value(node.slice)
-                self.ins_append(f"read {output} {cell} {val}")
+                self.ins_append("read", output, cell, val)
                 return output
 
             if isinstance(node.value, ast.Name) and node.value.id == "Link":
                 val = self.as_value(node.slice)
-                self.ins_append(f"getlink {output} {val}")
+                self.ins_append("getlink", output, val)
                 return output
 
             # container1[dynamic_res]
@@ -1227,7 +2015,24 @@ class Compiler(ast.NodeVisitor):
             else:
                 attr = _name_as_res(self.as_value(node.slice))
 
-            self.ins_append(f"sensor {output} {obj} {attr}")
+            self.ins_append("sensor", output, obj, attr)
+            return output
+
+        if _is_condition(node):
+            # a and (b or not c): the outcome is 1 or 0, and operands are only evaluated if needed.
+            done_label = _Label()
+            if _may_read(node, output):
+                false_label = _Label()
+                self.conditional_jump(false_label, node, jump_if_test=False)
+                self.ins_append("set", output, "true")
+                self.ins_append(_Jump(done_label, "always"))
+                self.ins_append(false_label)
+                self.ins_append("set", output, "false")
+            else:
+                self.ins_append("set", output, "false")
+                self.conditional_jump(done_label, node, jump_if_test=False)
+                self.ins_append("set", output, "true")
+            self.ins_append(done_label)
             return output
 
         if isinstance(node, ast.UnaryOp):
@@ -1248,17 +2053,29 @@ class Compiler(ast.NodeVisitor):
                     raise CompilerError(ERR_UNSUPPORTED_OP, node, op=op.__class__.__name__)
 
                 return self.as_value(ast.Constant(value=value))
+            elif (
+                op == ast.Not
+                and isinstance(node.operand, ast.Compare)
+                and type(node.operand.ops[0]) in BIN_CMP
+            ):
+                # not a < b -> a >= b
+                test = node.operand
+                cmp = NEGATED_BIN_CMP[BIN_CMP[type(test.ops[0])]]
+                self.ins_append(
+                    "op", cmp, output, self.as_value(test.left), self.as_value(test.comparators[0])
+                )
+                return output
             else:
                 operand = self.as_value(node.operand)
                 # No map here because Mindustry lacks some of these as unary (emulated as binary).
                 if op == ast.Invert:
-                    self.ins_append(f"op flip {output} {operand}")
+                    self.ins_append("op", "flip", output, operand)
                 elif op == ast.Not:
-                    self.ins_append(f"op equal {output} 0 {operand}")
+                    self.ins_append("op", "equal", output, "0", operand)
                 elif op == ast.UAdd:
-                    self.ins_append(f"op add {output} 0 {operand}")
+                    self.ins_append("op", "add", output, "0", operand)
                 elif op == ast.USub:
-                    self.ins_append(f"op sub {output} 0 {operand}")
+                    self.ins_append("op", "sub", output, "0", operand)
                 else:
                     raise CompilerError(ERR_UNSUPPORTED_OP, node, op.__class__.__name__)
 
@@ -1272,29 +2089,48 @@ class Compiler(ast.NodeVisitor):
 
             left = self.as_value(node.left)
             right = self.as_value(node.right)
-            self.ins_append(f"op {op} {output} {left} {right}")
+            self.ins_append("op", op, output, left, right)
             return output
 
         elif isinstance(node, ast.Compare):
-            # 1 < 2 (<3)?
-            # see [conditional_jump] for comments
-            self.ins_append(
-                f"op {BIN_CMP.get(type(node.ops.pop(0)))} {output} {self.as_value(node.left)} {self.as_value(node.comparators.pop(0))}"
-            )
-            for i, op in enumerate(node.ops):
-                self.ins_append(
-                    f"op {BIN_CMP.get(type(op))} {output} {output} {self.as_value(node.comparators[i])}"
-                )
+            # 1 < 2 (chained comparisons are conditions, see above)
+            cmp = BIN_CMP.get(type(node.ops[0]))
+            if cmp is None:
+                raise CompilerError(ERR_UNSUPPORTED_OP, node, op=node.ops[0].__class__.__name__)
+
+            self.ins_append("op", cmp, output, self.as_value(node.left), self.as_value(node.comparators[0]))
             return output
 
         elif isinstance(node, ast.IfExp):
+            value = _fold(node.test)
+            if value is not None:
+                return self.as_value(node.body if _truthy(value) else node.orelse, output)
+
+            extreme = _min_max(node)
+            if extreme is not None:
+                # x if x < high else high -> op min x high
+                op, a, b = extreme
+                self.ins_append("op", op, output, self.as_value(a), self.as_value(b))
+                return output
+
+            if self.supports("select") and _is_plain(node.body) and _is_plain(node.orelse):
+                test = node.test
+                if isinstance(test, ast.Compare) and len(test.ops) == 1 and type(test.ops[0]) in BIN_CMP:
+                    cmp = BIN_CMP[type(test.ops[0])]
+                    left, right = self.as_value(test.left), self.as_value(test.comparators[0])
+                else:
+                    left, cmp, right = self.as_value(test), "notEqual", "0"
+                body, orelse = self.as_value(node.body), self.as_value(node.orelse)
+                self.ins_append("select", output, cmp, left, right, body, orelse)
+                return output
+
             return_label = _Label()
             fail_label = _Label()
             self.conditional_jump(fail_label, node.test, jump_if_test=False)
-            self.ins_append(f"set {output} {self.as_value(node.body)}")
+            self.ins_append("set", output, self.as_value(node.body))
             self.ins_append(_Jump(return_label, "always"))
             self.ins_append(fail_label)
-            self.ins_append(f"set {output} {self.as_value(node.orelse)}")
+            self.ins_append("set", output, self.as_value(node.orelse))
             self.ins_append(return_label)
             return output
 
@@ -1315,19 +2151,12 @@ class Compiler(ast.NodeVisitor):
                         plural2=plural(argc),
                     )
 
-                operands = " ".join(self.as_value(arg) for arg in node.args)
-                self.ins_append(f"op {function} {output} {operands}")
+                operands = [self.as_value(arg) for arg in node.args]
+                self.ins_append("op", function, output, *operands)
                 return output
 
-            elif node.func.id in self._inline_functions:
-                body = self._inline_functions[node.func.id]
-                self._in_inline_function = True
-                for subnode in body:
-                    self.visit(subnode)
-                self._in_inline_function = False
-                return REG_RET
             else:
-                fn = self._functions.get(node.func.id)
+                fn = self._inline_functions.get(node.func.id) or self._functions.get(node.func.id)
                 if fn is None:
                     raise CompilerError(ERR_NO_DEF, node, a=node.func.id)
 
@@ -1342,15 +2171,10 @@ class Compiler(ast.NodeVisitor):
                         plural2=plural(fn.argc),
                     )
 
-                for arg in node.args:
-                    val = self.as_value(arg)
-                    self.ins_append(f"write {val} cell1 {REG_STACK}")
-                    self.ins_append(f"op add {REG_STACK} {REG_STACK} 1")
-
-                self.ins_append(f"write @counter cell1 {REG_STACK}")
-                self.ins_append(_Jump(fn.start, "always"))
-                # Expressions may be very complex elsewhere, make sure `REG_RET` is not overwritten.
-                self.ins_append(f"set {output} {REG_RET}")
+                if fn.body is not None:
+                    self.emit_inline_call(fn, node, output)
+                else:
+                    self.emit_call(fn, node, output)
                 return output
         elif isinstance(node, ast.Call) and isinstance(node.func.value, ast.Attribute):
             ns = node.func.value.value.id + "." + node.func.value.attr
@@ -1374,7 +2198,7 @@ class Compiler(ast.NodeVisitor):
                 method: str = node.func.attr
                 if method.startswith("get"):
                     ty = method.removeprefix("get_")
-                    self.ins_append(f"getblock {ty} {output} {x} {y}")
+                    self.ins_append("getblock", ty, output, x, y)
                     return output
             raise CompilerError(ERR_UNSUPPORTED_EXPR, node)
 
@@ -1399,7 +2223,7 @@ class Compiler(ast.NodeVisitor):
                     raise CompilerError(ERR_BAD_SYSCALL_ARGS, node)
 
                 x, y, r = map(self.as_value, node.args)
-                self.ins_append(f"ucontrol within {x} {y} {r} {output} 0")
+                self.ins_append("ucontrol", "within", x, y, r, output, "0")
                 return output
             else:
                 raise CompilerError(ERR_UNSUPPORTED_SYSCALL, node)
@@ -1408,18 +2232,41 @@ class Compiler(ast.NodeVisitor):
 
     def generate_masm(self):
         # Fill labels' line numbers
+        linenos = {}
         lineno = 0
         for ins in self._ins:
             if isinstance(ins, _Label):
-                ins._lineno = lineno
-            else:
-                lineno += 1
+                linenos[ins] = lineno
+            lineno += _size(ins)
 
-        if lineno > MAX_INSTRUCTIONS:
-            raise CompilerError(ERR_TOO_LONG, ast.Module(lineno=0, col_offset=0))
+        # Jumps past the last line do nothing, so jumping to the end is starting over instead.
+        linenos = {label: 0 if line == lineno else line for label, line in linenos.items()}
+
+        if lineno > self.target.max_instructions:
+            raise CompilerError(ERR_TOO_LONG, ast.Module(lineno=0, col_offset=0), target=self.target.name)
 
         # Final output is all instructions ignoring labels
-        return "\n".join(str(i) for i in self._ins if not isinstance(i, _Label)) + "\nend\n"
+        lines = []
+        for ins in self._ins:
+            labels = (
+                ins.labels if isinstance(ins, _JumpTable) else [ins.label] if isinstance(ins, _Jump) else []
+            )
+            if any(label not in linenos for label in labels):
+                raise CompilerError(
+                    INTERNAL_COMPILER_ERR,
+                    None,
+                    "lineno should be set. some instruction likely referenced this unstored label",
+                )
+
+            if isinstance(ins, _Jump):
+                lines.append(" ".join((ins.op, str(linenos[ins.label]), *ins.args)))
+            elif isinstance(ins, _JumpTable):
+                lines.append(" ".join(("op", "add", "@counter", "@counter", *ins.args)))
+                lines.extend(f"jump {linenos[label]} always" for label in labels)
+            elif not isinstance(ins, _Label):
+                lines.append(" ".join((ins.op, *ins.args)))
+
+        return "\n".join(lines or ["end"]) + "\n"
 
 
 def plural(n: int):
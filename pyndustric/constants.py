@@ -17,6 +17,8 @@ ERR_ARGC_MISMATCH = "ArgumentsError"
 ERR_TOO_LONG = "OverflowError"
 ERR_INVALID_SOURCE = "CompilerError"
 ERR_BAD_TUPLE_ASSIGN = "BadTupleError"
+ERR_UNSUPPORTED_PATTERN = "UnsupportedPatternError"
+ERR_UNAVAILABLE_INSTRUCTION = "UnavailableInstructionError"
 INTERNAL_COMPILER_ERR = "InternalCompilerError"
 
 
@@ -35,9 +37,11 @@ ERROR_DESCRIPTIONS = {
     ERR_REDEF: 'cannot define the function "{a}" twice',
     ERR_NO_DEF: 'function "{a}" has not been defined',
     ERR_ARGC_MISMATCH: 'used {n1} argument{plural1} calling function "{called}"; "{called}" defined with {n2} argument{plural2}',
-    ERR_TOO_LONG: "the program is too long to fit in a logic processor",
+    ERR_TOO_LONG: "the program is too long to fit in a {target} processor",
     ERR_INVALID_SOURCE: "the provided source type to compile is not supported",
     ERR_BAD_TUPLE_ASSIGN: "can only assign to a tuple if the right-hand side is a tuple of the same length",
+    ERR_UNSUPPORTED_PATTERN: "unsupported pattern `{unparsed}`",
+    ERR_UNAVAILABLE_INSTRUCTION: "the instruction `{a}` is not available on {target} processors",
     INTERNAL_COMPILER_ERR: "internal compiler error",
 }
 
@@ -59,8 +63,6 @@ NEGATED_BIN_CMP = {
     "greaterThanEq": "lessThan",
     "greaterThan": "lessThanEq",
     "lessThanEq": "greaterThan",
-    "and": "nand",
-    "or": "nor",
 }
 
 BIN_OPS = {
@@ -158,13 +160,62 @@ RES_MAP = {
     "payload_type": "@payloadType",
 }
 
+# Environment values (from `ENV_MAP`) which don't change while the processor runs.
+INVARIANT_ENV = {"this", "x", "y", "link_count", "width", "height"}
+
+# Resources (from `RES_MAP`) which never change for a given block, so that sensing them can be
+# done once before a loop rather than on every iteration. Add to it to move more sensors out.
+INVARIANT_RES = {"max_items", "max_liquids", "max_power", "max_ammo", "max_health", "size", "type"}
+
 ALLOWED_DECORATORS = ("inline",)
 
 REG_STACK = "__pyc_sp"
 REG_RET = "__pyc_ret"
 REG_RET_COUNTER_PREFIX = "__pyc_rc_"
 REG_IT_FMT = "__pyc_it_{}_{}"
+REG_IV_FMT = "__pyc_iv_{}_{}"  # line of the loop, number of the induction variable
 REG_TMP_FMT = "__pyc_tmp_{}"
+REG_LOCAL_FMT = "__pyc_{}_{}"  # function, variable
+
+# Instructions which are only available from a given version of mlog.
+OPCODE_VERSIONS = {"select": 8}
+MLOG_VERSION = 7  # version of mlog the code is generated for by default
+
+# Instructions which only world processors can run.
+PRIVILEGED_OPCODES = {
+    "getblock",
+    "setblock",
+    "spawn",
+    "status",
+    "spawnwave",
+    "setrule",
+    "message",
+    "cutscene",
+    "effect",
+    "explosion",
+    "setrate",
+    "fetch",
+    "sync",
+    "getflag",
+    "setflag",
+    "setprop",
+    "playsound",
+    "setmarker",
+    "makemarker",
+    "localeprint",
+}
 
 # https://github.com/Anuken/Mindustry/blob/ab19e6f/core/src/mindustry/logic/LExecutor.java#L28
 MAX_INSTRUCTIONS = 1000
+
+# How many instructions the copies of a function may take when automatically inlining it (unless
+# the target processor sets another budget).
+INLINE_BUDGET = MAX_INSTRUCTIONS // 20
+
+# How many different integers a `match` or `if`/`elif` chain must compare a value to before a
+# jump table is used to go straight to the right case (at least half of its entries must be used).
+JUMP_TABLE_MIN_CASES = 4
+
+# How many more instructions unrolling the loops of a program may take (unless the target processor
+# sets another budget).
+UNROLL_BUDGET = MAX_INSTRUCTIONS // 10
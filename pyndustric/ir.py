@@ -0,0 +1,334 @@
+"""
+Intermediate representation of the compiled program.
+
+The compiler lowers Python code into a flat list of `_Instruction`, each made of an opcode and
+a list of typed operands. Only `Compiler.generate_masm` turns this list into mlog text.
+"""
+
+import math
+
+from .constants import *
+
+
+class _Operand(str):
+    """
+    Represents an operand of a mlog instruction. Its value is the text used to represent it in mlog.
+    """
+
+    __slots__ = ()
+
+    def __repr__(self):
+        return f"{self.__class__.__name__[1:]}({str.__repr__(self)})"
+
+
+class _Variable(_Operand):
+    """
+    Represents a variable, either user-defined or one of the compiler registers.
+    """
+
+    __slots__ = ()
+
+
+class _Literal(_Operand):
+    """
+    Represents a constant value: numbers, strings, colors, `true`, `false` and `null`.
+    """
+
+    __slots__ = ()
+
+
+class _Builtin(_Operand):
+    """
+    Represents one of Mindustry's built-in variables or constants, those starting with `@`.
+    """
+
+    __slots__ = ()
+
+
+class _Keyword(_Operand):
+    """
+    Represents a fixed word selecting the mode of an instruction, such as `add` in `op add`.
+    """
+
+    __slots__ = ()
+
+
+_LITERAL_WORDS = {"true", "false", "null"}
+
+
+def _operand(value) -> _Operand:
+    """
+    Classifies the text of an operand the same way mlog does when parsing it.
+    """
+    if isinstance(value, _Operand):
+        return value
+
+    value = str(value)
+    if value.startswith("@"):
+        return _Builtin(value)
+
+    if value.startswith(('"', "%")) or value in _LITERAL_WORDS:
+        return _Literal(value)
+
+    try:
+        float(value)
+        return _Literal(value)
+    except ValueError:
+        return _Variable(value)
+
+
+# Amount of leading operands which are keywords rather than values.
+_KEYWORD_COUNT = {
+    "op": 1,
+    "draw": 1,
+    "control": 1,
+    "ucontrol": 1,
+    "fetch": 1,
+    "getblock": 1,
+    "setblock": 1,
+    "cutscene": 1,
+    "message": 1,
+    "ulocate": 2,
+    "radar": 4,
+    "uradar": 4,
+    "jump": 1,
+}
+
+# Operands which are keywords despite not being at the start, by opcode.
+_KEYWORD_INDICES = {
+    "select": (1,),  # select result lessThan a b if_true if_false
+}
+
+# Indices of the operands written by the instruction, by opcode or by opcode and mode.
+_OUTPUTS = {
+    "set": (0,),
+    "op": (1,),
+    "sensor": (0,),
+    "read": (0,),
+    "getlink": (0,),
+    "radar": (7,),
+    "uradar": (7,),
+    "ulocate": (4, 5, 6, 7),
+    "fetch": (1,),
+    "getblock": (1,),
+    "spawn": (5,),
+    "getflag": (0,),
+    "select": (0,),
+    ("ucontrol", "within"): (4,),
+    ("ucontrol", "getBlock"): (3, 4),
+}
+
+
+class _Instruction:
+    """
+    Represents a mlog instruction.
+    """
+
+    __slots__ = ("op", "args")
+
+    def __init__(self, op: str, *args):
+        keywords = _KEYWORD_COUNT.get(op, 0)
+        indices = _KEYWORD_INDICES.get(op, ())
+        self.op = op
+        self.args = [
+            _Keyword(arg) if i < keywords or i in indices else _operand(arg) for i, arg in enumerate(args)
+        ]
+
+    @property
+    def mode(self):
+        """
+        The keyword selecting the instruction's mode (`add` for `op add`), if any.
+        """
+        return self.args[0] if self.args and isinstance(self.args[0], _Keyword) else None
+
+    @property
+    def output_indices(self):
+        """
+        Indices of the operands this instruction writes to.
+        """
+        indices = _OUTPUTS.get((self.op, self.mode)) or _OUTPUTS.get(self.op, ())
+        return [i for i in indices if i < len(self.args) and not isinstance(self.args[i], _Literal)]
+
+    @property
+    def outputs(self):
+        """
+        The variables (and built-ins, like `@counter`) this instruction writes to.
+        """
+        return [self.args[i] for i in self.output_indices]
+
+    @property
+    def inputs(self):
+        """
+        The variables this instruction reads from.
+        """
+        written = self.output_indices
+        return [arg for i, arg in enumerate(self.args) if i not in written and isinstance(arg, _Variable)]
+
+    def __repr__(self):
+        return " ".join((self.op, *self.args))
+
+
+class _Label(_Instruction):
+    """
+    Represents a no-op instruction used to label certain destinations for mlog jumps.
+    """
+
+    __slots__ = ()
+
+    def __init__(self):
+        super().__init__("label")
+
+    def __repr__(self):
+        return f"label@{id(self):x}"
+
+
+class _Jump(_Instruction):
+    """
+    Represents a jump instruction towards a specific label.
+    """
+
+    __slots__ = ("label",)
+
+    def __init__(self, label: _Label, condition: str, *args):
+        super().__init__("jump", condition, *args)
+        self.label = label
+
+    @property
+    def condition(self):
+        return self.args[0]
+
+    def __repr__(self):
+        return " ".join(("jump", repr(self.label), *self.args))
+
+
+class _JumpTable(_Instruction):
+    """
+    Represents a jump to the label at the position given by its operand in a table of labels.
+
+    It becomes `op add @counter @counter index`, followed by one `jump` per label. The operand
+    must be between 0 and the amount of labels (excluded).
+    """
+
+    __slots__ = ("labels",)
+
+    def __init__(self, labels: list, index):
+        super().__init__("jumptable", index)
+        self.labels = labels
+
+    def __repr__(self):
+        return " ".join(("jumptable", *map(repr, self.labels), *self.args))
+
+
+def _size(ins: _Instruction) -> int:
+    """
+    Amount of mlog instructions the instruction turns into.
+    """
+    if isinstance(ins, _Label):
+        return 0
+    if isinstance(ins, _JumpTable):
+        return 1 + len(ins.labels)
+    return 1
+
+
+def _to_long(value: float) -> int:
+    # Java's `(long)` cast: truncate towards zero, saturating at the limits.
+    return int(max(min(value, 2**63 - 1), -(2**63)))
+
+
+def _wrap_long(value: int) -> int:
+    value &= 2**64 - 1
+    return value - 2**64 if value >= 2**63 else value
+
+
+# How mlog evaluates each `op`. Everything is a double, except for the bitwise operations, which
+# work on 64-bit longs. Operations which are not deterministic (like `rand`), or which Mindustry
+# computes with reduced precision (like `sin` or `len`), are missing on purpose.
+_EVALUATORS = {
+    "add": lambda a, b: a + b,
+    "sub": lambda a, b: a - b,
+    "mul": lambda a, b: a * b,
+    "div": lambda a, b: a / b,
+    "idiv": lambda a, b: math.floor(a / b),
+    "mod": math.fmod,
+    "pow": math.pow,
+    "equal": lambda a, b: abs(a - b) < 0.000001,
+    "notEqual": lambda a, b: abs(a - b) >= 0.000001,
+    "land": lambda a, b: a != 0 and b != 0,
+    "lessThan": lambda a, b: a < b,
+    "lessThanEq": lambda a, b: a <= b,
+    "greaterThan": lambda a, b: a > b,
+    "greaterThanEq": lambda a, b: a >= b,
+    "strictEqual": lambda a, b: a == b,
+    "shl": lambda a, b: _wrap_long(_to_long(a) << (_to_long(b) & 63)),
+    "shr": lambda a, b: _to_long(a) >> (_to_long(b) & 63),
+    "or": lambda a, b: _to_long(a) | _to_long(b),
+    "and": lambda a, b: _to_long(a) & _to_long(b),
+    "xor": lambda a, b: _to_long(a) ^ _to_long(b),
+    "flip": lambda a: ~_to_long(a),
+    "max": max,
+    "min": min,
+    "abs": abs,
+    "sqrt": math.sqrt,
+    "floor": math.floor,
+    "ceil": math.ceil,
+    "log": math.log,
+    "log10": math.log10,
+}
+
+
+def _evaluate(op: str, *values):
+    """
+    Computes the result of `op` on the given numbers like mlog would, or returns `None` if it
+    can't be known at compile time (because the result is not a finite number, for example).
+    """
+    evaluator = _EVALUATORS.get(op)
+    if evaluator is None or any(value is None for value in values):
+        return None
+
+    try:
+        result = evaluator(*map(float, values))
+    except (ArithmeticError, ValueError):
+        return None
+
+    if isinstance(result, float) and not math.isfinite(result):
+        return None
+    return result
+
+
+def _truthy(value) -> bool:
+    """
+    Whether mlog considers the number true (when jumping if it's `notEqual` to 0).
+    """
+    return abs(float(value)) >= 0.000001
+
+
+def _number(operand):
+    """
+    The value of a literal operand if it's a number (including `true` and `false`), or `None`.
+    """
+    if not isinstance(operand, _Literal):
+        return None
+    if operand == "true":
+        return True
+    if operand == "false":
+        return False
+    try:
+        return float(operand)
+    except ValueError:
+        return None
+
+
+def _number_literal(value):
+    """
+    The literal representing a number, or `None` if it can't be written in mlog (like `1e100`).
+    """
+    if isinstance(value, bool):
+        return _Literal(("false", "true")[value])
+
+    if isinstance(value, float) and value.is_integer() and abs(value) < 2**53:
+        value = int(value)
+
+    text = str(value)
+    if "e" in text or "inf" in text or "nan" in text:
+        return None
+    return _Literal(text)
@@ -0,0 +1,793 @@
+"""
+Optimization passes run by the compiler, and the order in which they run.
+
+Passes either work on the parsed Python code (`ast.Module`), before it's compiled, or on the list
+of instructions (see `ir.py`) generated from it.
+"""
+
+from .analysis import (
+    ControlFlowGraph,
+    Dominators,
+    Liveness,
+    _is_call,
+    _variables,
+    available_copies,
+    copy_transfer,
+    integer_variables,
+    natural_loops,
+)
+from .constants import *
+from .ir import _Builtin, _Instruction, _Jump, _JumpTable, _Label, _Variable
+from .ir import _evaluate, _number, _number_literal
+from dataclasses import dataclass
+from typing import Callable, Optional
+import ast
+import math
+import re
+
+
+@dataclass
+class Pass:
+    """
+    An optimization pass, which runs if the compiler's optimization level is at least `level`.
+
+    `run` is called with the compiler and the code to optimize, and must return the optimized code.
+    If `on_ast` is set, the code is the `ast.Module` to compile (for example, to use a
+    `ast.NodeTransformer`). Otherwise, it's the list of generated instructions.
+    """
+
+    name: str
+    level: int
+    run: Callable
+    on_ast: bool = False
+
+
+@dataclass
+class PassStats:
+    """
+    Stores how long a pass took and how many instructions there were before and after it ran.
+
+    Passes working on the AST have no instruction count.
+    """
+
+    name: str
+    seconds: float
+    before: Optional[int]
+    after: Optional[int]
+
+
+_REG_TMP_RE = re.compile("^" + REG_TMP_FMT.replace("{}", r"\d+") + "$")
+
+# Instructions whose only side effect is writing their output.
+_PURE_OPS = {"set", "op", "sensor", "read", "getlink", "select"}
+
+# Instructions which only ever read their operands.
+_NO_OUTPUT = {"write", "print", "printflush", "drawflush", "draw", "control", "wait", "jumptable"}
+
+# `op` that leave their non-constant operand untouched, as (operation, constant, constant index).
+_IDENTITY_OPS = {
+    ("add", "0", 2),
+    ("add", "0", 3),
+    ("sub", "0", 3),
+    ("mul", "1", 2),
+    ("mul", "1", 3),
+    ("div", "1", 3),
+}
+
+
+def _estimate_size(function: ast.FunctionDef) -> int:
+    # Roughly one instruction per statement and operation, which is enough to compare functions.
+    counted = (ast.stmt, ast.BinOp, ast.UnaryOp, ast.Compare, ast.BoolOp, ast.Call, ast.Subscript)
+    return sum(isinstance(node, counted) for stmt in function.body for node in ast.walk(stmt))
+
+
+def _inline_functions(compiler, tree: ast.Module) -> ast.Module:
+    """
+    Marks functions as `@inline` when copying them to every call takes no more instructions than
+    calling them, or when the copies fit in what is left of the target's budget, which is shared
+    by the whole program.
+
+    Only functions which don't call other functions (except those being inlined) are considered,
+    so that recursive functions are never inlined. The size of a function includes the copies of
+    the functions it calls, so that inlining nested calls can't grow the program more than that.
+    """
+    calls = {}
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Call) and isinstance(node.func, ast.Name):
+            calls[node.func.id] = calls.get(node.func.id, 0) + 1
+
+    functions = [node for node in ast.walk(tree) if isinstance(node, ast.FunctionDef)]
+    names = {function.name for function in functions}
+    inlined = {}  # function name -> size of each of its copies
+    budget = compiler.target.inline_budget
+    for function in sorted(functions, key=lambda function: function.lineno):
+        called = [
+            node.func.id
+            for node in ast.walk(function)
+            if isinstance(node, ast.Call) and isinstance(node.func, ast.Name)
+        ]
+        expanded = _estimate_size(function) + sum(inlined.get(name, 0) for name in called)
+
+        if function.decorator_list:
+            if any(
+                isinstance(decorator, ast.Name) and decorator.id == "inline"
+                for decorator in function.decorator_list
+            ):
+                inlined[function.name] = expanded
+            continue
+
+        if set(called) & names - inlined.keys():
+            continue
+
+        count = calls.get(function.name, 0)
+        size = count * expanded
+        # Calls pass the arguments, save the return address, jump and copy the result. The function
+        # itself ends with the epilogue.
+        called_size = expanded + 1 + count * (len(function.args.args) + 3)
+        if count and (size <= called_size or size <= budget):
+            if size > called_size:
+                budget -= size
+            function.decorator_list.append(ast.Name(id="inline", ctx=ast.Load()))
+            inlined[function.name] = expanded
+
+    return tree
+
+
+def _peephole(compiler, instructions: list) -> list:
+    """
+    Rewrite small sequences of adjacent instructions into cheaper equivalents.
+
+    Only temporaries (`REG_TMP_FMT`) are ever removed, because user variables may be read
+    after the program wraps around. Labels and jumps are never part of a rewritten window.
+    """
+    uses = {}
+    for ins in instructions:
+        for arg in ins.args:
+            uses[arg] = uses.get(arg, 0) + 1
+
+    changed = True
+    while changed:
+        changed = False
+        removed = set()
+        for i, ins in enumerate(instructions):
+            if i in removed or isinstance(ins, (_Label, _Jump)):
+                continue
+
+            if ins.op == "op" and len(ins.args) == 4:
+                # op add x 0 y -> set x y
+                for mode, const, index in _IDENTITY_OPS:
+                    if ins.args[0] == mode and ins.args[index] == const:
+                        uses[const] -= 1
+                        uses[mode] -= 1
+                        ins = instructions[i] = _Instruction("set", ins.args[1], ins.args[5 - index])
+                        changed = True
+                        break
+
+            if ins.op == "set" and ins.args[0] == ins.args[1]:
+                # set a a -> (nothing)
+                uses[ins.args[0]] -= 2
+                removed.add(i)
+                continue
+
+            if ins.op not in _PURE_OPS:
+                continue
+
+            index = 1 if ins.op == "op" else 0
+            output = ins.args[index]
+            if not _REG_TMP_RE.match(output) or ins.args.count(output) != 1:
+                continue
+
+            if uses[output] == 1:
+                # set tmp x (never read) -> (nothing)
+                for arg in ins.args:
+                    uses[arg] -= 1
+                removed.add(i)
+                continue
+
+            nxt = instructions[i + 1] if i + 1 < len(instructions) and i + 1 not in removed else None
+            if (
+                nxt is None
+                or isinstance(nxt, (_Label, _Jump))
+                or nxt.args.count(output) != uses[output] - 1
+            ):
+                continue
+
+            if nxt.op == "set" and nxt.args[1] == output:
+                # op add tmp a b; set x tmp -> op add x a b
+                ins.args[index] = nxt.args[0]
+                uses[output] -= 2
+                removed.add(i + 1)
+            elif (
+                ins.op == "set"
+                and ins.args[1] != "@counter"
+                and (nxt.op in _NO_OUTPUT or nxt.op in _PURE_OPS and output not in nxt.outputs)
+            ):
+                # set tmp x; print tmp -> print x
+                value = ins.args[1]
+                uses[value] += uses[output] - 2
+                nxt.args = [value if arg == output else arg for arg in nxt.args]
+                uses[output] = 0
+                removed.add(i)
+
+        if removed:
+            instructions = [ins for i, ins in enumerate(instructions) if i not in removed]
+            changed = True
+
+    return instructions
+
+
+# `op` which only use their first operand.
+_UNARY_OPS = {"flip", "abs", "sqrt", "floor", "ceil", "log", "log10"}
+
+
+def _is_register(var) -> bool:
+    # Variables which only the compiler uses (including the locals of functions, which are often
+    # copies of the arguments once inlined), and whose value is not needed once read.
+    return var.startswith(REG_LOCAL_FMT[: REG_LOCAL_FMT.index("{")])
+
+
+def _with_args(ins: _Instruction, args: list) -> _Instruction:
+    # Instructions may be shared, so a new one is made rather than changing them in place.
+    if isinstance(ins, _Jump):
+        return _Jump(ins.label, *args)
+    if isinstance(ins, _JumpTable):
+        return _JumpTable(ins.labels, *args)
+    return _Instruction(ins.op, *args)
+
+
+def _fold_op(ins: _Instruction) -> Optional[_Instruction]:
+    """
+    Turns an `op` whose operands are all numbers into a `set` of its result, if it can be known,
+    and one which leaves its other operand untouched (such as adding zero) into a copy of it.
+    """
+    if ins.op != "op" or len(ins.args) < 3:
+        return None
+
+    for mode, const, index in _IDENTITY_OPS:
+        if ins.mode == mode and len(ins.args) == 4 and ins.args[index] == const:
+            return _Instruction("set", ins.args[1], ins.args[5 - index])
+
+    # mlog always reads two operands, but the second one is ignored by unary operations.
+    values = [_number(arg) for arg in ins.args[2:4]]
+    if ins.mode in _UNARY_OPS:
+        values = values[:1]
+    if len(values) != (1 if ins.mode in _UNARY_OPS else 2) or None in values:
+        return None
+
+    result = _evaluate(ins.mode, *values)
+    literal = None if result is None else _number_literal(result)
+    return literal and _Instruction("set", ins.args[1], literal)
+
+
+def _propagate(compiler, instructions: list) -> list:
+    """
+    Replace the reads of variables known to hold a constant, or a copy of another variable,
+    with that value instead.
+
+    Operations whose operands become constant are computed, which may allow propagating further.
+    """
+    changed = True
+    while changed:
+        changed = False
+        cfg = ControlFlowGraph(instructions)
+        for block, copies in zip(cfg.blocks, available_copies(cfg)):
+            if copies is None:
+                continue
+
+            for i in range(block.start, block.end):
+                ins = instructions[i]
+                written = ins.output_indices
+                args = [
+                    copies.get(arg, arg) if j not in written and isinstance(arg, _Variable) else arg
+                    for j, arg in enumerate(ins.args)
+                ]
+                if args != ins.args:
+                    ins = instructions[i] = _with_args(ins, args)
+                    changed = True
+
+                folded = _fold_op(ins)
+                if folded is not None:
+                    ins = instructions[i] = folded
+                    changed = True
+
+                copy_transfer(copies, ins)
+
+    return _remove_dead_copies(instructions)
+
+
+def _exponent_of_two(value) -> Optional[int]:
+    # The `k` such that `value` is `2**k`, if it's a power of two (`k` may be negative).
+    if value is None or value <= 0:
+        return None
+    mantissa, exponent = math.frexp(value)
+    return exponent - 1 if mantissa == 0.5 else None
+
+
+# Integers this large or larger can't all be represented exactly, and may not fit in the 64-bit
+# integers bitwise operations work on once shifted.
+_SAFE_INTEGER = 2**53
+
+
+def _reduce_strength(compiler, instructions: list) -> list:
+    """
+    Rewrite arithmetic with a constant operand into simpler operations.
+
+    Small powers become multiplications, square roots or shifts, and divisions by a power of two
+    become multiplications by its (exact) inverse. Multiplications, floor divisions and modulos
+    by a power of two become shifts and masks, but only when the other operand is certainly an
+    integer (and not negative, for modulo), because bitwise operations truncate their operands,
+    and a small enough one, because they work on 64-bit integers which would wrap around.
+    Rounding an integer down or up becomes a copy.
+    """
+    integers = integer_variables(ControlFlowGraph(instructions))
+    for i, ins in enumerate(instructions):
+        if ins.op != "op" or len(ins.args) not in (3, 4):
+            continue
+
+        mode, output, a, *rest = ins.args
+        b = rest[0] if rest else None
+        if mode == "mul" and _number(a) is not None:
+            a, b = b, a
+        constant = _number(b)
+        exponent = _exponent_of_two(constant)
+        integer = a in integers[i]
+        natural, bound = integers[i].get(a, (False, math.inf))
+
+        if mode == "pow":
+            rewrite = {
+                0: ("set", output, "1"),
+                1: ("set", output, a),
+                2: ("op", "mul", output, a, a),
+                0.5: ("op", "sqrt", output, a),
+                -1: ("op", "div", output, "1", a),
+            }.get(constant)
+            natural, bound = integers[i].get(b, (False, math.inf))
+            if rewrite is None and _number(a) == 2 and natural and bound < 63:
+                # Shifting by 63 or more would overflow (or wrap around, from 64).
+                rewrite = ("op", "shl", output, "1", b)
+        elif mode == "div" and exponent is not None:
+            inverse = _number_literal(1 / constant)
+            rewrite = inverse and ("op", "mul", output, a, inverse)
+        elif mode == "mul" and exponent and exponent > 0 and integer and bound * constant < _SAFE_INTEGER:
+            rewrite = ("op", "shl", output, a, str(exponent))
+        elif mode == "idiv" and exponent and exponent > 0 and integer and bound < _SAFE_INTEGER:
+            rewrite = ("op", "shr", output, a, str(exponent))
+        elif mode == "mod" and exponent and exponent > 0 and natural and bound < _SAFE_INTEGER:
+            rewrite = ("op", "and", output, a, str(int(constant) - 1))
+        elif mode in ("floor", "ceil") and integer:
+            rewrite = ("set", output, a)
+        else:
+            rewrite = None
+
+        if rewrite is not None:
+            instructions[i] = _Instruction(*rewrite)
+
+    return instructions
+
+
+# `op` whose operands can be swapped without changing the result.
+_COMMUTATIVE_OPS = {
+    "add",
+    "mul",
+    "equal",
+    "notEqual",
+    "land",
+    "strictEqual",
+    "and",
+    "or",
+    "xor",
+    "max",
+    "min",
+}
+
+# Instructions which can't change the result of a `sensor` or `getlink`.
+_NO_WORLD_EFFECT = _PURE_OPS | {"print", "printflush", "draw", "drawflush", "write", "label"}
+
+
+def _value_key(ins: _Instruction) -> Optional[tuple]:
+    """
+    What the instruction computes, as `(opcode, mode, operands)`, or `None` if the same operands
+    may give a different result (like `op rand` or reading `@time`).
+    """
+    if ins.op == "op":
+        operands = ins.args[2:]
+        if ins.mode == "rand" or any(isinstance(arg, _Builtin) for arg in operands):
+            return None
+        if ins.mode in _COMMUTATIVE_OPS:
+            operands = sorted(operands)
+        return ("op", ins.mode, tuple(operands))
+
+    if (
+        ins.op == "sensor"
+        or ins.op in ("getlink", "read")
+        and not any(isinstance(arg, _Builtin) for arg in ins.args[1:])
+    ):
+        return (ins.op, None, tuple(ins.args[1:]))
+
+    return None
+
+
+def _number_values(compiler, instructions: list) -> list:
+    """
+    Replace the instructions computing a value which a variable already holds with a copy of it,
+    within each basic block.
+
+    The results of `sensor` and `getlink` are forgotten at every instruction which may change the
+    world (such as `wait`, `control` or `ucontrol`), and those of `read` when the same memory cell
+    is written. Calls and loops always start a new block, so nothing is kept across them.
+    """
+    cfg = ControlFlowGraph(instructions)
+    for block in cfg.blocks:
+        values = {}  # key -> variable holding the value
+        for i in range(block.start, block.end):
+            ins = instructions[i]
+            key = _value_key(ins)
+            if key is not None and key in values and ins.outputs:
+                ins = instructions[i] = _Instruction("set", ins.outputs[0], values[key])
+
+            if ins.op == "write":
+                values = {k: var for k, var in values.items() if k[0] != "read" or k[2][0] != ins.args[1]}
+            elif ins.op not in _NO_WORLD_EFFECT:
+                values = {k: var for k, var in values.items() if k[0] == "op"}
+
+            for output in ins.outputs:
+                values = {k: var for k, var in values.items() if var != output and output not in k[2]}
+
+            if key is not None and ins.outputs and ins.outputs[0] not in key[2]:
+                values.setdefault(key, ins.outputs[0])
+
+    return _propagate(compiler, instructions)
+
+
+# Values which are the same on every iteration of any loop.
+_INVARIANT_BUILTINS = {ENV_MAP[name] for name in INVARIANT_ENV}
+_INVARIANT_SENSORS = {RES_MAP[name] for name in INVARIANT_RES}
+
+# The instructions run per tick (used by `Env.ips`), which only `setrate` changes.
+_RATE = "@ipt"
+
+
+def _called_blocks(cfg: ControlFlowGraph, blocks) -> set:
+    # Blocks of the functions called from the given blocks, and of those they call in turn.
+    called = set()
+    prologues = [cfg.calls[block] for block in blocks if block in cfg.calls]
+    while prologues:
+        prologue = prologues.pop()
+        if prologue not in called:
+            body = cfg._function_body(prologue)
+            called.update(body)
+            prologues.extend(cfg.calls[block] for block in body if block in cfg.calls)
+    return called
+
+
+def _is_invariant(ins: _Instruction, writes: dict) -> bool:
+    # Whether the instruction computes the same value no matter how many times the loop ran,
+    # given how many times each variable is written in the loop.
+    def invariant(arg):
+        if isinstance(arg, _Builtin):
+            return arg in _INVARIANT_BUILTINS or (arg == _RATE and not writes.get(_RATE))
+        return not isinstance(arg, _Variable) or not writes.get(arg)
+
+    if ins.op == "op":
+        return ins.mode != "rand" and all(map(invariant, ins.args[2:]))
+    if ins.op == "set":
+        return invariant(ins.args[1])
+    if ins.op == "sensor":
+        return len(ins.args) == 3 and invariant(ins.args[1]) and ins.args[2] in _INVARIANT_SENSORS
+    return False
+
+
+def _hoist_invariants(compiler, instructions: list) -> list:
+    """
+    Move the instructions computing the same value on every iteration of a loop before the loop.
+
+    This is done for `op`, `set` and the `sensor` of `INVARIANT_RES` whose operands are never
+    written in the loop (nor by the functions it calls), as long as their output is only written
+    there, isn't read in the loop before being written, and isn't needed after leaving the loop
+    before they run. The loop must be entered by falling into it, so that there's room for them.
+    """
+    changed = True
+    while changed:
+        changed = False
+        cfg = ControlFlowGraph(instructions)
+        dominators = Dominators(cfg)
+        liveness = Liveness(cfg)
+        for header, blocks in natural_loops(cfg, dominators):
+            before = cfg.blocks[header.index - 1]
+            last = before.last
+            if (
+                [pred for pred in header.predecessors if pred not in blocks] != [before]
+                or isinstance(last, _JumpTable)
+                or isinstance(last, _Jump)
+                and cfg.label_blocks[last.label] is header
+            ):
+                continue
+
+            writes = {}
+            for block in blocks | _called_blocks(cfg, blocks):
+                for ins in block.instructions:
+                    for var in ins.outputs:
+                        writes[var] = writes.get(var, 0) + 1
+                    if ins.op == "setrate":
+                        writes[_RATE] = writes.get(_RATE, 0) + 1
+
+            exits = [(block, succ) for block in blocks for succ in block.successors if succ not in blocks]
+            hoisted = []
+            for block in sorted(blocks, key=lambda block: block.start):
+                for i in range(block.start, block.end):
+                    ins = instructions[i]
+                    outputs = ins.outputs
+                    if (
+                        len(outputs) == 1
+                        and isinstance(outputs[0], _Variable)
+                        and writes[outputs[0]] == 1
+                        and outputs[0] not in liveness.live_in[header.index]
+                        and all(
+                            outputs[0] not in liveness.live_in[succ.index]
+                            or dominators.dominates(block, exiting)
+                            for exiting, succ in exits
+                        )
+                        and _is_invariant(ins, writes)
+                    ):
+                        writes[outputs[0]] = 0
+                        hoisted.append(i)
+
+            if hoisted:
+                start = header.start - sum(i < header.start for i in hoisted)
+                moved = [instructions[i] for i in hoisted]
+                instructions = [ins for i, ins in enumerate(instructions) if i not in hoisted]
+                instructions[start:start] = moved
+                changed = True
+                break
+
+    return instructions
+
+
+def _remove_dead_copies(instructions: list) -> list:
+    """
+    Remove the copies of a variable into itself, and the instructions without side effects which
+    only write registers nobody reads, or any variable which is written again before being read.
+    """
+    while True:
+        cfg = ControlFlowGraph(instructions)
+        liveness = Liveness(cfg)
+        removed = set()
+        for block in cfg.blocks:
+            # Going backwards, the variables the rest of the block writes before reading them.
+            overwritten = set()
+            for i in reversed(range(block.start, block.end)):
+                ins = instructions[i]
+                outputs = _variables(ins.outputs)
+                if ins.op in _PURE_OPS and outputs and outputs <= overwritten:
+                    removed.add(i)
+                overwritten |= outputs
+                overwritten -= _variables(ins.inputs)
+
+            for i, (ins, live) in enumerate(zip(block.instructions, liveness.live_after(block))):
+                outputs = ins.outputs
+                if ins.op == "set" and ins.args[0] == ins.args[1]:
+                    removed.add(block.start + i)
+                elif (
+                    ins.op in _PURE_OPS
+                    and outputs
+                    and all(_is_register(var) and var not in live for var in outputs)
+                ):
+                    removed.add(block.start + i)
+
+        if not removed:
+            return instructions
+
+        instructions = [ins for i, ins in enumerate(instructions) if i not in removed]
+
+
+def _jump_outcome(ins: _Jump) -> Optional[bool]:
+    # Whether the jump is always or never taken, if it's known.
+    if ins.condition == "always":
+        return True
+    if ins.args[1] == ins.args[2] and isinstance(ins.args[1], _Variable):
+        # mlog has no NaN, so a variable always equals itself.
+        return ins.condition in ("equal", "lessThanEq", "greaterThanEq", "strictEqual")
+
+    result = _evaluate(ins.condition, *map(_number, ins.args[1:3]))
+    return None if result is None else bool(result)
+
+
+def _unreachable(instructions: list) -> set:
+    # Indices of the instructions which no path from the start of the program leads to.
+    cfg = ControlFlowGraph(instructions)
+    reachable = set(cfg.reverse_postorder())
+    return {i for block in cfg.blocks if block not in reachable for i in range(block.start, block.end)}
+
+
+def _eliminate_dead_code(compiler, instructions: list) -> list:
+    """
+    Remove the instructions which can never run, and the jumps which have no effect.
+
+    Jumps whose outcome is known become unconditional or disappear. Functions which are never
+    called (or which were inlined) are unreachable too, so their whole body goes away, and with it
+    the `end` separating them from the main program.
+    """
+    changed = True
+    while changed:
+        changed = False
+        for i, ins in enumerate(instructions):
+            if isinstance(ins, _Jump) and ins.condition != "always":
+                taken = _jump_outcome(ins)
+                if taken is not None:
+                    instructions[i] = _Jump(ins.label, "always") if taken else _Label()
+                    changed = True
+            elif isinstance(ins, _JumpTable) and _number(ins.args[0]) in range(len(ins.labels)):
+                instructions[i] = _Jump(ins.labels[int(_number(ins.args[0]))], "always")
+                changed = True
+
+        removed = _unreachable(instructions)
+
+        # A jump to the instruction right after it does nothing (its operands have no side effects).
+        for i, ins in enumerate(instructions):
+            if not isinstance(ins, _Jump) or i in removed:
+                continue
+
+            j = i + 1
+            while (
+                j < len(instructions)
+                and isinstance(instructions[j], _Label)
+                and instructions[j] is not ins.label
+            ):
+                j += 1
+            if j < len(instructions) and instructions[j] is ins.label:
+                removed.add(i)
+
+        if removed:
+            instructions = [ins for i, ins in enumerate(instructions) if i not in removed]
+            changed = True
+
+    return _remove_dead_copies(instructions)
+
+
+def _thread_jumps(compiler, instructions: list) -> list:
+    """
+    Make jumps go straight to their final destination, rather than through other jumps.
+
+    Consecutive labels are merged into one, jumps to the next instruction are removed, and
+    jumping to the end of the program goes back to the start instead, skipping the `end`.
+    A conditional jump over an unconditional one is replaced by a single jump on the negated
+    condition. Whatever can no longer be reached once the jumps are redirected is removed.
+    """
+    start = _Label()
+    instructions = [start, *instructions]
+    changed = True
+    while changed:
+        changed = False
+        canonical = {}  # label -> first label of the consecutive labels it belongs to
+        target = {}  # label -> index of the instruction it points to
+        labels = []
+        for i, ins in enumerate(instructions + [None]):
+            if isinstance(ins, _Label):
+                labels.append(ins)
+                continue
+
+            for label in labels:
+                canonical[label] = labels[0]
+                target[label] = i
+            labels = []
+
+        def destination(label):
+            seen = set()
+            while label not in seen:
+                seen.add(label)
+                i = target[label]
+                if i == len(instructions) or instructions[i].op == "end":
+                    return start
+                ins = instructions[i]
+                if not isinstance(ins, _Jump) or ins.condition != "always" or _is_call(instructions, i):
+                    break
+                label = ins.label
+            return canonical[label]
+
+        def following(i):
+            # Index of the instruction which runs after the one at `i`, unless it jumps.
+            i += 1
+            while i < len(instructions) and isinstance(instructions[i], _Label):
+                i += 1
+            return i
+
+        # Redirecting jumps leaves what they used to go through (such as the `end`) unreachable.
+        removed = _unreachable(instructions)
+        for i, ins in enumerate(instructions):
+            if isinstance(ins, _JumpTable):
+                labels = [destination(label) for label in ins.labels]
+                if labels != ins.labels:
+                    instructions[i] = _JumpTable(labels, *ins.args)
+                    changed = True
+                continue
+
+            if not isinstance(ins, _Jump):
+                continue
+
+            label = canonical[ins.label] if _is_call(instructions, i) else destination(ins.label)
+            if label is not ins.label:
+                ins = instructions[i] = _Jump(label, *ins.args)
+                changed = True
+
+            nxt = following(i)
+            if target[label] == nxt:
+                # jump 1 always; label 1 -> (nothing)
+                removed.add(i)
+            elif (
+                ins.condition in NEGATED_BIN_CMP
+                and nxt not in removed
+                and nxt < len(instructions)
+                and isinstance(instructions[nxt], _Jump)
+                and instructions[nxt].condition == "always"
+                and not _is_call(instructions, nxt)
+                and target[label] == following(nxt)
+            ):
+                # jump 1 equal x y; jump 2 always; label 1 -> jump 2 notEqual x y; label 1
+                instructions[i] = _Jump(
+                    instructions[nxt].label, NEGATED_BIN_CMP[ins.condition], *ins.args[1:]
+                )
+                removed.add(nxt)
+
+        if removed:
+            instructions = [ins for i, ins in enumerate(instructions) if i not in removed]
+            changed = True
+
+    referenced = {ins.label for ins in instructions if isinstance(ins, _Jump)}
+    referenced.update(label for ins in instructions if isinstance(ins, _JumpTable) for label in ins.labels)
+    return [ins for ins in instructions if not isinstance(ins, _Label) or ins in referenced]
+
+
+def _allocate_registers(compiler, instructions: list) -> list:
+    """
+    Rename the temporaries so that those which are never needed at the same time share a name.
+
+    Each temporary gets the lowest number not used by another temporary live while it's written.
+    """
+    cfg = ControlFlowGraph(instructions)
+    liveness = Liveness(cfg)
+    interference = {}  # temporary -> temporaries which can't share its name
+
+    def interfere(var, others):
+        interference.setdefault(var, set()).update(others)
+        for other in others:
+            interference.setdefault(other, set()).add(var)
+
+    for block in cfg.blocks:
+        live_in = {var for var in liveness.live_in[block.index] if _REG_TMP_RE.match(var)}
+        for var in live_in:
+            interfere(var, live_in - {var})
+
+        for ins, live in zip(block.instructions, liveness.live_after(block)):
+            for var in ins.outputs:
+                if _REG_TMP_RE.match(var):
+                    interfere(var, {other for other in live if other != var and _REG_TMP_RE.match(other)})
+
+    names = {}
+    for ins in instructions:
+        for var in ins.args:
+            if var in interference and var not in names:
+                taken = {names.get(other) for other in interference[var]}
+                number = 1
+                while REG_TMP_FMT.format(number) in taken:
+                    number += 1
+                names[var] = REG_TMP_FMT.format(number)
+
+    return [
+        _with_args(ins, [names.get(arg, arg) for arg in ins.args])
+        if any(arg in names for arg in ins.args)
+        else ins
+        for ins in instructions
+    ]
+
+
+PASSES = [
+    Pass("inline", 2, _inline_functions, on_ast=True),
+    Pass("peephole", 1, _peephole),
+    Pass("propagate", 2, _propagate),
+    Pass("strength", 2, _reduce_strength),
+    Pass("values", 2, _number_values),
+    Pass("hoist", 2, _hoist_invariants),
+    Pass("dead-code", 2, _eliminate_dead_code),
+    Pass("jumps", 2, _thread_jumps),
+    Pass("registers", 2, _allocate_registers),
+]
@@ -0,0 +1,58 @@
+"""
+Processors the compiled code can run on, and what sets them apart.
+
+Every processor runs the same language, but they differ in how fast they run it, and only world
+processors can use the instructions which change the world directly (see `PRIVILEGED_OPCODES`).
+"""
+
+from .constants import *
+from .ir import _Instruction, _JumpTable, _Label
+from dataclasses import dataclass
+
+
+@dataclass(frozen=True)
+class Target:
+    """
+    A kind of processor the code can run on.
+
+    `ipt` is how many instructions it runs per tick, and `max_instructions` how long a program
+    may be. `privileged` processors can use the instructions in `PRIVILEGED_OPCODES`.
+
+    `inline_budget` and `unroll_budget` limit how much larger the optimizations may make the
+    program for it to run faster. Every processor fits programs of the same length, but every
+    instruction saved matters more to those running fewer of them per tick, so slower processors
+    get larger budgets.
+    """
+
+    name: str
+    ipt: int
+    max_instructions: int = MAX_INSTRUCTIONS
+    privileged: bool = False
+    inline_budget: int = INLINE_BUDGET
+    unroll_budget: int = UNROLL_BUDGET
+
+    def cost(self, ins: _Instruction) -> int:
+        """
+        How many of the instructions run in a tick running the instruction takes.
+        """
+        if isinstance(ins, _Label):
+            return 0
+        if isinstance(ins, _JumpTable):
+            # The `op add @counter` and the `jump` it lands on.
+            return 2
+        return 1
+
+
+# https://github.com/Anuken/Mindustry/blob/ab19e6f/core/src/mindustry/content/Blocks.java
+TARGETS = {
+    target.name: target
+    for target in (
+        Target("micro", ipt=2, inline_budget=INLINE_BUDGET * 2, unroll_budget=UNROLL_BUDGET * 2),
+        Target("logic", ipt=8),
+        Target("hyper", ipt=25, inline_budget=INLINE_BUDGET // 2, unroll_budget=UNROLL_BUDGET // 2),
+        # The rate can be changed with `World.set_rate`, 8 is the default.
+        Target("world", ipt=8, privileged=True),
+    )
+}
+
+DEFAULT_TARGET = "logic"
@@ -1,5 +1,7 @@
+import ast
 import functools
 import inspect
+import math
 import pathlib
 import pyndustric
 import pytest
@@ -11,29 +13,36 @@ import tempfile
 _REG_TMP_RE = re.compile(r"\b" + pyndustric.REG_TMP_FMT.replace("{}", r"(\w+)") + r"\b")
 
 
-def as_masm(source):
+def as_masm(source, stack=True):
     # Dedent expected mlog source by removing all leading whitespace
-    return "set __pyc_sp 0\n" + re.sub(r"^\s+", "", source.strip(), flags=re.MULTILINE) + "\nend\n"
+    # The stack pointer is only initialized if it's used when optimizing more (`stack=False`)
+    prologue = "set __pyc_sp 0\n" if stack else ""
+    return prologue + re.sub(r"^\s+", "", source.strip(), flags=re.MULTILINE) + "\nend\n"
 
 
-def masm_test(source_func):
+def masm_test(source_func=None, *, opt_level=1, **options):
     """
     Marks the function as a "masm test".
 
     The body of the wrapped function will be compiled, and this masm output will be compared
     against the function's docstring, which should contain the *expected* masm output.
+    It's compiled with the default optimization level, unless `@masm_test(opt_level=N)` is used.
+    Other options are passed to the compiler too, like `@masm_test(mlog_version=8)`.
 
     The special value `%tmpD`, where D is an integer, will be replaced by the matching `REG_TMP_FMT`.
     The temporary names are ordered by time of appearance (meaning `__pyc_tmp_2` can be `%tmp0` and
     `__pyc_tmp_1` be `%tmp1` if they appear in this order in the generated masm).
     """
+    if source_func is None:
+        return functools.partial(masm_test, opt_level=opt_level, **options)
+
     dbg_name = f"{source_func.__name__}:{inspect.currentframe().f_back.f_lineno}"
 
     @functools.wraps(source_func)
     def wrapped():
         assert source_func.__doc__ is not None, "bad `masm_test` usage; def should have docstring"
-        expected = as_masm(source_func.__doc__)
-        masm = pyndustric.Compiler().compile(source_func)
+        expected = as_masm(source_func.__doc__, stack=opt_level < 2)
+        masm = pyndustric.Compiler(opt_level=opt_level, **options).compile(source_func)
 
         tmp = 0
         while True:
@@ -145,6 +154,39 @@ def test_err_too_long():
     expect_err(pyndustric.ERR_TOO_LONG, "x = 1\n" * (1 + pyndustric.MAX_INSTRUCTIONS))
 
 
+def test_err_unavailable_instruction():
+    expect_err(pyndustric.ERR_UNAVAILABLE_INSTRUCTION, "World.set_rate(10)")
+    expect_err(pyndustric.ERR_UNAVAILABLE_INSTRUCTION, "if x:\n  World.set_rate(10)")
+
+
+def test_targets():
+    from pyndustric.ir import _Instruction, _JumpTable, _Label
+
+    source = "x = 1\n" * 20
+    tiny = pyndustric.Target("tiny", ipt=1, max_instructions=10)
+    with pytest.raises(pyndustric.CompilerError, match=pyndustric.ERR_TOO_LONG):
+        pyndustric.Compiler(target=tiny).compile(source)
+
+    for target in pyndustric.TARGETS:
+        pyndustric.Compiler(target=target).compile(source)
+
+    world = pyndustric.TARGETS["world"]
+    assert world.privileged and not pyndustric.TARGETS["micro"].privileged
+    assert world.cost(_Instruction("set", "x", "1")) == 1
+    assert world.cost(_Label()) == 0
+    assert world.cost(_JumpTable([_Label(), _Label()], "x")) == 2
+
+    # Slower processors may grow the program more to run faster.
+    def unrolled(target, n):
+        masm = pyndustric.Compiler(opt_level=2, target=target).compile(
+            f"for i in range({n}):\n  Mem.cell1[i] = i"
+        )
+        return "jump" not in masm
+
+    assert unrolled("micro", 60) and not unrolled("logic", 60)
+    assert unrolled("logic", 40) and not unrolled("hyper", 40)
+
+
 def test_err_bad_tuple():
     expect_err(pyndustric.ERR_UNSUPPORTED_EXPR, "x = 1, 2")
     expect_err(pyndustric.ERR_BAD_TUPLE_ASSIGN, "x, y = 1")
@@ -152,6 +194,12 @@ def test_err_bad_tuple():
     expect_err(pyndustric.ERR_BAD_TUPLE_ASSIGN, "x, y = a, b, c")
 
 
+def test_err_unsupported_pattern():
+    if sys.version_info >= (3, 10):
+        expect_err(pyndustric.ERR_UNSUPPORTED_PATTERN, "match x:\n  case [a, b]: pass")
+        expect_err(pyndustric.ERR_UNSUPPORTED_PATTERN, "match x:\n  case 1 if y: pass")
+
+
 def test_no_compile_method():
     class Foo:
         def bar(self):
@@ -225,18 +273,16 @@ def test_inline():
 
     expected = as_masm(
         """\
-        jump 5 always
-        read __pyc_rc_0 cell1 __pyc_sp
-        set x 1
-        op add @counter __pyc_rc_0 1
-        write @counter cell1 __pyc_sp
-        jump 2 always
-        set __pyc_tmp_1 __pyc_ret
+        op add __pyc_rc_0 @counter 1
+        jump 4 always
+        end
+        set __pyc_f_x 1
+        set @counter __pyc_rc_0
         """
     )
     expected_inline = as_masm(
         """\
-        set x 1
+        set __pyc_f_x 1
         """
     )
 
@@ -265,22 +311,19 @@ def test_inline_return():
 
     expected = as_masm(
         """\
+        op add __pyc_rc_0 @counter 1
+        jump 4 always
+        end
+        set __pyc_f_x 1
+        set rtn __pyc_f_x
         jump 7 always
-        read __pyc_rc_0 cell1 __pyc_sp
-        set x 1
-        set __pyc_ret x
-        jump 6 always
-        op add @counter __pyc_rc_0 1
-        write @counter cell1 __pyc_sp
-        jump 2 always
-        set rtn __pyc_ret
+        set @counter __pyc_rc_0
         """
     )
     expected_inline = as_masm(
         """\
-        set x 1
-        set __pyc_ret x
-        set rtn __pyc_ret
+        set __pyc_f_x 1
+        set rtn __pyc_f_x
         """
     )
 
@@ -291,6 +334,623 @@ def test_inline_return():
     assert masm == expected_inline
 
 
+@masm_test
+def test_inline_args():
+    """
+    set __pyc_clamp_v x
+    set __pyc_clamp_hi 10
+    jump 6 lessThanEq __pyc_clamp_v __pyc_clamp_hi
+    set y __pyc_clamp_hi
+    jump 7 always
+    set y __pyc_clamp_v
+    """
+
+    @inline
+    def clamp(v, hi):
+        if v > hi:
+            return hi
+        return v
+
+    y = clamp(x, 10)
+
+
+@masm_test(opt_level=2)
+def test_auto_inline():
+    """
+    op mul %tmp0 a a
+    op mul %tmp1 b b
+    op add c %tmp0 %tmp1
+    """
+
+    def square(n):
+        return n * n
+
+    c = square(a) + square(b)
+
+
+def test_auto_inline_nested():
+    # Every level is small, but inlining all of them copies `c` 54 times.
+    source = """\
+def c(x):
+    s = 0
+    for k in range(x):
+        s += k
+    return s
+def b(x):
+    return c(x) + c(x + 1) + c(x + 2)
+def a(x):
+    return b(x) + b(x + 1) + b(x + 2)
+def z(x):
+    return a(x) + a(x + 1) + a(x + 2)
+def w(x):
+    return z(x) + z(x + 1)
+print(w(Mem.cell1[0]))
+"""
+    called = pyndustric.Compiler(opt_level=1).compile(source)
+    inlined = pyndustric.Compiler(opt_level=2).compile(source)
+    assert inlined.count("\n") <= called.count("\n") + pyndustric.TARGETS["logic"].inline_budget
+
+
+def test_ir_operands():
+    from pyndustric.ir import _Builtin, _Instruction, _Keyword, _Literal, _Variable
+
+    ins = _Instruction("op", "add", "x", "@time", "1.5")
+    assert list(map(type, ins.args)) == [_Keyword, _Variable, _Builtin, _Literal]
+    assert ins.mode == "add"
+    assert ins.outputs == ["x"]
+    assert ins.inputs == []
+
+    ins = _Instruction("ucontrol", "within", "x", "y", '"r"', "out", "0")
+    assert ins.outputs == ["out"]
+    assert ins.inputs == ["x", "y"]
+
+
+def test_analysis():
+    from pyndustric.analysis import (
+        ControlFlowGraph,
+        Dominators,
+        Liveness,
+        natural_loops,
+        reaching_definitions,
+    )
+
+    def source():
+        def f(n):
+            return n + 1
+
+        x = 0
+        while x < 10:
+            x = f(x)
+        print(x)
+
+    compiler = pyndustric.Compiler()
+    compiler.compile(source)
+    cfg = ControlFlowGraph(compiler._ins)
+    entry, call, test, after, prologue, epilogue, _ = cfg.blocks
+
+    assert entry.successors == [after, call]
+    assert cfg.calls == {call: prologue}
+    assert prologue.predecessors == [call]
+    assert epilogue.successors == [test]
+    assert test.successors == [call, after]
+    assert after.successors == [entry]
+
+    liveness = Liveness(cfg)
+    assert "x" in liveness.live_in[call.index]
+    assert "x" not in liveness.live_in[entry.index]
+    assert "__pyc_f_n" not in liveness.live_out[prologue.index]
+
+    dominators = Dominators(cfg)
+    assert dominators.dominates(entry, call)
+    assert dominators.dominates(call, prologue)
+    assert not dominators.dominates(call, after)
+    assert natural_loops(cfg, dominators) == [(call, {call, test, prologue, epilogue})]
+
+    reaching = reaching_definitions(cfg)
+    defs_of_x = {i for i in reaching[after.index] if "x" in cfg.instructions[i].outputs}
+    assert len(defs_of_x) == 2
+
+
+def test_costs():
+    def source():
+        def f(n):
+            s = 0
+            for j in range(3):
+                s += n
+            return s
+
+        total = 0
+        for i in range(10):
+            total += f(i)
+        print(total)
+        while total > 5:
+            total -= 1
+
+    compiler = pyndustric.Compiler()
+    compiler.compile(source)
+    program, function, outer, unbounded, inner = compiler.costs()
+
+    assert function == pyndustric.Cost("function", "f", 15, 3 + 3 * 3 + 2)
+    assert inner == pyndustric.Cost("loop", "", 17, 3, 3)
+    assert outer == pyndustric.Cost("loop", "", 3, 3 + function.instructions + 3, 10)
+    assert unbounded.trips is None
+    assert program.instructions == math.inf
+
+    compiler = pyndustric.Compiler()
+    compiler.compile("total = 0\nfor i in range(4):\n    total += i")
+    assert compiler.costs()[0].instructions == 3 + 4 * 3 + 1
+
+
+def test_no_optimize():
+    def source():
+        y = +x
+
+    expected = as_masm(
+        """\
+        op add y 0 x
+        """
+    )
+    expected_optimized = as_masm(
+        """\
+        set y x
+        """
+    )
+
+    masm = pyndustric.Compiler(opt_level=0).compile(source)
+    assert masm == expected
+
+    masm = pyndustric.Compiler().compile(source)
+    assert masm == expected_optimized
+
+
+def test_custom_passes():
+    class Double(ast.NodeTransformer):
+        def visit_Constant(self, node):
+            return ast.Constant(value=node.value * 2)
+
+    def remove_prints(compiler, instructions):
+        return [ins for ins in instructions if ins.op != "print"]
+
+    passes = [
+        pyndustric.Pass("double", 2, lambda compiler, tree: Double().visit(tree), on_ast=True),
+        pyndustric.Pass("remove prints", 2, remove_prints),
+    ]
+
+    def source():
+        x = 2
+        print(x)
+
+    compiler = pyndustric.Compiler(opt_level=2, passes=passes)
+    assert compiler.compile(source) == as_masm("set x 4\nprintflush message1")
+    assert [(s.name, s.before, s.after) for s in compiler.pass_stats] == [
+        ("double", None, None),
+        ("codegen", 0, 5),
+        ("remove prints", 5, 4),
+    ]
+    compiler.compile(source)
+    assert [s.name for s in compiler.pass_stats] == ["double", "codegen", "remove prints"]
+
+    compiler = pyndustric.Compiler(opt_level=1, passes=passes)
+    assert compiler.compile(source) == as_masm("set x 2\nprint x\nprintflush message1")
+
+
+@masm_test
+def test_peephole():
+    """
+    set y x
+    op mul z x x
+    sensor %tmp0 container1 @copper
+    ucontrol flag %tmp0 0 0 0 0
+    end
+    op add __pyc_ret z y
+    jump 8 always
+    set @counter __pyc_rc_0
+    """
+    a = +a
+    y = x * 1
+    z = x * x
+    Unit.flag = container1.copper
+
+    def f():
+        return z + y
+
+
+@masm_test
+def test_constant_folding():
+    """
+    set a 482
+    set b -1
+    set c 3
+    set d 2
+    set e 10
+    set f true
+    set g 2
+    op div h 1 0
+    print "yes"
+    printflush message1
+    """
+    a = 60 * 8 + 2
+    b = -7 % 3
+    c = 7 // 2
+    d = 1 << 65
+    e = max(sqrt(16), 5) * 2
+    f = 1 == 1.0000001
+    g = 1 if 0.0000001 else 2
+    h = 1 / 0
+    if 2 > 1:
+        print("yes")
+    else:
+        print("no")
+    while 1 == 2:
+        print("never")
+
+
+@masm_test(opt_level=2)
+def test_propagation():
+    """
+    set x 5
+    set y 10
+    sensor %tmp0 container1 @copper
+    jump 6 lessThanEq %tmp0 10
+    set z 5
+    jump 7 always
+    set z 7
+    print 15
+    printflush message1
+    print z
+    printflush message1
+    """
+    x = 5
+    y = x * 2
+    if container1.copper > y:
+        z = x
+    else:
+        z = 7
+    print(x + y)
+    print(z)
+
+
+@masm_test(opt_level=2)
+def test_propagation_identity():
+    """
+    sensor x container1 @copper
+    set y 1
+    set z 0
+    print x
+    printflush message1
+    set w x
+    """
+    x = container1.copper
+    y = 1
+    z = 0
+    print(x * y + z)
+    w = x - z
+
+
+@masm_test(opt_level=2)
+def test_dead_code():
+    """
+    set x 0
+    set y @time
+    op add z y 1
+    """
+    x = 0
+    if x > 1:
+        print("never")
+    y = Env.time
+
+    def unused(a):
+        return a * 2
+
+    def f(a):
+        return a + 1
+        print("after return")
+
+    z = f(y)
+
+
+@masm_test(opt_level=2)
+def test_jump_threading():
+    """
+    sensor x container1 @copper
+    jump 5 greaterThanEq x 10
+    jump 5 equal x 5
+    op add x x 1
+    jump 2 lessThan x 10
+    jump 9 notEqual x 6
+    print "yes"
+    printflush message1
+    jump 0 always
+    print "no"
+    printflush message1
+    """
+    x = container1.copper
+    while x < 10:
+        if x == 5:
+            break
+        x += 1
+    if x == 6:
+        print("yes")
+    else:
+        print("no")
+
+
+@pytest.mark.skipif(sys.version_info < (3, 10), reason="match requires Python 3.10")
+def test_jump_threading_unreachable():
+    expected = as_masm(
+        """\
+        set i 0
+        read %tmp0 cell1 i
+        jump 9 equal %tmp0 0
+        jump 7 notEqual %tmp0 1
+        print 1
+        printflush message1
+        jump 9 always
+        print 2
+        printflush message1
+        op add i i 1
+        jump 1 lessThan i 4
+        """,
+        stack=False,
+    )
+    masm = pyndustric.Compiler(opt_level=2).compile(
+        """\
+for i in range(4):
+    match Mem.cell1[i]:
+        case 0:
+            continue
+        case 1:
+            print(1)
+        case _:
+            print(2)
+"""
+    )
+    assert _REG_TMP_RE.sub("%tmp0", masm) == expected
+
+
+@masm_test(opt_level=2)
+def test_registers():
+    """
+    sensor %tmp0 container1 @copper
+    sensor %tmp1 container2 @lead
+    op add a %tmp0 %tmp1
+    sensor %tmp0 container1 @sand
+    sensor %tmp1 container2 @coal
+    op mul b %tmp0 %tmp1
+    """
+    a = container1.copper + container2.lead
+    b = container1.sand * container2.coal
+
+
+@masm_test(opt_level=2)
+def test_strength_reduction():
+    """
+    op mul a x x
+    op sqrt b x
+    op mul c x 0.25
+    op idiv d x 8
+    read %tmp0 cell1 0
+    op idiv %tmp0 %tmp0 1
+    op mod i %tmp0 1000
+    op shl e i 2
+    op shr f i 3
+    op mod g i 16
+    op abs n i
+    op and h n 15
+    """
+    a = x**2
+    b = x**0.5
+    c = x / 4
+    d = x // 8
+    i = Mem.cell1[0] // 1 % 1000
+    e = i * 4
+    f = i // 8
+    g = i % 16
+    n = abs(i)
+    h = n % 16
+
+
+@masm_test(opt_level=2)
+def test_strength_reduction_overflow():
+    """
+    set m 5
+    op pow %tmp0 2 m
+    print %tmp0
+    printflush message1
+    op add m m 1
+    jump 1 lessThan m 70
+    set d 6
+    set n 0
+    op mul d d 5
+    op add n n 1
+    jump 8 lessThan n 40
+    op mod %tmp0 d 8
+    print %tmp0
+    printflush message1
+    op idiv %tmp0 d 4
+    print %tmp0
+    printflush message1
+    """
+    # Bitwise operations work on 64-bit integers, which these would overflow.
+    m = 5
+    while m < 70:
+        print(2**m)
+        m += 1
+    d = 6
+    n = 0
+    while n < 40:
+        d *= 5
+        n += 1
+    print(d % 8)
+    print(d // 4)
+
+
+@masm_test(opt_level=2)
+def test_value_numbering():
+    """
+    sensor %tmp0 container1 @copper
+    op mul %tmp1 %tmp0 2
+    op add a %tmp0 %tmp1
+    op mul %tmp0 x y
+    op add b %tmp0 %tmp0
+    control enabled reactor false
+    sensor c container1 @copper
+    read %tmp0 cell1 3
+    op add d %tmp0 %tmp0
+    write d cell1 3
+    read e cell1 3
+    """
+    a = container1.copper + container1.copper * 2
+    b = x * y + y * x
+    reactor.enabled(False)
+    c = container1.copper
+    d = Mem.cell1[3] + Mem.cell1[3]
+    Mem.cell1[3] = d
+    e = Mem.cell1[3]
+
+
+@masm_test(opt_level=2)
+def test_hoist():
+    """
+    set i 0
+    jump 0 greaterThanEq 0 n
+    sensor %tmp0 container1 @itemCapacity
+    op mul %tmp0 %tmp0 n
+    op add %tmp1 %tmp0 i
+    write %tmp1 cell1 i
+    sensor x container1 @copper
+    op add i i 1
+    jump 4 lessThan i n
+    """
+    for i in range(n):
+        Mem.cell1[i] = container1.max_items * n + i
+        x = container1.copper
+
+
+@masm_test(opt_level=2)
+def test_hoist_ips():
+    """
+    set i 0
+    jump 0 greaterThanEq 0 n
+    op mul %tmp0 @ipt 60
+    write %tmp0 cell1 i
+    op add i i 1
+    jump 3 lessThan i n
+    """
+    for i in range(n):
+        Mem.cell1[i] = Env.ips
+
+
+@masm_test(opt_level=2, target="world")
+def test_hoist_ips_set_rate():
+    """
+    set i 0
+    jump 0 greaterThanEq 0 n
+    setrate i
+    op mul %tmp0 @ipt 60
+    write %tmp0 cell1 i
+    op add i i 1
+    jump 2 lessThan i n
+    """
+    # Changing the rate changes `Env.ips`, so it can't move out of the loop.
+    for i in range(n):
+        World.set_rate(i)
+        Mem.cell1[i] = Env.ips
+
+
+@masm_test(opt_level=2)
+def test_induction():
+    """
+    op mul %tmp0 n 4
+    op add %tmp0 %tmp0 2
+    set __pyc_iv_12_0 2
+    jump 0 greaterThanEq 2 %tmp0
+    write 1 cell1 __pyc_iv_12_0
+    op add __pyc_iv_12_0 __pyc_iv_12_0 4
+    jump 4 lessThan __pyc_iv_12_0 %tmp0
+    """
+    for i in range(n):
+        Mem.cell1[i * 4 + 2] = 1
+
+
+@masm_test(opt_level=2)
+def test_unroll():
+    """
+    write 0 cell1 0
+    write 2 cell1 1
+    write 4 cell1 2
+    set i 3
+    """
+    for i in range(3):
+        Mem.cell1[i] = i * 2
+
+
+@masm_test(opt_level=2)
+def test_unroll_assigned():
+    """
+    set i 1
+    print 8
+    printflush message1
+    jump 5 equal a 1
+    op mul i i 3
+    op add i i 2
+    jump 1 lessThan i 6
+    print i
+    printflush message1
+    write 2 cell1 0
+    write 2 cell1 0
+    write 2 cell1 0
+    write 2 cell1 0
+    """
+    # Assigning the iteration variable changes how many times the loop runs, so it stays a loop.
+    for i in range(1, 6, 2):
+        print(8)
+        if a != 1:
+            i *= 3
+    print(i)
+    # The copies don't set a variable nobody reads.
+    for j in range(4):
+        Mem.cell1[0] = 2
+
+
+@masm_test(opt_level=2)
+def test_unroll_partial():
+    """
+    read %tmp0 cell2 0
+    write %tmp0 cell1 0
+    read %tmp0 cell2 1
+    write %tmp0 cell1 1
+    set i 2
+    read %tmp0 cell2 i
+    write %tmp0 cell1 i
+    op add i i 1
+    read %tmp0 cell2 i
+    write %tmp0 cell1 i
+    op add i i 1
+    read %tmp0 cell2 i
+    write %tmp0 cell1 i
+    op add i i 1
+    read %tmp0 cell2 i
+    write %tmp0 cell1 i
+    op add i i 1
+    read %tmp0 cell2 i
+    write %tmp0 cell1 i
+    op add i i 1
+    read %tmp0 cell2 i
+    write %tmp0 cell1 i
+    op add i i 1
+    read %tmp0 cell2 i
+    write %tmp0 cell1 i
+    op add i i 1
+    read %tmp0 cell2 i
+    write %tmp0 cell1 i
+    op add i i 1
+    jump 5 lessThan i 50
+    """
+    for i in range(50):
+        Mem.cell1[i] = Mem.cell2[i]
+
+
 @masm_test
 def test_assignments():
     """
@@ -335,11 +995,13 @@ def test_types():
 @masm_test
 def test_builtin_defs():
     """
-    op abs a 1
-    op min lo 1 2
+    op abs a x
+    op min lo x 2
+    op atan2 t x y
     """
-    a = abs(1)
-    lo = min(1, 2)
+    a = abs(x)
+    lo = min(x, 2)
+    t = atan2(x, y)
 
 
 @masm_test
@@ -370,11 +1032,13 @@ def test_aug_assignments():
 def test_complex_aug_assig():
     """
     set x 1
-    op add %tmp0 1 2
+    op add %tmp0 y 2
     op mul %tmp1 %tmp0 3
     op add x x %tmp1
+    op add x x 9
     """
     x = 1
+    x += (y + 2) * 3
     x += (1 + 2) * 3
 
 
@@ -395,7 +1059,7 @@ def test_if():
 @masm_test
 def test_ternary():
     """
-    op mod %tmp0 5 1
+    op mod %tmp0 x 1
     jump 5 notEqual %tmp0 0
     set %tmp1 true
     jump 6 always
@@ -404,8 +1068,10 @@ def test_ternary():
     set a @titanium
     jump 10 always
     set a @thorium
+    set b @titanium
     """
-    a = Env.titanium if (True if 5 % 1 == 0 else False) else Env.thorium
+    a = Env.titanium if (True if x % 1 == 0 else False) else Env.thorium
+    b = Env.titanium if (True if 5 % 1 == 0 else False) else Env.thorium
 
 
 @masm_test
@@ -459,6 +1125,149 @@ def test_if_elif_else():
         y = 3
 
 
+@masm_test(opt_level=2)
+def test_if_jump_table():
+    """
+    jump 16 lessThan state 1
+    jump 16 greaterThan state 4
+    op floor %tmp0 state
+    jump 16 notEqual %tmp0 state
+    op sub %tmp0 state 1
+    op add @counter @counter %tmp0
+    jump 10 always
+    jump 12 always
+    jump 14 always
+    jump 12 always
+    set x 1
+    jump 0 always
+    set x 2
+    jump 0 always
+    set x 3
+    jump 0 always
+    jump 0 equal ready 0
+    set x 4
+    """
+    if state == 1:
+        x = 1
+    elif state == 2 or state == 4:
+        x = 2
+    elif state == 3:
+        x = 3
+    elif ready:
+        x = 4
+
+
+@masm_test(opt_level=2)
+def test_if_jump_table_integer():
+    """
+    read %tmp0 cell1 0
+    op idiv state %tmp0 1
+    jump 17 lessThan state 0
+    jump 17 greaterThan state 3
+    op add @counter @counter state
+    jump 9 always
+    jump 11 always
+    jump 13 always
+    jump 15 always
+    set x 1
+    jump 0 always
+    set x 2
+    jump 0 always
+    set x 3
+    jump 0 always
+    set x 4
+    jump 0 always
+    set x 0
+    """
+    state = Mem.cell1[0] // 1
+    if state == 0:
+        x = 1
+    elif state == 1:
+        x = 2
+    elif state == 2:
+        x = 3
+    elif state == 3:
+        x = 4
+    else:
+        x = 0
+
+
+@pytest.mark.skipif(sys.version_info < (3, 10), reason="match requires Python 3.10")
+def test_match():
+    expected = as_masm(
+        """\
+        jump 18 lessThan state 0
+        jump 18 greaterThan state 5
+        op floor %tmp0 state
+        jump 18 notEqual %tmp0 state
+        op add @counter @counter state
+        jump 12 always
+        jump 14 always
+        jump 14 always
+        jump 18 always
+        jump 16 always
+        jump 16 always
+        set x 1
+        jump 19 always
+        set x 2
+        jump 19 always
+        set x 3
+        jump 19 always
+        set x 0
+        jump 22 equal name "a"
+        jump 24 equal name "b"
+        jump 25 always
+        set y 1
+        jump 25 always
+        set y 2
+        """
+    )
+    masm = pyndustric.Compiler().compile(
+        """\
+match state:
+    case 0:
+        x = 1
+    case 1 | 2:
+        x = 2
+    case 4 | 5:
+        x = 3
+    case _:
+        x = 0
+match name:
+    case "a":
+        y = 1
+    case "b":
+        y = 2
+"""
+    )
+    assert _REG_TMP_RE.sub("%tmp0", masm) == expected
+
+
+@masm_test
+def test_min_max():
+    """
+    op min a x 10
+    op min b y 0
+    """
+    a = x if x < 10 else 10
+    b = 0 if y >= 0 else y
+
+
+@masm_test(mlog_version=8)
+def test_select():
+    """
+    select a notEqual ready 0 1 2
+    select b equal y z x w
+    jump 6 equal y 0
+    op add c x 1
+    jump 7 always
+    set c 0
+    """
+    a = 1 if ready else 2
+    b = x if y == z else w
+    c = x + 1 if y else 0
+
+
 @masm_test
 def test_while():
     """
@@ -474,14 +1283,41 @@ def test_while():
     z = 1
 
 
+def test_main_loop():
+    def source():
+        while True:
+            level = container1.copper
+            if level < 100:
+                continue
+            print(level)
+
+    # The program starts over once it runs off its last line, without a jump or `end`.
+    masm = pyndustric.Compiler(opt_level=2).compile(source)
+    assert (
+        masm
+        == as_masm(
+            """
+        sensor level container1 @copper
+        jump 0 lessThan level 100
+        print level
+        printflush message1
+        """,
+            stack=False,
+        ).replace("end\n", "")
+    )
+
+    # Anything running before the loop must only run once, so it still jumps back.
+    masm = pyndustric.Compiler().compile("level = 0\nwhile True:\n    level += 1")
+    assert masm == as_masm("set level 0\nop add level level 1\njump 2 always")
+
+
 @masm_test
 def test_for_end():
     """
     set x 0
-    jump 6 greaterThanEq x 10
     op add y x x
     op add x x 1
-    jump 2 always
+    jump 2 lessThan x 10
     set z 1
     """
     for x in range(10):
@@ -493,10 +1329,9 @@ def test_for_end():
 def test_for_start_end():
     """
     set x 5
-    jump 6 greaterThanEq x 10
     op add y x x
     op add x x 1
-    jump 2 always
+    jump 2 lessThan x 10
     """
     for x in range(5, 10):
         y = x + x
@@ -506,10 +1341,9 @@ def test_for_start_end():
 def test_for_start_end_step():
     """
     set x 0
-    jump 6 greaterThanEq x 10
     op add y x x
     op add x x 3
-    jump 2 always
+    jump 2 lessThan x 10
     """
     for x in range(0, 10, 3):
         y = x + x
@@ -519,10 +1353,9 @@ def test_for_start_end_step():
 def test_for_negative():
     """
     set x 10
-    jump 6 lessThanEq x 0
     op add y x x
     op add x x -1
-    jump 2 always
+    jump 2 greaterThan x 0
     """
     for x in range(10, 0, -1):
         y = x + x
@@ -539,11 +1372,10 @@ def test_break():
     jump 3 notEqual x 0
     set z 1
     set x 0
-    jump 14 greaterThanEq x 10
-    jump 12 notEqual x 5
-    jump 14 always
+    jump 11 notEqual x 5
+    jump 13 always
     op add x x 1
-    jump 9 always
+    jump 9 lessThan x 10
     set z 1
     """
     x = 10
@@ -603,17 +1435,16 @@ def test_continue():
     jump 9 equal x 0
     op sub x x 1
     jump 7 notEqual x 5
-    jump 4 always
+    jump 8 always
     op add a a 1
     jump 4 notEqual x 0
     set b 0
     set x 0
-    jump 17 greaterThanEq x 10
-    jump 14 notEqual x 5
-    jump 15 always
+    jump 13 notEqual x 5
+    jump 14 always
     op add b b 1
     op add x x 1
-    jump 11 always
+    jump 11 lessThan x 10
     """
     a = 0
     x = 10
@@ -642,11 +1473,11 @@ def test_nested_continue():
     jump 13 equal j 0
     op sub j j 1
     jump 11 notEqual j 5
-    jump 8 always
+    jump 12 always
     op add b b 1
     jump 8 notEqual j 0
     jump 15 notEqual i 5
-    jump 5 always
+    jump 16 always
     op add a a 1
     jump 5 notEqual i 0
     """
@@ -668,34 +1499,28 @@ def test_nested_continue():
 
 @masm_test
 def test_def():
-    # TODO cells can't store strings, test that no fn args are
     """
-    jump 12 always
-    read __pyc_rc_0 cell1 __pyc_sp
-    op sub __pyc_sp __pyc_sp 1
-    read n cell1 __pyc_sp
-    jump 9 greaterThanEq n 10
-    set __pyc_ret true
-    jump 11 always
-    jump 11 always
-    set __pyc_ret false
-    jump 11 always
-    op add @counter __pyc_rc_0 1
-    write 5 cell1 __pyc_sp
-    op add __pyc_sp __pyc_sp 1
-    write @counter cell1 __pyc_sp
-    jump 2 always
+    set __pyc_small_n 5
+    op add __pyc_rc_0 @counter 1
+    jump 15 always
     set a __pyc_ret
-    write 15 cell1 __pyc_sp
-    op add __pyc_sp __pyc_sp 1
-    write @counter cell1 __pyc_sp
-    jump 2 always
+    set __pyc_small_n 15
+    op add __pyc_rc_0 @counter 1
+    jump 15 always
     set b __pyc_ret
     print "5 small? "
     print a
     print ", 15 small? "
     print b
     printflush message1
+    end
+    jump 19 greaterThanEq __pyc_small_n 10
+    set __pyc_ret true
+    jump 21 always
+    jump 21 always
+    set __pyc_ret false
+    jump 21 always
+    set @counter __pyc_rc_0
     """
 
     def small(n):
@@ -710,26 +1535,115 @@ def test_def():
 
 
 @masm_test
-def test_multi_call():
+def test_def_locals():
     """
-    jump 8 always
-    read __pyc_rc_0 cell1 __pyc_sp
-    op sub __pyc_sp __pyc_sp 1
-    read i cell1 __pyc_sp
-    set __pyc_ret i
-    jump 7 always
-    op add @counter __pyc_rc_0 1
-    write 1 cell1 __pyc_sp
+    set y 1
+    set __pyc_f_x y
+    op add __pyc_rc_0 @counter 1
+    jump 6 always
+    end
+    op add total total __pyc_f_x
+    op mul __pyc_f_y __pyc_f_x 2
+    set x __pyc_f_y
+    jump 10 always
+    set @counter __pyc_rc_0
+    """
+
+    def f(x):
+        global total
+        total += x
+        y = x * 2
+        return y
+
+    y = 1
+    x = f(y)
+
+
+@masm_test
+def test_def_recursive():
+    """
+    set __pyc_fact_n 5
+    op add __pyc_rc_0 @counter 1
+    jump 6 always
+    set x __pyc_ret
+    end
+    jump 9 greaterThan __pyc_fact_n 1
+    set __pyc_ret 1
+    jump 23 always
+    op sub %tmp0 __pyc_fact_n 1
+    write __pyc_rc_0 cell1 __pyc_sp
     op add __pyc_sp __pyc_sp 1
-    write @counter cell1 __pyc_sp
-    jump 2 always
-    set %tmp0 __pyc_ret
-    write 2 cell1 __pyc_sp
+    write __pyc_fact_n cell1 __pyc_sp
     op add __pyc_sp __pyc_sp 1
-    write @counter cell1 __pyc_sp
-    jump 2 always
-    set %tmp1 __pyc_ret
-    op add x %tmp0 %tmp1
+    set __pyc_fact_n %tmp0
+    op add __pyc_rc_0 @counter 1
+    jump 6 always
+    op sub __pyc_sp __pyc_sp 1
+    read __pyc_fact_n cell1 __pyc_sp
+    op sub __pyc_sp __pyc_sp 1
+    read __pyc_rc_0 cell1 __pyc_sp
+    op mul __pyc_ret __pyc_fact_n __pyc_ret
+    jump 23 always
+    set @counter __pyc_rc_0
+    """
+
+    def fact(n):
+        if n <= 1:
+            return 1
+        return n * fact(n - 1)
+
+    x = fact(5)
+
+
+@masm_test
+def test_def_tail_call():
+    """
+    set __pyc_count_n 3
+    set __pyc_count_total 0
+    op add __pyc_rc_1 @counter 1
+    jump 9 always
+    end
+    op mul x __pyc_double_n 2
+    jump 8 always
+    set @counter __pyc_rc_0
+    jump 13 greaterThan __pyc_count_n 0
+    set __pyc_double_n __pyc_count_total
+    set __pyc_rc_0 __pyc_rc_1
+    jump 6 always
+    op sub %tmp0 __pyc_count_n 1
+    op add %tmp1 __pyc_count_total __pyc_count_n
+    set __pyc_count_n %tmp0
+    set __pyc_count_total %tmp1
+    jump 9 always
+    set @counter __pyc_rc_1
+    """
+
+    def double(n):
+        return n * 2
+
+    def count(n, total):
+        if n <= 0:
+            return double(total)
+        return count(n - 1, total + n)
+
+    x = count(3, 0)
+
+
+@masm_test
+def test_multi_call():
+    """
+    set __pyc_f_i 1
+    op add __pyc_rc_0 @counter 1
+    jump 10 always
+    set %tmp0 __pyc_ret
+    set __pyc_f_i 2
+    op add __pyc_rc_0 @counter 1
+    jump 10 always
+    op add x %tmp0 __pyc_ret
+    end
+    set __pyc_ret __pyc_f_i
+    jump 12 always
+    set @counter __pyc_rc_0
     """
 
     def f(i):
@@ -741,22 +1655,14 @@ def test_multi_call():
 @masm_test
 def test_multiarg_call():
     """
-    jump 10 always
-    read __pyc_rc_0 cell1 __pyc_sp
-    op sub __pyc_sp __pyc_sp 1
-    read y cell1 __pyc_sp
-    op sub __pyc_sp __pyc_sp 1
-    read x cell1 __pyc_sp
-    set __pyc_ret y
-    jump 9 always
-    op add @counter __pyc_rc_0 1
-    write 4 cell1 __pyc_sp
-    op add __pyc_sp __pyc_sp 1
-    write 2 cell1 __pyc_sp
-    op add __pyc_sp __pyc_sp 1
-    write @counter cell1 __pyc_sp
-    jump 2 always
-    set %tmp0 __pyc_ret
+    set __pyc_dot_x 4
+    set __pyc_dot_y 2
+    op add __pyc_rc_0 @counter 1
+    jump 6 always
+    end
+    set __pyc_ret __pyc_dot_y
+    jump 8 always
+    set @counter __pyc_rc_0
     """
 
     def dot(x, y):
@@ -768,21 +1674,14 @@ def test_multiarg_call():
 @masm_test
 def test_complex_call():
     """
+    set __pyc_f_i 5
+    op add __pyc_rc_0 @counter 1
+    jump 6 always
+    op add x __pyc_ret 4
+    end
+    set __pyc_ret __pyc_f_i
     jump 8 always
-    read __pyc_rc_0 cell1 __pyc_sp
-    op sub __pyc_sp __pyc_sp 1
-    read i cell1 __pyc_sp
-    set __pyc_ret i
-    jump 7 always
-    op add @counter __pyc_rc_0 1
-    op add %tmp0 2 3
-    write %tmp0 cell1 __pyc_sp
-    op add __pyc_sp __pyc_sp 1
-    write @counter cell1 __pyc_sp
-    jump 2 always
-    set %tmp1 __pyc_ret
-    op mul %tmp2 1 %tmp1
-    op add x %tmp2 4
+    set @counter __pyc_rc_0
     """
 
     def f(i):
@@ -793,16 +1692,13 @@ def test_complex_call():
 
 @masm_test
 def test_def_sideeffects():
-    # TODO detect this unnecessary use of %tmp0 and optimize it away
     """
-    jump 6 always
-    read __pyc_rc_0 cell1 __pyc_sp
+    op add __pyc_rc_0 @counter 1
+    jump 4 always
+    end
     print "bar"
     printflush message1
-    op add @counter __pyc_rc_0 1
-    write @counter cell1 __pyc_sp
-    jump 2 always
-    set %tmp0 __pyc_ret
+    set @counter __pyc_rc_0
     """
 
     def foo():
@@ -813,26 +1709,19 @@ def test_def_sideeffects():
 
 @masm_test
 def test_def_call_as_call_arg():
-    # TODO detect this unnecessary use of %tmp0 and optimize it away
     """
+    set __pyc_square_n 2
+    op add __pyc_rc_0 @counter 1
+    jump 9 always
+    set __pyc_square_n __pyc_ret
+    op add __pyc_rc_0 @counter 1
     jump 9 always
-    read __pyc_rc_0 cell1 __pyc_sp
-    op sub __pyc_sp __pyc_sp 1
-    read n cell1 __pyc_sp
-    op pow n n 2
-    set __pyc_ret n
-    jump 8 always
-    op add @counter __pyc_rc_0 1
-    write 2 cell1 __pyc_sp
-    op add __pyc_sp __pyc_sp 1
-    write @counter cell1 __pyc_sp
-    jump 2 always
-    set %tmp0 __pyc_ret
-    write %tmp0 cell1 __pyc_sp
-    op add __pyc_sp __pyc_sp 1
-    write @counter cell1 __pyc_sp
-    jump 2 always
     set r __pyc_ret
+    end
+    op pow __pyc_square_n __pyc_square_n 2
+    set __pyc_ret __pyc_square_n
+    jump 12 always
+    set @counter __pyc_rc_0
     """
 
     def square(n):
@@ -887,7 +1776,7 @@ def test_env():
     jump 16 greaterThanEq __pyc_it_30_16 @links
     getlink link __pyc_it_30_16
     op add __pyc_it_30_16 __pyc_it_30_16 1
-    jump 12 always
+    jump 13 lessThan __pyc_it_30_16 @links
     """
     cop = Env.copper
     this = Env.this
@@ -937,7 +1826,7 @@ def test_sensor_special_names():
     health = duo1.health / duo1.max_health
 
 
-@masm_test
+@masm_test(target="world")
 def test_world_setblock():
     """
     setrate 6000
@@ -947,9 +1836,9 @@ def test_world_setblock():
     jump 9 greaterThanEq y @maph
     setblock block @router x y @sharded 0
     op add y y 1
-    jump 5 always
+    jump 6 lessThan y @maph
     op add x x 1
-    jump 3 always
+    jump 4 lessThan x @mapw
     """
     World.set_rate(6000)
     for x in range(Env.width):
@@ -1118,7 +2007,6 @@ def test_memory():
     write 1 cell1 0
     write 1 cell1 1
     set i 2
-    jump 13 greaterThanEq i 64
     op sub %tmp0 i 2
     read %tmp1 cell1 %tmp0
     op sub %tmp2 i 1
@@ -1126,7 +2014,7 @@ def test_memory():
     op add %tmp4 %tmp1 %tmp3
     write %tmp4 cell1 i
     op add i i 1
-    jump 4 always
+    jump 4 lessThan i 64
     read %tmp5 cell1 63
     print %tmp5
     printflush message1
@@ -1140,7 +2028,7 @@ def test_memory():
     print(Mem.cell1[63])
 
 
-@masm_test
+@masm_test(target="world")
 def test_world_general():
     """
     setrate 4000
@@ -1222,22 +2110,41 @@ def control_config():
 @masm_test
 def test_complex_compare():
     """
-    op lessThan a 1 2
-    op lessThan a a 3
-    op lessThan a a 4
-    op lessThan a a 5
-    op lessThan a a 6
-    op lessThan a a 7
-    op lessThan a a 8
-    op lessThan a a 9
-    op lessThan a a 10
-    op lessThan a a 11
-    op lessThan a a 12
-    op lessThan a a 13
-    op lessThan a a 14
-    op lessThan a a 15
-    """
-    a = 1 < 2 < 3 < 4 < 5 < 6 < 7 < 8 < 9 < 10 < 11 < 12 < 13 < 14 < 15
+    set a false
+    jump 4 greaterThanEq x 2
+    set a true
+    set b true
+    """
+    a = x < 2 < 3 < 4 < 5 < 6 < 7 < 8 < 9 < 10 < 11 < 12 < 13 < 14 < 15
+    b = 1 < 2 < 3 < 4 < 5 < 6 < 7 < 8 < 9 < 10 < 11 < 12 < 13 < 14 < 15
+
+
+@masm_test
+def test_short_circuit():
+    """
+    jump 6 equal a 0
+    jump 6 equal b 0
+    jump 6 notEqual c 0
+    print "all"
+    printflush message1
+    jump 12 equal x 3
+    jump 12 equal x 5
+    jump 12 greaterThanEq 0 y
+    jump 12 greaterThan y 10
+    print "between"
+    printflush message1
+    set ok false
+    jump 15 notEqual a 0
+    jump 16 lessThanEq b 1
+    set ok true
+    op greaterThanEq no a b
+    """
+    if a and b and not c:
+        print("all")
+    if not (x == 3 or x == 5) and 0 < y <= 10:
+        print("between")
+    ok = a or b > 1
+    no = not a < b
 
 
 @masm_test